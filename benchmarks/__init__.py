@@ -0,0 +1,13 @@
+"""
+Benchmarks for the chimera query and distance pipelines, on the bundled sample data and on synthetic inputs
+obtained by scaling it up.
+
+Benchmarks are written in the style of asv (https://asv.readthedocs.io) - classes with (optional) 'params', a 'setup'
+method and 'time_*' methods - so they can be run with 'asv run' (see asv.conf.json), or without any extra dependencies
+with:
+
+    python -m benchmarks.run [--save benchmarks/baseline.json] [--compare benchmarks/baseline.json]
+
+Each benchmark class also declares a 'unit' (e.g. 'sequence' or 'atom pair'), and sets 'n' (the no. of units processed
+by each timed call) in 'setup', so that the runner reports throughput as well as timings.
+"""
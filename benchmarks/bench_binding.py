@@ -0,0 +1,47 @@
+import pandas as pd
+
+from chimera.core.binding import BindingFrequencyArray, unpivot_binding_frequencies
+
+from .common import binding_frequency_records
+
+
+class ParseBindingFrequencies:
+    unit = 'record'
+
+    def setup(self):
+        self.df = binding_frequency_records()
+        self.n = len(self.df)
+
+    def time_binding_frequency_array(self):
+        BindingFrequencyArray(self.df['binding_frequencies'])
+
+    def time_split(self):
+        # How binding frequencies were parsed before BindingFrequencyArray, one record at a time
+        for _, row in self.df.iterrows():
+            list(map(float, row.binding_frequencies.split(',')))
+
+
+class UnpivotBindingFrequencies:
+    unit = 'record'
+
+    def setup(self):
+        self.df = binding_frequency_records()
+        self.binding_frequencies = BindingFrequencyArray(self.df['binding_frequencies'])
+        self.n = len(self.df)
+
+    def time_unpivot_binding_frequencies(self):
+        unpivot_binding_frequencies(self.df, self.binding_frequencies)
+
+    def time_iterrows(self):
+        # How unpivoted tables were built before unpivot_binding_frequencies (see scripts/create_binding_freq_files.py)
+        l = []
+        for pfam_id, _df in self.df.groupby('pfam_id'):
+            for _, row in _df.iterrows():
+                for i, bf in enumerate(map(float, row.binding_frequencies.split(',')), start=1):
+                    l.append({
+                        'pfam_id': pfam_id,
+                        'match_state': i,
+                        'ligand_type': row.ligand_type,
+                        'binding_frequency': bf
+                    })
+        pd.DataFrame(l)
@@ -0,0 +1,71 @@
+import os
+import shutil
+from importlib.resources import path
+from tempfile import mkdtemp
+import chimera.data.sample.ligand
+import chimera.data.sample.receptor
+from chimera.distance import create_distance_file, create_fasta, create_fastas, overlap_table
+
+from .common import scaled_distance_df
+
+
+class CreateDistanceFile:
+    # The (legacy) 'quad' overlap method takes tens of seconds per structure, and is left out
+    params = ([1, 4], ['analytic', 'table'])
+    param_names = ['scale', 'overlap_method']
+    unit = 'atom pair'
+
+    def setup(self, scale, overlap_method):
+        self.tmp_dir = mkdtemp()
+        with path(chimera.data.sample.receptor, '2lueA.pdb') as receptor_path, \
+                path(chimera.data.sample.ligand, '2lue_III_B_1.pdb') as ligand_path:
+            receptor_path = shutil.copy(receptor_path, self.tmp_dir)
+            ligand_path = shutil.copy(ligand_path, self.tmp_dir)
+
+        # The same receptor/ligand pair is processed <scale> times, under different chain names
+        self.kwargs = dict(
+            pdb_id='2lue',
+            pdb_chains=[f'A{i}' for i in range(scale)],
+            receptor_filepaths=[receptor_path] * scale,
+            ligand_ids=['III'] * scale,
+            ligand_filepaths=[ligand_path] * scale,
+            distance_filepath=os.path.join(self.tmp_dir, 'distances.txt'),
+            compressed=False,
+            overlap_method=overlap_method
+        )
+        # Parse structures and populate overlap tables outside of the timed calls
+        self.n = len(create_distance_file(**self.kwargs))
+        overlap_table()
+
+    def teardown(self, scale, overlap_method):
+        shutil.rmtree(self.tmp_dir)
+
+    def time_create_distance_file(self, scale, overlap_method):
+        create_distance_file(**self.kwargs)
+
+
+class CreateFasta:
+    params = [1, 10]
+    param_names = ['scale']
+    unit = 'atom pair'
+
+    def setup(self, scale):
+        self.tmp_dir = mkdtemp()
+        with path(chimera.data.sample.receptor, '2lueA.pdb') as receptor_path, \
+                path(chimera.data.sample.ligand, '2lue_III_B_1.pdb') as ligand_path:
+            df = create_distance_file(
+                pdb_id='2lue', pdb_chains=['A'], receptor_filepaths=[receptor_path], ligand_ids=['III'],
+                ligand_filepaths=[ligand_path], distance_filepath=os.path.join(self.tmp_dir, 'distances.txt'),
+                compressed=False, overlap_method='analytic'
+            )
+        self.df = scaled_distance_df(df, scale)
+        self.n = len(self.df)
+
+    def teardown(self, scale):
+        shutil.rmtree(self.tmp_dir)
+
+    def time_create_fasta(self, scale):
+        create_fasta(self.df, os.path.join(self.tmp_dir, 'maxstd.fa'), distance='maxstd')
+
+    def time_create_fastas(self, scale):
+        create_fastas(self.df, os.path.join(self.tmp_dir, '{distance}.fa'))
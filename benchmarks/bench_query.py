@@ -0,0 +1,83 @@
+from chimera.core import seq_to_matchstates, seqs_to_matchstates, domain_binding_frequencies
+from chimera.plots import binding_freq_plot_data_sequence, binding_freq_plot_data_sequences
+
+from .common import RecordedDomainFinder, ctcf, ctcf_hits, ctcf_sequences, synthetic_alignments, \
+    require_binding_frequencies
+
+
+class SeqsToMatchStates:
+    params = [1, 100, 10000]
+    param_names = ['n_sequences']
+    unit = 'sequence'
+
+    def setup(self, n_sequences):
+        self.seqs, self.starts, self.ends = synthetic_alignments(n_sequences)
+        self.n = n_sequences
+
+    def time_seqs_to_matchstates(self, n_sequences):
+        seqs_to_matchstates(self.seqs, self.starts, self.ends)
+
+    def time_seq_to_matchstates(self, n_sequences):
+        for seq, start, end in zip(self.seqs, self.starts, self.ends):
+            seq_to_matchstates(seq, start, end)
+
+
+class DomainTable:
+    params = [1, 100, 10000]
+    param_names = ['n_sequences']
+    unit = 'sequence'
+
+    def setup(self, n_sequences):
+        self.domain_finder = RecordedDomainFinder(ctcf_hits())
+        self.sequences = ctcf_sequences(n_sequences)
+        self.n = n_sequences
+
+    def time_domain_table(self, n_sequences):
+        self.domain_finder.domain_table(self.sequences)
+
+
+class DomainBindingFrequencies:
+    # The 'merge' step of chimera.core.query, i.e. everything after the domain search
+    params = ([1, 100, 1000], ['dsprint', 'interacdome'])
+    param_names = ['n_sequences', 'algorithm']
+    unit = 'sequence'
+
+    def setup(self, n_sequences, algorithm):
+        require_binding_frequencies(algorithm)
+        self.domains = RecordedDomainFinder(ctcf_hits()).domain_table(ctcf_sequences(n_sequences))
+        self.n = n_sequences
+
+    def time_domain_binding_frequencies(self, n_sequences, algorithm):
+        domain_binding_frequencies(self.domains.copy(), algorithm=algorithm)
+
+
+class BindingFreqPlotDataSequence:
+    params = ['dsprint', 'interacdome']
+    param_names = ['algorithm']
+    unit = 'sequence'
+
+    def setup(self, algorithm):
+        require_binding_frequencies(algorithm)
+        self.domains = RecordedDomainFinder(ctcf_hits()).domain_table([ctcf])
+        self.df = domain_binding_frequencies(self.domains, algorithm=algorithm)
+        self.seq = str(ctcf.seq)
+        self.n = 1
+
+    def time_binding_freq_plot_data_sequence(self, algorithm):
+        binding_freq_plot_data_sequence(self.seq, self.domains, self.df)
+
+
+class BindingFreqPlotDataSequences:
+    params = ([5, 50], ['dsprint', 'interacdome'])
+    param_names = ['n_sequences', 'algorithm']
+    unit = 'sequence'
+
+    def setup(self, n_sequences, algorithm):
+        require_binding_frequencies(algorithm)
+        self.sequences = ctcf_sequences(n_sequences)
+        self.domains = RecordedDomainFinder(ctcf_hits()).domain_table(self.sequences)
+        self.df = domain_binding_frequencies(self.domains, algorithm=algorithm)
+        self.n = n_sequences
+
+    def time_binding_freq_plot_data_sequences(self, n_sequences, algorithm):
+        binding_freq_plot_data_sequences(self.sequences, self.domains, self.df)
@@ -0,0 +1,132 @@
+import os
+import json
+from importlib.resources import read_text
+import numpy as np
+import pandas as pd
+from Bio.SeqRecord import SeqRecord
+
+import chimera
+from chimera.utils import parse_fasta
+from chimera.core.domain import DomainFinder
+from chimera.core.domain.hmmerweb import HmmerWebDomainFinder
+
+# A Hmmer Web response for CTCF, as recorded for tests
+CTCF_RESPONSE_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'hmmr_ctcf_results.json')
+
+ctcf = parse_fasta(read_text('chimera.data.sample', 'ctcf.fa'))[0]
+globins = parse_fasta(read_text('chimera.data.sample', 'globins45.fa'))
+
+
+class RecordedDomainFinder(DomainFinder):
+    """
+    A DomainFinder that finds the same (recorded) hits for every sequence, so that benchmarks of downstream steps
+    don't depend on (or time) an actual domain search.
+    """
+
+    algorithm = 'recorded'
+
+    def __init__(self, hits):
+        """
+        :param hits: A list of dicts (see DomainFinder._iter_domains), without the 'query_id' key
+        """
+        super().__init__()
+        self.cache = None  # Recorded hits are never cached
+        self.hits = hits
+
+    def _iter_domains(self, sequences):
+        for sequence in sequences:
+            for hit in self.hits:
+                yield dict(query_id=sequence.name, **hit)
+
+
+class _ReplayingHmmerWebDomainFinder(HmmerWebDomainFinder):
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+    def _post(self, sequence):
+        return self.response
+
+
+def require_binding_frequencies(algorithm):
+    """
+    Load binding frequency data for an algorithm (outside of timed calls), skipping the benchmark if the data is
+    not available.
+    :param algorithm: Ligand-binding algorithm, e.g. 'dsprint'
+    :return: None
+    """
+    try:
+        getattr(chimera, f'binding_frequencies_{algorithm}_index')
+    except FileNotFoundError:
+        # As in asv, raising NotImplementedError in setup skips a benchmark
+        raise NotImplementedError(f'Binding frequency data for {algorithm} not found')
+
+
+def ctcf_hits():
+    """
+    Get the hits for CTCF from its recorded Hmmer Web response
+    :return: A list of dicts (see DomainFinder._iter_domains), without the 'query_id' key
+    """
+    with open(CTCF_RESPONSE_PATH) as f:
+        response = json.load(f)
+    return [{k: v for k, v in hit.items() if k != 'query_id'}
+            for hit in _ReplayingHmmerWebDomainFinder(response).find_domains([ctcf])]
+
+
+def ctcf_sequences(n):
+    """
+    Get copies of the CTCF sequence
+    :param n: No. of copies
+    :return: A list of Bio.SeqRecord.SeqRecord objects, with distinct names
+    """
+    return [SeqRecord(ctcf.seq, id=f'ctcf_{i}', name=f'ctcf_{i}') for i in range(n)]
+
+
+def synthetic_alignments(n, seed=0):
+    """
+    Get synthetic aligned sequences (see chimera.core.seqs_to_matchstates), derived from the globins45 sequences,
+    with ~5% of positions turned into insertions (lowercase) and ~5% of positions followed by deletions ('-')
+    :param n: No. of aligned sequences
+    :param seed: Random seed
+    :return: A 3-tuple of lists of aligned sequences, start positions and end positions
+    """
+    rng = np.random.default_rng(seed)
+    seqs, starts, ends = [], [], []
+    for i in range(n):
+        seq = str(globins[i % len(globins)].seq)
+        r = rng.random(len(seq))
+        seqs.append(''.join(
+            c.lower() if x < 0.05 else c + '-' if x > 0.95 else c for c, x in zip(seq, r)
+        ))
+        starts.append(1)
+        ends.append(len(seq))
+    return seqs, starts, ends
+
+
+def scaled_distance_df(df, scale):
+    """
+    Scale up a distance DataFrame by replicating its chains
+    :param df: A distance DataFrame, as returned by create_distance_file
+    :param scale: No. of copies of each chain
+    :return: A distance DataFrame
+    """
+    dfs = []
+    for i in range(scale):
+        _df = df.copy()
+        _df['pdbID-pdbChain'] = _df['pdbID-pdbChain'].astype(str) + str(i)
+        dfs.append(_df)
+    return pd.concat(dfs, ignore_index=True)
+
+
+def binding_frequency_records():
+    """
+    Get binding frequency records (as in interacdome_fordownload.tsv, with comma-separated binding frequencies),
+    re-pivoted from the unpivoted InteracDome table shipped with the package
+    :return: A DataFrame with columns pfam_id, ligand_type, domain_length, binding_frequencies
+    """
+    require_binding_frequencies('interacdome')
+    df = chimera.binding_frequencies_interacdome.sort_values(['pfam_id', 'ligand_type', 'match_state'])
+    groups = df.groupby(['pfam_id', 'ligand_type'], sort=False)['binding_frequency']
+    records = groups.agg(lambda x: ','.join(map(str, x))).rename('binding_frequencies').reset_index()
+    records['domain_length'] = groups.size().values
+    return records
@@ -0,0 +1,140 @@
+"""
+A minimal runner for the (asv-style) benchmarks in this package, that doesn't need asv to be installed.
+
+    python -m benchmarks.run                                    # Run all benchmarks
+    python -m benchmarks.run -k DomainTable                     # Run benchmarks whose name contains 'DomainTable'
+    python -m benchmarks.run --save benchmarks/baseline.json    # Record a baseline
+    python -m benchmarks.run --compare benchmarks/baseline.json # Compare against a recorded baseline
+
+Each benchmark is timed as the best of several repeats. When comparing against a baseline, benchmarks that are slower
+than the baseline by more than the given factor are reported as regressions (and the exit code is non-zero).
+"""
+import sys
+import json
+import inspect
+import logging
+import argparse
+import importlib
+import itertools
+import platform
+import pkgutil
+import timeit
+
+import benchmarks
+
+
+def _benchmark_classes():
+    for module_info in pkgutil.iter_modules(benchmarks.__path__):
+        if module_info.name.startswith('bench_'):
+            module = importlib.import_module(f'benchmarks.{module_info.name}')
+            for _, cls in inspect.getmembers(module, inspect.isclass):
+                if cls.__module__ == module.__name__:
+                    yield module_info.name, cls
+
+
+def _param_combinations(cls):
+    params = getattr(cls, 'params', [])
+    if not params:
+        return [()]
+    # As in asv, a single list of params is shorthand for a list with one list of params
+    if not isinstance(params, tuple) and not isinstance(params[0], (list, tuple)):
+        params = [params]
+    return list(itertools.product(*params))
+
+
+def _time(f, repeat, min_time):
+    # Calibrate the no. of calls per repeat so that each repeat takes at least min_time seconds
+    timer = timeit.Timer(f)
+    number, elapsed = timer.autorange() if min_time > 0.2 else (1, timer.timeit(1))
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(pattern=None, repeat=3, min_time=0.1):
+    """
+    Run benchmarks
+    :param pattern: Only run benchmarks whose name (<module>.<class>.<method>) contains this string
+    :param repeat: No. of repeats of each timing
+    :param min_time: Minimum time (in seconds) of each repeat
+    :return: A dict mapping <benchmark_name> => {'time': <seconds_per_call>, 'throughput': <units_per_second>,
+        'unit': <unit>}, with benchmark names of the form <module>.<class>.<method>(<params>)
+    """
+    results = {}
+    for module_name, cls in _benchmark_classes():
+        methods = [name for name, _ in inspect.getmembers(cls, inspect.isfunction) if name.startswith('time_')]
+        methods = [m for m in methods if pattern is None or pattern in f'{module_name}.{cls.__name__}.{m}']
+        if not methods:
+            continue
+
+        for params in _param_combinations(cls):
+            benchmark = cls()
+            if hasattr(benchmark, 'setup'):
+                try:
+                    benchmark.setup(*params)
+                except NotImplementedError as e:
+                    # As in asv, raising NotImplementedError in setup skips a benchmark
+                    print(f'Skipping {module_name}.{cls.__name__}({", ".join(map(str, params))}): {e}', flush=True)
+                    continue
+            try:
+                for method in methods:
+                    name = f'{module_name}.{cls.__name__}.{method}({", ".join(map(str, params))})'
+                    t = _time(lambda: getattr(benchmark, method)(*params), repeat=repeat, min_time=min_time)
+                    n = getattr(benchmark, 'n', None)
+                    results[name] = {
+                        'time': t,
+                        'throughput': None if n is None else n / t,
+                        'unit': getattr(benchmark, 'unit', None)
+                    }
+                    print(_format(name, results[name]), flush=True)
+            finally:
+                if hasattr(benchmark, 'teardown'):
+                    benchmark.teardown(*params)
+
+    return results
+
+
+def _format(name, result, baseline=None):
+    s = f'{name:<90} {result["time"] * 1000:>12.3f} ms'
+    if result['throughput'] is not None:
+        s += f' {result["throughput"]:>14.1f} {result["unit"]}/s'
+    if baseline is not None:
+        s += f'  x{result["time"] / baseline["time"]:.2f} vs baseline'
+    return s
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run chimera benchmarks')
+    parser.add_argument('-k', dest='pattern', help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=3, help='No. of repeats of each timing')
+    parser.add_argument('--min-time', type=float, default=0.1, help='Minimum time (in seconds) of each repeat')
+    parser.add_argument('--save', help='Path to a JSON file to save results to, e.g. as a new baseline')
+    parser.add_argument('--compare', help='Path to a JSON file of baseline results to compare against')
+    parser.add_argument('--factor', type=float, default=1.5,
+                        help='Slowdown factor (vs the baseline) beyond which a benchmark is a regression')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = run(pattern=args.pattern, repeat=args.repeat, min_time=args.min_time)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': platform.platform(), 'python': platform.python_version(), 'results': results}, f,
+                      indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print(f'\nComparison against {args.compare}:')
+        regressions = []
+        for name, result in results.items():
+            if name in baseline:
+                print(_format(name, result, baseline[name]))
+                if result['time'] > args.factor * baseline[name]['time']:
+                    regressions.append(name)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) (slower than the baseline by more than x{args.factor}):')
+            print('\n'.join(regressions))
+            sys.exit(1)
@@ -3,7 +3,7 @@ import os
 import gzip
 import pandas as pd
 
-from chimera.distance import ANNOTATION_COLUMNS, create_distance_file, create_fasta
+from chimera.distance import ANNOTATION_COLUMNS, create_distance_file, create_fastas, DISTANCE_METRICS
 
 ANNOTATION_FILE = '/media/vineetb/t5-vineetb/biolip/processed_data/annotations/current_annotations.txt'
 COMPRESS = False
@@ -48,12 +48,13 @@ if __name__ == '__main__':
                 compressed=COMPRESS
             )
 
-        for DISTANCE in ('mindist', 'fracin4', 'meandist', 'maxstd', 'meanstd', 'sumstd', 'maxvdw', 'meanvdw', 'sumvdw'):
-            create_fasta(df, 'distance.fa', compressed=COMPRESS, distance=DISTANCE)
+        # All distance metrics are calculated in a single pass
+        fasta_filepaths = create_fastas(df, 'distance_{distance}.fa', distances=DISTANCE_METRICS)
+        for DISTANCE in DISTANCE_METRICS:
             if COMPRESS:
-                s = gzip.open('distance.fa.gz', 'rb').read().decode('utf8')
+                s = gzip.open(fasta_filepaths[DISTANCE] + '.gz', 'rb').read().decode('utf8')
             else:
-                s = open('distance.fa', 'rb').read().decode('utf8')
+                s = open(fasta_filepaths[DISTANCE], 'rb').read().decode('utf8')
 
             s2 = gzip.open(
                 os.path.join('/media/vineetb/t5-vineetb/biolip/processed_data/fasta/', pdb_id[0],
@@ -0,0 +1,21 @@
+import pandas as pd
+from chimera.distance import ANNOTATION_COLUMNS, create_distance_files
+
+ANNOTATION_FILE = '/media/vineetb/t5-vineetb/biolip/processed_data/annotations/current_annotations.txt'
+
+
+if __name__ == '__main__':
+
+    annot_df = pd.read_csv(ANNOTATION_FILE, sep='\t', header=None, names=ANNOTATION_COLUMNS)
+    pdb_ids = list(pd.unique(annot_df['pdb_id']))
+
+    results = create_distance_files(
+        ANNOTATION_FILE,
+        pdb_ids,
+        receptor_dir='/media/vineetb/t5-vineetb/biolip/downloaded_data/receptor/',
+        ligand_dir='/media/vineetb/t5-vineetb/biolip/downloaded_data/ligand/',
+        distance_dir='/media/vineetb/t5-vineetb/biolip/processed_data/distances_overlap/',
+        chunksize=4
+    )
+
+    print(results[results.status == 'failed'].to_string())
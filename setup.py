@@ -29,6 +29,17 @@ setup(
     packages=find_namespace_packages(where='src'),
     include_package_data=True,
 
+    extras_require={
+        # For the long-lived hmmscan server (chimera.core.domain.hmmerserver)
+        'server': ['pyhmmer']
+    },
+
+    entry_points={
+        'console_scripts': [
+            'chimera=chimera.__main__:main'
+        ]
+    },
+
     zip_safe=False,
     test_suite='tests'
 )
@@ -6,6 +6,7 @@ import logging.config
 import logging
 from types import SimpleNamespace
 import json
+import threading
 import pandas as pd
 from string import Formatter
 from collections import defaultdict
@@ -66,11 +67,15 @@ LIGAND_TYPES = ('peptide', 'ion', 'metabolite', 'sm', 'dna', 'dnabase', 'dnaback
 
 # TODO: Names of these DataFrames directly ported from R - not intuitive!
 
-df_dl = None
-interacdome_pfam_ids = None
-with path(chimera.data, 'interacdome_fordownload.tsv') as p:
-    df = pd.read_csv(p, sep='\t', header=0)
-    logger.info(f'Read {len(df)} records from interacdome_fordownload.tsv')
+
+def read_interacdome(filepath):
+    """
+    Read binding frequency records for InteracDome
+    :param filepath: Path to a binding frequency file, e.g. interacdome_fordownload.tsv
+    :return: A DataFrame of binding frequency records, for the ligand types we support
+    """
+    df = pd.read_csv(filepath, sep='\t', header=0)
+    logger.info(f'Read {len(df)} records from {os.path.basename(filepath)}')
 
     # TODO: The way results are filtered from the 'master' tsv file for InteracDome is to compare the 'ligand_type'
     # column values with the uppercased ligand types, with a '_' appended at the end.
@@ -78,9 +83,15 @@ with path(chimera.data, 'interacdome_fordownload.tsv') as p:
     # (i.e. records that have ligand types 'SM', 'RNA', 'DNA')
     # We do the same here for backward compatibility, but this will need further investigation.
     old_ligand_types = [x.upper() + '_' for x in LIGAND_TYPES]
-    df_dl = df[df['ligand_type'].isin(old_ligand_types)]
+    df_dl = df[df['ligand_type'].isin(old_ligand_types)].copy()
     df_dl['ligand_type'] = df_dl['ligand_type'].map(lambda x: x.replace('_', '').lower())
     logger.info(f'Read {len(df_dl)} filtered binding frequency records for InteracDome after filtering for ligand type')
+    return df_dl
+
+
+def _load_interacdome():
+    with path(chimera.data, 'interacdome_fordownload.tsv') as p:
+        df_dl = read_interacdome(p)
 
     # Filtered records to be displayed on the website
     df_dl_filtered = df_dl[
@@ -90,24 +101,102 @@ with path(chimera.data, 'interacdome_fordownload.tsv') as p:
     logger.info(f'Read {len(df_dl_filtered)} filtered binding frequency records for InteracDome for website display')
 
     interacdome_pfam_ids = pd.unique(df_dl_filtered['pfam_id'])
-
-df_dl_dsprint = None
-dsprint_pfam_ids = None
-with path(chimera.data, 'dsprint_fordownload.tsv') as p:
-    df_dl_dsprint = pd.read_csv(p, sep='\t', header=0)
-    logger.info(f'Read {len(df_dl_dsprint)} records from dsprint_fordownload.tsv')
+    return {
+        'df_dl': df_dl,
+        'df_dl_filtered': df_dl_filtered,
+        'interacdome_pfam_ids': interacdome_pfam_ids,
+        # For membership checks, e.g. of requested pfam ids
+        'interacdome_pfam_id_set': frozenset(interacdome_pfam_ids)
+    }
+
+
+def read_dsprint(filepath):
+    """
+    Read binding frequency records for dSPRINT
+    :param filepath: Path to a binding frequency file, e.g. dsprint_fordownload.tsv
+    :return: A DataFrame of binding frequency records
+    """
+    df = pd.read_csv(filepath, sep='\t', header=0)
+    logger.info(f'Read {len(df)} records from {os.path.basename(filepath)}')
+    return df
+
+
+def _load_dsprint():
+    with path(chimera.data, 'dsprint_fordownload.tsv') as p:
+        df_dl_dsprint = read_dsprint(p)
 
     dsprint_pfam_ids = pd.unique(df_dl_dsprint['pfam_id'])
+    return {
+        'df_dl_dsprint': df_dl_dsprint,
+        'dsprint_pfam_ids': dsprint_pfam_ids,
+        # For membership checks, e.g. of requested pfam ids
+        'dsprint_pfam_id_set': frozenset(dsprint_pfam_ids)
+    }
+
+
+# Per-position binding frequencies of each record of the tables above, parsed once (and shared by all consumers)
+def _load_binding_frequency_array(algorithm):
+    def _load():
+        from chimera.core.binding import BindingFrequencyArray
+        df = __getattr__('df_dl_dsprint' if algorithm == 'dsprint' else 'df_dl')
+        binding_frequencies = BindingFrequencyArray(df['binding_frequencies'])
+        logger.info(f'Parsed {len(binding_frequencies.values)} binding frequencies for {algorithm}')
+        return {f'{algorithm}_binding_frequencies': binding_frequencies}
+    return _load
+
 
 # Unpivoted binding-frequencies table which has been pre-filtered on
 # num_nonidentical_instances/num_structures/max_achieved_precision as per the config file
-# TODO: Generate/cache on demand rather than ahead of time!
-binding_frequencies_interacdome = None
-with path(chimera.data, 'binding_frequencies_interacdome.parquet') as p:
-    binding_frequencies_interacdome = pd.read_parquet(p)
-    logger.info(f'Read {len(binding_frequencies_interacdome)} records from binding_frequencies_interacdome.parquet')
-
-binding_frequencies_dsprint = None
-with path(chimera.data, 'binding_frequencies_dsprint.parquet') as p:
-    binding_frequencies_dsprint = pd.read_parquet(p)
-    logger.info(f'Read {len(binding_frequencies_dsprint)} records from binding_frequencies_dsprint.parquet')
+# (generated, whenever its source or these thresholds change, with 'chimera binding-frequencies')
+def _load_binding_frequencies(algorithm):
+    def _load():
+        filename = f'binding_frequencies_{algorithm}.parquet'
+        with path(chimera.data, filename) as p:
+            df = pd.read_parquet(p)
+            logger.info(f'Read {len(df)} records from {filename}')
+        return {f'binding_frequencies_{algorithm}': df}
+    return _load
+
+
+# A dense (pfam_id, match_state) => binding frequencies lookup structure, built from the unpivoted table above
+def _load_binding_frequency_index(algorithm):
+    def _load():
+        from chimera.core.binding import BindingFrequencyIndex
+        df = __getattr__(f'binding_frequencies_{algorithm}')
+        return {f'binding_frequencies_{algorithm}_index': BindingFrequencyIndex(df)}
+    return _load
+
+
+# Data attributes of this module that are expensive to create, and are thus only loaded on first access.
+# A dict mapping <attribute_name> => <callable>, where <callable> takes no arguments and returns a dict of
+# <attribute_name> => <value> (a single loader may populate more than one attribute).
+_lazy_data = {
+    'df_dl': _load_interacdome,
+    'df_dl_filtered': _load_interacdome,
+    'interacdome_pfam_ids': _load_interacdome,
+    'interacdome_pfam_id_set': _load_interacdome,
+    'df_dl_dsprint': _load_dsprint,
+    'dsprint_pfam_ids': _load_dsprint,
+    'dsprint_pfam_id_set': _load_dsprint,
+    'interacdome_binding_frequencies': _load_binding_frequency_array('interacdome'),
+    'dsprint_binding_frequencies': _load_binding_frequency_array('dsprint'),
+    'binding_frequencies_interacdome': _load_binding_frequencies('interacdome'),
+    'binding_frequencies_dsprint': _load_binding_frequencies('dsprint'),
+    'binding_frequencies_interacdome_index': _load_binding_frequency_index('interacdome'),
+    'binding_frequencies_dsprint_index': _load_binding_frequency_index('dsprint')
+}
+_lazy_data_lock = threading.RLock()
+
+
+def __getattr__(name):
+    """
+    Load (and cache as a module attribute) any data attribute registered in _lazy_data on first access.
+    Once loaded, the attribute is found by regular module attribute lookup, and this function is not called again.
+    """
+    if name not in _lazy_data:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    with _lazy_data_lock:
+        if name not in globals():
+            globals().update(_lazy_data[name]())
+    return globals()[name]
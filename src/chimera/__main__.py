@@ -0,0 +1,39 @@
+"""
+The 'chimera' command, e.g.:
+
+    chimera binding-frequencies --algorithm interacdome
+
+(or, without installing the package, 'python -m chimera ...')
+"""
+import argparse
+
+from chimera.core.binding import write_binding_frequencies
+
+
+def binding_frequencies(args):
+    for algorithm in args.algorithm:
+        write_binding_frequencies(algorithm, row_group_size=args.row_group_size, force=args.force)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='chimera', description='Protein Domain Identification Package')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparser = subparsers.add_parser(
+        'binding-frequencies',
+        help='Generate unpivoted binding frequency tables (binding_frequencies_<algorithm>.parquet) from their '
+             'source files, if either the source files or the thresholds in the config file have changed'
+    )
+    subparser.add_argument('--algorithm', nargs='+', choices=('interacdome', 'dsprint'),
+                           default=['interacdome', 'dsprint'], help='Ligand-binding algorithm(s)')
+    subparser.add_argument('--row-group-size', type=int, default=65536,
+                           help='Approximate no. of rows in each row group of the parquet file(s)')
+    subparser.add_argument('--force', action='store_true', help='Generate tables even if they are up to date')
+    subparser.set_defaults(func=binding_frequencies)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
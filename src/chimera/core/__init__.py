@@ -2,34 +2,70 @@ import logging
 import numpy as np
 import pandas as pd
 
-from chimera import binding_frequencies_interacdome, binding_frequencies_dsprint
+import chimera
 from chimera.core.domain import HmmerDomainFinder, HmmerWebDomainFinder, Dpuc2DomainFinder, DomStratStatsDomainFinder
 
 logger = logging.getLogger(__name__)
 
 
+def seqs_to_matchstates(seqs, starts, ends):
+    """
+    Determine the 'index' and 'matchstate' information of a number of aligned sequences at once.
+    TODO: Code ported directly from R - Could use an intuitive explanation!
+
+    Each sequence is a string of single-letter components, which can contain lowercase characters (insertions wrt the
+    domain, which do not consume a match state) or '-' characters (deletions wrt the domain, which do not consume
+    a position in the original sequence). Only positions that consume both a match state and a sequence position
+    are returned.
+
+    :param seqs: An iterable of strings of single-letter components of a sequence
+    :param starts: An array-like of 1-indexed start positions of each sequence in the original sequence
+    :param ends: An array-like of 1-indexed (inclusive) end positions of each sequence in the original sequence
+    :return: A 3-tuple of arrays, all of the same length
+        0: array indicating the (0-indexed) sequence in seqs that each entry belongs to
+        1: array indicating match-states.
+        2: array indicating indices.
+    """
+    seqs = list(seqs)
+    starts = np.asarray(starts, dtype=int)
+    ends = np.asarray(ends, dtype=int)
+
+    lengths = np.fromiter(map(len, seqs), dtype=int, count=len(seqs))
+    chars = np.frombuffer(''.join(seqs).encode('ascii'), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(seqs)), lengths)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])[:-1]
+
+    def _cumcount(mask):
+        # 1-indexed running count of True values in mask, restarting at each sequence boundary
+        cumsum = np.concatenate([[0], np.cumsum(mask)])
+        return cumsum[1:] - cumsum[offsets][rows]
+
+    match_states_mask = (chars < ord('a')) | (chars > ord('z'))  # Anything that's not lowercase
+    seq_indices_mask = chars != ord('-')
+
+    n_seq_indices = np.bincount(rows, weights=seq_indices_mask, minlength=len(seqs))
+    if not np.array_equal(n_seq_indices, ends - starts + 1):
+        raise RuntimeError('Sequence lengths (excluding deletions) must agree with their start/end positions')
+
+    # line up the outputs, keeping only positions that have both a match state and a sequence index
+    mask = match_states_mask & seq_indices_mask
+    match_states = _cumcount(match_states_mask)[mask]
+    seq_indices = (_cumcount(seq_indices_mask) + starts[rows] - 1)[mask]
+
+    return rows[mask], match_states, seq_indices
+
+
 def seq_to_matchstates(seq, start, end):
     """
     Determine the 'index' and 'matchstate' information of a given sequence.
-    TODO: Code ported directly from R - Could use an intuitive explanation!
     :param seq: A string of single-letter components of a sequence, which can contain lowercase characters
         or '-' characters.
     :return: A 2-tuple of arrays
         0: array indicating indices
         1: array indicating match-states.
     """
-    match_states = np.zeros(len(seq)).astype('int')
-    match_states_mask = np.array([s_i.upper() == s_i for s_i in seq])
-    match_states[match_states_mask] = np.arange(1, len(match_states[match_states_mask])+1)
-    seq_indices = np.zeros(len(seq)).astype('int')
-    seq_indices_mask = np.array([s_i != '-' for s_i in seq])
-    seq_indices[seq_indices_mask] = np.arange(start, end+1)
-    assert len(match_states) == len(seq_indices), "Match states and seq indices must have same length"
-
-    # line up the outputs, filter out any 0s (in either of them)
-    match_states, seq_indices = zip(*[(m, s) for m, s in zip(match_states, seq_indices) if m != 0 and s != 0])
-
-    return match_states, seq_indices
+    _, match_states, seq_indices = seqs_to_matchstates([seq], [start], [end])
+    return tuple(match_states.tolist()), tuple(seq_indices.tolist())
 
 
 def query(sequences, algorithm='dsprint', domain_algorithm='hmmer', full_domains=False):
@@ -58,29 +94,70 @@ def query(sequences, algorithm='dsprint', domain_algorithm='hmmer', full_domains
     }[domain_algorithm]()
 
     domains = domain_finder.domain_table(sequences, full_domains=full_domains)
+    return domains, domain_binding_frequencies(domains, algorithm=algorithm)
+
 
-    domains[['match_states', 'seq_indices']] = domains.apply(
-        lambda row: pd.Series(seq_to_matchstates(row.aliseq, row.target_start, row.target_end)),
-        axis=1
+def domain_binding_frequencies(domains, algorithm='dsprint'):
+    """
+    Find out binding frequency data for domain hits, at each sequence position covered by a match state of a domain
+    :param domains: A DataFrame of domain hits, as returned by DomainFinder.domain_table. Columns 'match_states' and
+        'seq_indices' are added to this DataFrame in place.
+    :param algorithm: Ligand-binding algorithm (case-sensitive). One of:
+        dsprint
+        interacdome
+    :return: A DataFrame containing Ligand-binding frequency data
+    """
+
+    rows, match_states, seq_indices = seqs_to_matchstates(
+        domains['aliseq'], domains['target_start'], domains['target_end']
     )
+
+    # Split the flattened arrays back into one tuple per hit
+    boundaries = np.searchsorted(rows, np.arange(len(domains) + 1)).tolist()
+    _match_states, _seq_indices = match_states.tolist(), seq_indices.tolist()
+    domains['match_states'] = [tuple(_match_states[i:j]) for i, j in zip(boundaries[:-1], boundaries[1:])]
+    domains['seq_indices'] = [tuple(_seq_indices[i:j]) for i, j in zip(boundaries[:-1], boundaries[1:])]
     logger.info('Added match state and sequence index information to results')
 
-    match_rows = []
-    for (query_id, pfam_domain), _df in domains.groupby(['query_id', 'pfam_domain']):
-        for _, row in _df.iterrows():
-            for match_i, seq_i in zip(row.match_states, row.seq_indices):
-                match_rows.append({'query_id': query_id, 'pfam_domain': pfam_domain, 'match_i': match_i, 'seq_i': seq_i})
-    matches = pd.DataFrame(match_rows)
+    # Order the match/sequence table by query/domain (stable, so hits otherwise retain their relative order)
+    order = domains[['query_id', 'pfam_domain']].reset_index(drop=True).sort_values(
+        ['query_id', 'pfam_domain'], kind='mergesort'
+    ).index.values
+    rank = np.empty(len(domains), dtype=int)
+    rank[order] = np.arange(len(domains))
+    permutation = np.argsort(rank[rows], kind='mergesort')
+    rows, match_states, seq_indices = rows[permutation], match_states[permutation], seq_indices[permutation]
+
+    # Group rows by (pfam_domain, match_i), in order of first appearance, which is the order that a merge on these
+    # columns gives (stable, so rows of each group retain their order)
+    pfam_codes = pd.factorize(domains['pfam_domain'].values[rows])[0]
+    key_codes = pd.factorize(pfam_codes.astype(np.int64) * (match_states.max(initial=0) + 1) + match_states)[0]
+    permutation = np.argsort(key_codes, kind='mergesort')
+    rows, match_states, seq_indices = rows[permutation], match_states[permutation], seq_indices[permutation]
+
+    # query_id/pfam_domain are plain strings (rather than categoricals, as in the domain table) in the output
+    matches = pd.DataFrame({
+        'query_id': domains['query_id'].values.astype(object)[rows],
+        'pfam_domain': domains['pfam_domain'].values.astype(object)[rows],
+        'match_i': match_states,
+        'seq_i': seq_indices
+    })
     logger.info('Created an unpivoted match/sequence table of domain results')
 
     if algorithm == 'interacdome':
-        binding_frequencies = binding_frequencies_interacdome
+        binding_frequency_index = chimera.binding_frequencies_interacdome_index
     elif algorithm == 'dsprint':
-        binding_frequencies = binding_frequencies_dsprint
+        binding_frequency_index = chimera.binding_frequencies_dsprint_index
     else:
         raise RuntimeError('Unsupported ligand frequency algorithm')
 
-    df = pd.merge(matches, binding_frequencies, left_on=['pfam_domain', 'match_i'], right_on=['pfam_id', 'match_state'])
-    logger.info('Merged domain results / binding frequency dataFrames')
+    indices, ligand_types, binding_frequencies = binding_frequency_index.lookup(matches['pfam_domain'],
+                                                                                matches['match_i'])
+    df = matches.iloc[indices].reset_index(drop=True)
+    df['binding_frequency'] = binding_frequencies
+    df['ligand_type'] = ligand_types
+    df['match_state'] = df['match_i']
+    df['pfam_id'] = df['pfam_domain']
+    logger.info('Looked up binding frequencies for domain results')
 
-    return domains, df
+    return df
@@ -0,0 +1,280 @@
+import os
+import json
+import logging
+from tempfile import NamedTemporaryFile
+from importlib.resources import path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import chimera.data
+from chimera import config, LIGAND_TYPES, read_interacdome, read_dsprint
+from chimera.core.domain.cache import file_checksum
+
+logger = logging.getLogger(__name__)
+
+# Bump to regenerate all unpivoted binding frequency tables, e.g. when their layout changes
+BINDING_FREQUENCIES_VERSION = 2
+
+# Key of the (parquet) schema metadata that records what an unpivoted binding frequency table was generated from
+BINDING_FREQUENCIES_METADATA_KEY = b'chimera.binding_frequencies'
+
+
+class BindingFrequencyArray:
+    """
+    Per-position binding frequencies of the records of a binding frequency table (e.g. interacdome_fordownload.tsv),
+    parsed once from their comma-separated strings into a single ragged float32 array.
+
+    The binding frequencies of the i-th record are values[offsets[i]:offsets[i + 1]], one for each (1-indexed) match
+    state of the domain. Records are addressed by their index labels in the table.
+    """
+
+    def __init__(self, binding_frequencies, dtype=np.float32):
+        """
+        :param binding_frequencies: A Series of comma-separated binding frequency strings, e.g. the
+            'binding_frequencies' column of a binding frequency table
+        :param dtype: dtype of the parsed binding frequencies. float32 is enough for display, but tables that query
+            results are looked up in need float64, so that values come back exactly as they appear in the source
+        """
+        strings = binding_frequencies.astype(str)
+        self.index = strings.index
+        lengths = strings.str.count(',').values + 1
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+
+        # All strings are parsed in a single call, rather than split and converted one record at a time
+        values = np.fromstring(','.join(strings), dtype=float, sep=',') if len(strings) else np.array([])
+        if len(values) != self.offsets[-1]:
+            raise RuntimeError('Unable to parse binding frequencies')
+        self.values = values.astype(dtype)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, label):
+        """
+        Get the binding frequencies of a record
+        :param label: Index label of the record
+        :return: A float32 array (a view into self.values), with one binding frequency per match state
+        """
+        i = self.index.get_loc(label)
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def tolist(self, label):
+        """
+        Get the binding frequencies of a record as a list of floats, each the shortest decimal that round-trips to its
+        float32 value (so that e.g. 0.1 is serialized as 0.1, and not as 0.10000000149011612)
+        :param label: Index label of the record
+        :return: A list of floats
+        """
+        return self[label].astype(str).astype(float).tolist()
+
+    def explode(self, labels=None):
+        """
+        Get the binding frequencies of (some of the) records, one per match state
+        :param labels: Index labels of the records, by default all records
+        :return: A 3-tuple of arrays, all of the same length, with one entry per (record, match state)
+            0: array of (0-indexed) positions in labels of the record
+            1: array of (1-indexed) match states
+            2: array of binding frequencies
+        """
+        positions = np.arange(len(self)) if labels is None else self.index.get_indexer(labels)
+        if (positions < 0).any():
+            raise RuntimeError('Binding frequencies not found for some records')
+
+        starts, lengths = self.offsets[positions], np.diff(self.offsets)[positions]
+        rows = np.repeat(np.arange(len(positions)), lengths)
+        # 0-indexed rank of each entry within its record
+        ranks = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return rows, ranks + 1, self.values[starts[rows] + ranks]
+
+
+def unpivot_binding_frequencies(df, binding_frequencies):
+    """
+    Unpivot (some of the) records of a binding frequency table, into one row per (record, match state)
+    :param df: A DataFrame of binding frequency records, with columns 'pfam_id' and 'ligand_type'
+    :param binding_frequencies: A BindingFrequencyArray over (a superset of) the records of df
+    :return: A DataFrame with columns
+        pfam_id, match_state, ligand_type, binding_frequency
+    """
+    rows, match_states, values = binding_frequencies.explode(df.index)
+    return pd.DataFrame({
+        'pfam_id': df['pfam_id'].values[rows],
+        'match_state': match_states,
+        'ligand_type': df['ligand_type'].values[rows],
+        'binding_frequency': values
+    })
+
+
+class BindingFrequencyIndex:
+    """
+    A dense lookup structure over an unpivoted binding-frequencies table, i.e. a DataFrame with columns
+        pfam_id, match_state, ligand_type, binding_frequency
+
+    All binding frequencies are held in a single float array of shape (<total no. of match states>, <no. of ligand types>),
+    where the rows for any pfam id are contiguous and ordered by (1-indexed) match state. Ligand types that have no
+    binding frequencies for a pfam id are NaN.
+
+    Looking up binding frequencies for a set of (pfam_id, match_state) pairs is thus a matter of slicing this array,
+    instead of merging against the whole table.
+    """
+
+    def __init__(self, df):
+        present_ligand_types = set(df['ligand_type'].unique())
+        ligand_types = [l for l in LIGAND_TYPES if l in present_ligand_types]
+        ligand_types += sorted(present_ligand_types - set(ligand_types))
+        self.ligand_types = np.array(ligand_types, dtype=object)
+
+        pfam_codes, pfam_ids = pd.factorize(df['pfam_id'], sort=True)
+        self.pfam_ids = pd.Index(pfam_ids)
+
+        match_states = df['match_state'].values.astype(int)
+        # No. of match states for each pfam id, and the row in self.values where its binding frequencies begin
+        self.lengths = np.zeros(len(self.pfam_ids), dtype=int)
+        np.maximum.at(self.lengths, pfam_codes, match_states)
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)[:-1]]).astype(int)
+
+        ligand_codes = pd.Categorical(df['ligand_type'], categories=ligand_types).codes
+        rows = self.offsets[pfam_codes] + match_states - 1
+        self.values = np.full((self.lengths.sum(), len(ligand_types)), np.nan)
+        self.values[rows, ligand_codes] = df['binding_frequency'].values
+        # Position of each binding frequency in df, so that lookups list them in the order of df (as a merge would)
+        self.positions = np.full(self.values.shape, -1, dtype=np.int32)
+        self.positions[rows, ligand_codes] = np.arange(len(df))
+
+    def lookup(self, pfam_ids, match_states):
+        """
+        Look up binding frequencies for (pfam_id, match_state) pairs
+        :param pfam_ids: An array-like of pfam ids, e.g. 'PF00096_zf-C2H2'
+        :param match_states: An array-like of 1-indexed match states, of the same length as pfam_ids
+        :return: A 3-tuple of arrays, all of the same length, with one entry per available binding frequency, ordered by
+            position in the input and then by position in the table the index was built from
+            0: array of (0-indexed) positions in the input that the binding frequency corresponds to
+            1: array of ligand types
+            2: array of binding frequencies
+        """
+        pfam_codes = self.pfam_ids.get_indexer(pfam_ids)
+        match_states = np.asarray(match_states, dtype=int)
+
+        found = np.flatnonzero(pfam_codes >= 0)
+        found = found[(match_states[found] >= 1) & (match_states[found] <= self.lengths[pfam_codes[found]])]
+
+        rows = self.offsets[pfam_codes[found]] + match_states[found] - 1
+        values = self.values[rows]
+        i, j = np.nonzero(~np.isnan(values))
+        order = np.lexsort((self.positions[rows[i], j], i))
+        i, j = i[order], j[order]
+
+        return found[i], self.ligand_types[j], values[i, j]
+
+
+def binding_frequency_thresholds(algorithm):
+    """
+    Get the minimum value of each column that binding frequency records of an algorithm must have, as per the config
+    file, to be included in its unpivoted binding frequency table
+    :param algorithm: Ligand-binding algorithm (case-sensitive), one of 'interacdome'/'dsprint'
+    :return: A dict mapping <column> => <minimum value>
+    """
+    if algorithm == 'interacdome':
+        return {
+            'num_nonidentical_instances': config.web.min_instances,
+            'num_structures': config.web.min_structures,
+            'max_achieved_precision': config.web.min_achieved_precision
+        }
+    elif algorithm == 'dsprint':
+        # dSPRINT records are all displayed (and queried), unfiltered
+        return {}
+    else:
+        raise RuntimeError(f'Unsupported ligand frequency algorithm {algorithm}')
+
+
+def binding_frequency_table(df, binding_frequencies, thresholds):
+    """
+    Get an unpivoted binding frequency table
+    :param df: A DataFrame of binding frequency records, with columns 'pfam_id', 'ligand_type', and any columns
+        in thresholds
+    :param binding_frequencies: A BindingFrequencyArray over (a superset of) the records of df
+    :param thresholds: A dict mapping <column> => <minimum value>, of records to include
+    :return: A DataFrame with columns
+        pfam_id, match_state, ligand_type, binding_frequency
+        sorted by pfam_id, with the records of each pfam id in their original order (each unpivoted into rows for
+        match states 1, 2, ..), as the table has always been generated. Query results follow this order.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for column, minimum in thresholds.items():
+        mask &= (df[column] >= minimum).values
+    df = df[mask].sort_values('pfam_id', kind='mergesort')
+
+    # Match states of each record are contiguous and ordered, so records sorted by pfam id give a table sorted by pfam id
+    return unpivot_binding_frequencies(df, binding_frequencies)
+
+
+def _row_group_boundaries(pfam_ids, row_group_size):
+    """
+    Get boundaries of row groups of a table sorted by pfam id, of ~row_group_size rows each, with all rows of a
+    pfam id in the same row group
+    :param pfam_ids: An array of (sorted) pfam ids, one for each row of the table
+    :param row_group_size: Approximate no. of rows in each row group
+    :return: An int array of row indices, starting with 0 and ending with len(pfam_ids)
+    """
+    # Rows where a pfam id starts
+    starts = np.flatnonzero(np.append([True], pfam_ids[1:] != pfam_ids[:-1]))[:len(pfam_ids)]
+    # A new row group begins at the first pfam id that starts in each (row_group_size-sized) block of rows
+    blocks = starts // row_group_size
+    starts = starts[np.append([True], blocks[1:] != blocks[:-1])[:len(starts)]]
+    return np.append(starts, len(pfam_ids)) if len(starts) else np.array([0, 0])
+
+
+def write_binding_frequencies(algorithm, filepath=None, source_filepath=None, row_group_size=65536, force=False):
+    """
+    Generate the unpivoted binding frequency table of an algorithm (see binding_frequency_table) as a parquet file,
+    sorted by pfam id and with each pfam id in a single row group (so that reads of specific pfam ids can skip all
+    other row groups). Nothing is done if the file was generated from the same source file and thresholds.
+    :param algorithm: Ligand-binding algorithm (case-sensitive), one of 'interacdome'/'dsprint'
+    :param filepath: Path of the parquet file, by default binding_frequencies_<algorithm>.parquet in chimera.data
+    :param source_filepath: Path of the binding frequency file, by default <algorithm>_fordownload.tsv in chimera.data
+    :param row_group_size: Approximate no. of rows in each row group
+    :param force: Whether to generate the file even if it's up to date
+    :return: True if the file was (re)generated, False if it was up to date
+    """
+    if filepath is None:
+        with path(chimera.data, f'binding_frequencies_{algorithm}.parquet') as p:
+            filepath = str(p)
+    if source_filepath is None:
+        with path(chimera.data, f'{algorithm}_fordownload.tsv') as p:
+            source_filepath = str(p)
+
+    thresholds = binding_frequency_thresholds(algorithm)
+    metadata = json.dumps({
+        'version': BINDING_FREQUENCIES_VERSION,
+        'source': file_checksum(source_filepath),
+        'thresholds': thresholds
+    }, sort_keys=True).encode('utf8')
+
+    if not force and os.path.exists(filepath):
+        existing_metadata = pq.read_schema(filepath).metadata or {}
+        if existing_metadata.get(BINDING_FREQUENCIES_METADATA_KEY) == metadata:
+            logger.info(f'{filepath} is up to date')
+            return False
+
+    df = read_interacdome(source_filepath) if algorithm == 'interacdome' else read_dsprint(source_filepath)
+    # Parsed as float64 (as in the shipped tables), since query results report these values as-is
+    table = binding_frequency_table(df, BindingFrequencyArray(df['binding_frequencies'], dtype=np.float64),
+                                    thresholds)
+
+    arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+    arrow_table = arrow_table.replace_schema_metadata({
+        **(arrow_table.schema.metadata or {}),
+        BINDING_FREQUENCIES_METADATA_KEY: metadata
+    })
+    boundaries = _row_group_boundaries(table['pfam_id'].values, row_group_size)
+
+    # Write to a temporary file first, so that concurrent readers never see a partially written table
+    with NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(filepath)), suffix='.parquet', delete=False) as f:
+        with pq.ParquetWriter(f, arrow_table.schema) as writer:
+            for start, end in zip(boundaries[:-1], boundaries[1:]):
+                writer.write_table(arrow_table.slice(start, end - start), row_group_size=max(end - start, 1))
+    os.replace(f.name, filepath)
+
+    logger.info(f'Wrote {len(table)} binding frequencies in {len(boundaries) - 1} row groups to {filepath}')
+    return True
@@ -1,4 +1,30 @@
+import logging
+from array import array
+from itertools import groupby
+import numpy as np
 import pandas as pd
+from Bio.SeqRecord import SeqRecord
+
+from chimera import config
+from chimera.core.domain.cache import SqliteDomainCache
+
+logger = logging.getLogger(__name__)
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    Get the DomainCache configured in the config file (under cache.domains), or None if caching is not configured.
+    """
+    global _default_cache
+    if _default_cache is None and config.cache.domains.path:
+        _default_cache = SqliteDomainCache(
+            config.cache.domains.path,
+            max_entries=config.cache.domains.max_entries,
+            max_size_mb=config.cache.domains.max_size_mb
+        )
+    return _default_cache
 
 
 class DomainFinder:
@@ -6,51 +32,167 @@ class DomainFinder:
     A class that finds domains, given one of more sequences.
     """
 
+    # Name of the domain-finding algorithm, used to distinguish cached results across subclasses
+    algorithm = None
+
+    def __init__(self, cache=None):
+        """
+        :param cache: A chimera.core.domain.cache.DomainCache object, or None to use the default cache (if any)
+            configured in the config file.
+        """
+        self.cache = cache if cache is not None else default_cache()
+
+    def database_version(self):
+        """
+        A string that identifies the domain database (and any other inputs) that results of this DomainFinder depend
+        on, so that cached results are invalidated when any of these change. None if results should not be cached.
+        """
+        return None
+
     def find_domains(self, sequences):
+        """
+        Find domains for one or more sequences, consulting the cache (if any) for results of individual sequences.
+        :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+        :return: A list of dicts (see _iter_domains)
+        """
+        return list(self.iter_domains(sequences))
+
+    def iter_domains(self, sequences):
+        """
+        Find domains for one or more sequences, consulting the cache (if any) for results of individual sequences.
+        Hits are yielded as soon as they are available, grouped by sequence, in the order of the input sequences.
+        :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+        :return: A generator of dicts (see _iter_domains)
+        """
+        database_version = None
+        if self.cache is not None:
+            database_version = self.database_version()
+        if database_version is None:
+            for hits in self._iter_domains_by_sequence(sequences):
+                yield from hits
+            return
+
+        keys = [self.cache.key(sequence, self.algorithm, database_version) for sequence in sequences]
+        cached_hits = [self.cache.get(key) for key in keys]
+
+        uncached_sequences = [sequence for sequence, hits in zip(sequences, cached_hits) if hits is None]
+        logger.info(f'Found cached results for {len(sequences) - len(uncached_sequences)}/{len(sequences)} sequences')
+
+        new_hits = self._iter_domains_by_sequence(uncached_sequences)
+        for sequence, key, hits in zip(sequences, keys, cached_hits):
+            if hits is None:
+                hits = [{k: v for k, v in hit.items() if k != 'query_id'} for hit in next(new_hits)]
+                self.cache.put(key, hits)
+            yield from (dict(query_id=sequence.name, **hit) for hit in hits)
+
+    def _iter_domains_by_sequence(self, sequences):
+        """
+        Find domains for one or more sequences (see _iter_domains), grouped by sequence
+        :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+        :return: A generator of lists of dicts, one list (possibly empty) per sequence, in the order of the sequences
+        """
+        # Hits are attributed to sequences by name, so if names are not unique, sequences are passed on named by
+        # position instead
+        renamed = sequences
+        if len(set(sequence.name for sequence in sequences)) < len(sequences):
+            renamed = [SeqRecord(sequence.seq, id=str(i), name=str(i), description='')
+                       for i, sequence in enumerate(sequences)]
+        for sequence, hits in zip(sequences, _hits_by_sequence(renamed, self._iter_domains(renamed))):
+            yield [dict(hit, query_id=sequence.name) for hit in hits]
+
+    def _iter_domains(self, sequences):
         """
         Find domains for one or more sequences
-        :param sequence: A list of Bio.SeqRecord.SeqRecord objects
-        :return: A list of dicts with keys
-            name: str (name of domain), e.g. "zf-H2C2_2"
-            ndom: int (no. of instances of this domain found)
-            domains: A list of dicts with keys:
-                query_id - str, query id, e.g. 'ctcf'
-                alihmmacc - accession (str), e.g. 'PF13465.6'
-                alihmmname - str, e.g. 'zf-H2C2_2'
-                alisqfrom - int. e.g. 262
-                alisqto - int, e.g. 274
-                alihmmfrom - int, e.g. 11
-                alihmmto - int, e.g. 23
-                aliM - int, e.g. 26
-                bitscore - float, e.g. 5.896
-                ievalue - str, e.g. '19'
-                aliaseq - str, e.g. 'VKKTFQCELCSYT'
+        :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+        :return: A generator of dicts, grouped by sequence in the order of the input sequences, with keys:
+            query_id - str, query id, e.g. 'ctcf'
+            alihmmacc - accession (str), e.g. 'PF13465.6'
+            alihmmname - str, e.g. 'zf-H2C2_2'
+            alisqfrom - int. e.g. 262
+            alisqto - int, e.g. 274
+            alihmmfrom - int, e.g. 11
+            alihmmto - int, e.g. 23
+            aliM - int, e.g. 26
+            bitscore - float, e.g. 5.896
+            ievalue - str, e.g. '19'
+            aliaseq - str, e.g. 'VKKTFQCELCSYT'
         """
         raise NotImplementedError('Subclasses must implement this.')
 
-    def domain_table(self, sequences, full_domains=False):
+    def domain_table(self, sequences, full_domains=False, arrow_strings=False):
+        """
+        Find domains for one or more sequences, as a DataFrame. Columns are accumulated incrementally as hits are found,
+        so the intermediate list of hits is never materialized.
+        :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+        :param full_domains: A boolean indicating whether we restrict results to full domain matches.
+        :param arrow_strings: A boolean indicating whether the 'aliseq' column is stored as Arrow-backed strings
+            (requires pandas >= 1.3 and pyarrow) instead of python objects.
+        :return: A DataFrame with one row per hit, with columns:
+            query_id - categorical
+            pfam_domain - categorical
+            target_start, target_end, hmm_start, hmm_end, domain_length - int32
+            bit_score - float32
+            e_value - float64 (E-values routinely underflow float32)
+            aliseq - str
+        """
+        columns = {
+            'query_id': [],
+            'pfam_domain': [],
+            'target_start': array('i'),
+            'target_end': array('i'),
+            'hmm_start': array('i'),
+            'hmm_end': array('i'),
+            'domain_length': array('i'),
+            'bit_score': array('f'),
+            'e_value': array('d'),
+            'aliseq': []
+        }
 
-        hits = self.find_domains(sequences)
-        results = []  # A list-of-dicts that we'll convert to a DataFrame
-        for hit in hits:
+        for hit in self.iter_domains(sequences):
             if full_domains and not (hit['alihmmfrom'] == 1 and hit['alihmmto'] == hit['aliM']):
                 continue
             pfam_name = hit['alihmmacc'][:7] + '_' + hit['alihmmname']  # TODO: Why this strange clipping of names?
-            results.append({
-                'query_id': hit['query_id'],
-                'pfam_domain': pfam_name,
-                'target_start': int(hit['alisqfrom']),
-                'target_end': int(hit['alisqto']),
-                'hmm_start': int(hit['alihmmfrom']),
-                'hmm_end': int(hit['alihmmto']),
-                'domain_length': int(hit['aliM']),
-                'bit_score': float(hit['bitscore']),
-                'e_value': float(hit['ievalue']),
-                'aliseq': hit['aliaseq'],
-            })
-
-        return pd.DataFrame(results)
+            columns['query_id'].append(hit['query_id'])
+            columns['pfam_domain'].append(pfam_name)
+            columns['target_start'].append(int(hit['alisqfrom']))
+            columns['target_end'].append(int(hit['alisqto']))
+            columns['hmm_start'].append(int(hit['alihmmfrom']))
+            columns['hmm_end'].append(int(hit['alihmmto']))
+            columns['domain_length'].append(int(hit['aliM']))
+            columns['bit_score'].append(float(hit['bitscore']))
+            columns['e_value'].append(float(hit['ievalue']))
+            columns['aliseq'].append(hit['aliaseq'])
+
+        # Categories are sorted, so that sorting on categorical columns is equivalent to sorting on the strings
+        columns['query_id'] = pd.Categorical(columns['query_id'], categories=sorted(set(columns['query_id'])))
+        columns['pfam_domain'] = pd.Categorical(columns['pfam_domain'], categories=sorted(set(columns['pfam_domain'])))
+        if arrow_strings:
+            if not hasattr(pd, 'ArrowDtype') and not hasattr(pd.arrays, 'ArrowStringArray'):
+                raise RuntimeError('Arrow-backed strings are not supported by this version of pandas')
+            columns['aliseq'] = pd.array(columns['aliseq'], dtype='string[pyarrow]')
+        else:
+            columns['aliseq'] = np.array(columns['aliseq'], dtype=object)
 
+        return pd.DataFrame({k: np.array(v) if isinstance(v, array) else v for k, v in columns.items()})
+
+
+def _hits_by_sequence(sequences, hits):
+    """
+    Group hits by sequence
+    :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+    :param hits: An iterable of dicts (see DomainFinder._iter_domains), grouped by sequence in the order of sequences
+    :return: A generator of lists of dicts, one list (possibly empty) per sequence
+    """
+    groups = groupby(hits, key=lambda hit: hit['query_id'])
+    query_id, group = next(groups, (None, None))
+    for sequence in sequences:
+        if sequence.name == query_id:
+            yield list(group)
+            query_id, group = next(groups, (None, None))
+        else:
+            yield []
+    if query_id is not None:
+        raise RuntimeError(f'Unexpected hits for query {query_id}')
 
 from . hmmer import HmmerDomainFinder
 from . hmmerweb import HmmerWebDomainFinder
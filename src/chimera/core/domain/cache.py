@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# A dict mapping (<file_path>, <file_size>, <file_mtime_ns>) => <checksum>, so that large files (e.g. Pfam-A.hmm)
+# are only read once per process, unless they change on disk.
+_file_checksums = {}
+
+
+def file_checksum(file_path, block_size=1 << 20):
+    """
+    Get the (memoized) SHA-256 checksum of a file
+    :param file_path: Path to a file
+    :param block_size: Size of blocks (in bytes) in which to read the file
+    :return: A hex digest string
+    """
+    stat = os.stat(file_path)
+    key = os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+    if key not in _file_checksums:
+        logger.info(f'Calculating checksum of {file_path}')
+        h = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+        _file_checksums[key] = h.hexdigest()
+    return _file_checksums[key]
+
+
+class DomainCache:
+    """
+    A class that stores domain hits for individual sequences, keyed by a content-derived string.
+    """
+
+    @staticmethod
+    def key(sequence, algorithm, database_version):
+        """
+        Get the cache key for a sequence
+        :param sequence: A Bio.SeqRecord.SeqRecord object
+        :param algorithm: str, name of the domain-finding algorithm, e.g. 'hmmer'
+        :param database_version: str, identifies the domain database (and any other inputs) used by the algorithm
+        :return: A hex digest string
+        """
+        h = hashlib.sha256()
+        for s in (algorithm, database_version, str(sequence.seq)):
+            h.update(s.encode('utf8') + b'\0')
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Get the cached hits for a key
+        :param key: A key, as returned by DomainCache.key
+        :return: A list of dicts (see DomainFinder.find_domains), without the 'query_id' key; None if not found
+        """
+        raise NotImplementedError('Subclasses must implement this.')
+
+    def put(self, key, hits):
+        """
+        Cache hits for a key
+        :param key: A key, as returned by DomainCache.key
+        :param hits: A list of dicts (see DomainFinder.find_domains), without the 'query_id' key
+        :return: None
+        """
+        raise NotImplementedError('Subclasses must implement this.')
+
+
+class SqliteDomainCache(DomainCache):
+    """
+    A DomainCache backed by a local SQLite database, with least-recently-used eviction once either the number of
+    entries or their total size exceeds the specified limits.
+    """
+
+    # Rather than timestamps (which may collide), we record accesses using a strictly increasing counter
+    _NEXT_ACCESSED = '(SELECT COALESCE(MAX(accessed), 0) + 1 FROM hits)'
+
+    def __init__(self, db_path, max_entries=None, max_size_mb=None):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_size = None if max_size_mb is None else max_size_mb * 1024 * 1024
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS hits '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed INTEGER NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS hits_accessed ON hits (accessed)')
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads, so we keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30)
+        return conn
+
+    def get(self, key):
+        with self._connection() as conn:
+            row = conn.execute('SELECT value FROM hits WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(f'UPDATE hits SET accessed = {self._NEXT_ACCESSED} WHERE key = ?', (key,))
+        return json.loads(row[0])
+
+    def put(self, key, hits):
+        value = json.dumps(hits)
+        with self._connection() as conn:
+            conn.execute(
+                f'INSERT OR REPLACE INTO hits (key, value, size, accessed) VALUES (?, ?, ?, {self._NEXT_ACCESSED})',
+                (key, value, len(value))
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        if self.max_entries is not None:
+            conn.execute(
+                'DELETE FROM hits WHERE key IN (SELECT key FROM hits ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+        if self.max_size is not None:
+            # Delete entries, least recently used first, while the total size is over the limit
+            conn.execute(
+                'DELETE FROM hits WHERE key IN ('
+                '  SELECT key FROM ('
+                '    SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS cumulative_size FROM hits'
+                '  ) WHERE cumulative_size > ?'
+                ')',
+                (self.max_size,)
+            )
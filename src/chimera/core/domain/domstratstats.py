@@ -3,16 +3,26 @@ import logging
 from subprocess import run
 from tempfile import NamedTemporaryFile
 from collections import defaultdict
-from Bio import SearchIO
 
 from chimera.core.domain import DomainFinder
+from chimera.core.domain.cache import file_checksum
+from chimera.core.domain.hmmerparser import parse_hmmscan_text, hmmscan_results
 from chimera import config
 
 logger = logging.getLogger(__name__)
 
 
 class DomStratStatsDomainFinder(DomainFinder):
-    def find_domains(self, sequences):
+
+    algorithm = 'domstratstats'
+
+    def database_version(self):
+        return ','.join(file_checksum(f) for f in (
+            os.path.join(config.dirs.data.pfam, 'Pfam-A.hmm'),
+            os.path.join(config.dirs.data.pfam, 'Pfam-A.hmm.dat')
+        ))
+
+    def _iter_domains(self, sequences):
         def read_filtered_domtab(filename):
             """
             Read a 'filtered' Hmmer domtab file (i.e. a Hmmer domtab files with arbitrary lines removed) as a dictionary.
@@ -98,35 +108,6 @@ class DomStratStatsDomainFinder(DomainFinder):
             logger.info(f'Wrote DomStratStats hmmscan results to temporary file = {f_intermediate1.name}')
             logger.info(f'Wrote hmmscan alignments to temporary file = {f_alignments.name}')
 
-            """
-            From http://biopython.org/DIST/docs/api/Bio.SearchIO-module.html:
-
-            SearchIO parses a search output file's contents into a hierarchy of four nested objects:
-                QueryResult represents a search query. This is the main object returned by the input functions and it
-                    contains all other objects.
-                Hit represents a database hit
-                HSP represents high-scoring alignment region(s) in the hit
-                HSPFragment represents a contiguous alignment within the HSP
-
-            The 'fragments' attribute of a QueryResult gives us all HSPFragment objects as a list.
-            """
-            alignment_qresults = SearchIO.parse(f_alignments.name, format='hmmer3-text')
-
-            # Create a dictionary of sequence strings so that we can get alignment information of any 'hit' in
-            # qresult (corresponding to Hmmer --domtab result) by consulting the corresponding entry in qresult
-            # alignments (corresponding to Hmmer stdout)
-            # TODO: There's probably a more direct way to do this using the Bio.SearchIO library
-
-            # A dict mapping (query_id, hit_id, hit_start, hit_end, query_start, query_end) => <query_seq_string>
-            # Note that <query_seq_string> may contain lowercase letters (for insertions) and hyphens for deletions.
-            alignments = {}
-            for alignment_qresult in alignment_qresults:
-                for f in alignment_qresult.fragments:
-                    key = alignment_qresult.id, f.hit_id, f.hit_start, f.hit_end, f.query_start, f.query_end
-                    if key in alignments:
-                        raise RuntimeError('Unexpected - a key with identical hit info already exists!')
-                    alignments[key] = str(f.query.seq)
-
             p2 = run([
                 'perl',
                 '1noOvs.pl',
@@ -156,34 +137,13 @@ class DomStratStatsDomainFinder(DomainFinder):
             logger.info(f'Obtaining list of dPUC2 hits from output file.')
             final_results = read_filtered_domtab(f_out.name)
 
-            results = []
-
-            qresults = SearchIO.parse(f_intermediate1.name, format='hmmscan3-domtab')
-            for qresult in qresults:
-                for hit in qresult.hits:
-                    for hsp in hit.hsps:
-
-                        # Is this HSP included in dPUC2 results? If so, add it to our results
-                        if hsp.domain_index in final_results[qresult.id][hit.id]:
-                            result = dict()
-                            result['query_id'] = qresult.id
-                            result['alihmmacc'] = hit.accession
-                            result['alihmmname'] = hit.id
-                            result['alisqfrom'] = hsp.query_start + 1  # 0-indexed inclusive -> 1-indexed inclusive
-                            result['alisqto'] = hsp.query_end  # 0-indexed exclusive -> 1-indexed inclusive
-                            result['alihmmfrom'] = hsp.hit_start + 1  # 0-indexed inclusive -> 1-indexed inclusive
-                            result['alihmmto'] = hsp.hit_end  # 0-indexed exclusive -> 1-indexed inclusive
-                            result['aliM'] = hit.seq_len
-                            result['bitscore'] = hsp.bitscore
-                            result['ievalue'] = hsp.evalue
-
-                            # Get alignment info from the dictionary we constructed from qresult_alignments
-                            key = qresult.id, hit.id, hsp.hit_start, hsp.hit_end, hsp.query_start, hsp.query_end
-                            if key not in alignments:
-                                raise RuntimeError(f'Alignment information for {key} not found!')
-                            result['aliaseq'] = alignments[key]
-
-                            results.append(result)
+            # The domain table written by hmmscan (and filtered by the scripts above) identifies the domains to keep;
+            # everything else, including alignments, is read in a single pass over the hmmscan text output.
+            domains = (
+                domain for domain in parse_hmmscan_text(f_alignments.name)
+                if domain.domain_index in final_results[domain.query_id][domain.hit_id]
+            )
+            yield from hmmscan_results(domains, pfam_hmm_path)
 
         finally:
             os.unlink(f_in.name)
@@ -196,5 +156,3 @@ class DomStratStatsDomainFinder(DomainFinder):
                     os.unlink(fname)
                 if os.path.exists(fname + '.gz'):
                     os.unlink(fname + '.gz')
-
-        return results
@@ -1,38 +1,120 @@
 import os
+import heapq
 import logging
 from subprocess import run
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import NamedTemporaryFile
-from Bio import SearchIO
 
 from . import DomainFinder
+from .cache import file_checksum
+from . import hmmerserver
+from .hmmerparser import parse_hmmscan_text, hmmscan_results
 from chimera import config
 
 logger = logging.getLogger(__name__)
 
 
+def shard_indices(sequences, n_shards):
+    """
+    Split sequences into shards with (approximately) equal total residue lengths.
+    Sequences are assigned longest-first to the shard with the smallest total length so far.
+    :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+    :param n_shards: int, maximum no. of shards
+    :return: A list of non-empty lists of (0-indexed) positions of sequences, each in ascending order
+    """
+    shards = [(0, i, []) for i in range(min(n_shards, len(sequences)))]
+    for i in sorted(range(len(sequences)), key=lambda i: len(sequences[i].seq), reverse=True):
+        total_length, shard_index, indices = heapq.heappop(shards)
+        indices.append(i)
+        heapq.heappush(shards, (total_length + len(sequences[i].seq), shard_index, indices))
+
+    return [sorted(indices) for _, _, indices in sorted(shards, key=lambda x: x[1])]
+
+
+def shard_sequences(sequences, n_shards):
+    """
+    Split sequences into shards with (approximately) equal total residue lengths (see shard_indices)
+    :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+    :param n_shards: int, maximum no. of shards
+    :return: A list of non-empty lists of Bio.SeqRecord.SeqRecord objects, each retaining the input order
+    """
+    return [[sequences[i] for i in indices] for indices in shard_indices(sequences, n_shards)]
+
+
 class HmmerDomainFinder(DomainFinder):
-    def find_domains(self, sequences):
 
+    algorithm = 'hmmer'
+
+    def database_version(self):
+        # Pfam-A.hmm.dat is optional (see hmm_metadata), but results depend on it if it's there
+        pfam_hmm_path = os.path.join(config.dirs.data.pfam, 'Pfam-A.hmm')
+        file_paths = [pfam_hmm_path]
+        if os.path.exists(pfam_hmm_path + '.dat'):
+            file_paths.append(pfam_hmm_path + '.dat')
+        return ','.join(file_checksum(f) for f in file_paths)
+
+    def _iter_domains(self, sequences):
+
+        # If a long-lived hmmscan server is configured, delegate to it
+        if config.hmmer.server:
+            yield from hmmerserver.find_domains(sequences)
+            return
+
+        # Small inputs (e.g. interactive queries) are not worth a concurrent full-Pfam hmmscan per shard
+        n_shards = min(config.hmmer.shards, -(-len(sequences) // config.hmmer.min_sequences_per_shard))
+        shards = shard_indices(sequences, n_shards)
+        if len(shards) <= 1:
+            for hits in self._hmmscan(sequences):
+                yield from hits
+            return
+
+        # Unless configured otherwise, shards split the available cores between them
+        cpus = config.hmmer.cpus_per_shard or max(1, (os.cpu_count() or 1) // len(shards))
+
+        logger.info(f'Running hmmscan on {len(sequences)} sequences in {len(shards)} shards, with {cpus} cpu(s) each')
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [executor.submit(self._hmmscan, [sequences[i] for i in shard], cpus) for shard in shards]
+            # Sequences are located by position (a shard, and a position within it) rather than by name, since names
+            # need not be unique
+            locations = {i: (future, j) for shard, future in zip(shards, futures) for j, i in enumerate(shard)}
+
+            # Yield results in the order of the input sequences, irrespective of how they were sharded, as soon as
+            # the shard containing each sequence is done
+            for i in range(len(sequences)):
+                future, j = locations[i]
+                yield from future.result()[j]
+
+    def _hmmscan(self, sequences, cpus=None):
+        """
+        Run hmmscan on sequences
+        :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+        :param cpus: No. of worker threads of hmmscan, or None for the 'hmmer.cpus_per_shard' config value (if any)
+        :return: A list of lists of dicts (see DomainFinder._iter_domains), one list per sequence
+        """
         f_in = NamedTemporaryFile(delete=False)
         f_alignments = NamedTemporaryFile(delete=False)
-        f_out = NamedTemporaryFile(delete=False)
 
-        for sequence in sequences:
-            f_in.write(f'>{sequence.name}\n{sequence.seq}\n\n'.encode('utf8'))
+        # Sequences are named by position, so that results map back to them even if their names are not unique
+        for i, sequence in enumerate(sequences):
+            f_in.write(f'>{i}\n{sequence.seq}\n\n'.encode('utf8'))
         f_in.close()
         logger.info(f'Wrote sequences to temporary file = {f_in.name}')
 
         pfam_hmm_path = os.path.join(config.dirs.data.pfam, 'Pfam-A.hmm')
         hmmscan_bin = os.path.join(config.dirs.bin.hmmr, 'hmmscan')
 
+        cpu_args = []
+        cpus = cpus or config.hmmer.cpus_per_shard
+        if cpus is not None:
+            cpu_args = ['--cpu', str(cpus)]
+
         try:
             p = run([
                 hmmscan_bin,
                 '--cut_ga',
+                *cpu_args,
                 '-o',
                 f_alignments.name,
-                '--domtblout',
-                f_out.name,
                 pfam_hmm_path,
                 f_in.name
             ], capture_output=True)
@@ -42,65 +124,14 @@ class HmmerDomainFinder(DomainFinder):
 
             logger.info(f'Wrote hmmscan stdout to temporary file = {f_alignments.name}')
 
-            """
-            From http://biopython.org/DIST/docs/api/Bio.SearchIO-module.html:
-
-            SearchIO parses a search output file's contents into a hierarchy of four nested objects:
-                QueryResult represents a search query. This is the main object returned by the input functions and it
-                    contains all other objects.
-                Hit represents a database hit
-                HSP represents high-scoring alignment region(s) in the hit
-                HSPFragment represents a contiguous alignment within the HSP
-
-            The 'fragments' attribute of a QueryResult gives us all HSPFragment objects as a list.
-            """
-            qresults = SearchIO.parse(f_out.name, format='hmmscan3-domtab')
-            alignment_qresults = SearchIO.parse(f_alignments.name, format='hmmer3-text')
-
-            # Create a dictionary of sequence strings so that we can get alignment information of any 'hit' in
-            # qresult (corresponding to Hmmer --domtab result) by consulting the corresponding entry in qresult
-            # alignments (corresponding to Hmmer stdout)
-            # TODO: There's probably a more direct way to do this using the Bio.SearchIO library
-
-            # A dict mapping (query_id, hit_id, hit_start, hit_end, query_start, query_end) => <query_seq_string>
-            # Note that <query_seq_string> may contain lowercase letters (for insertions) and hyphens for deletions.
-            alignments = {}
-            for alignment_qresult in alignment_qresults:
-                for f in alignment_qresult.fragments:
-                    key = alignment_qresult.id, f.hit_id, f.hit_start, f.hit_end, f.query_start, f.query_end
-                    if key in alignments:
-                        raise RuntimeError('Unexpected - a key with identical hit info already exists!')
-                    alignments[key] = str(f.query.seq)
-
-            results = []
-            for qresult in qresults:
-                for hit in qresult.hits:
-                    for hsp in hit.hsps:
-                        result = dict()
-                        result['query_id'] = qresult.id
-                        result['alihmmacc'] = hit.accession
-                        result['alihmmname'] = hit.id
-                        result['alisqfrom'] = hsp.query_start + 1  # 0-indexed inclusive -> 1-indexed inclusive
-                        result['alisqto'] = hsp.query_end          # 0-indexed exclusive -> 1-indexed inclusive
-                        result['alihmmfrom'] = hsp.hit_start + 1   # 0-indexed inclusive -> 1-indexed inclusive
-                        result['alihmmto'] = hsp.hit_end           # 0-indexed exclusive -> 1-indexed inclusive
-                        result['aliM'] = hit.seq_len
-                        result['bitscore'] = hsp.bitscore
-                        result['ievalue'] = hsp.evalue
-
-                        # Get alignment info from the dictionary we constructed from qresult_alignments
-                        key = qresult.id, hit.id, hsp.hit_start, hsp.hit_end, hsp.query_start, hsp.query_end
-                        if key not in alignments:
-                            raise RuntimeError(f'Alignment information for {key} not found!')
-                        result['aliaseq'] = alignments[key]
-
-                        # TODO: The old Interacdome website does the following filtering of results for Hmmer
-                        if result['bitscore'] > 0:
-                            results.append(result)
+            results = [[] for _ in sequences]
+            for result in hmmscan_results(parse_hmmscan_text(f_alignments.name), pfam_hmm_path):
+                # TODO: The old Interacdome website does the following filtering of results for Hmmer
+                if result['bitscore'] > 0:
+                    i = int(result['query_id'])
+                    results[i].append(dict(result, query_id=sequences[i].name))
+            return results
 
         finally:
             os.unlink(f_in.name)
             os.unlink(f_alignments.name)
-            os.unlink(f_out.name)
-
-        return results
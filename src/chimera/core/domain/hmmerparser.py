@@ -0,0 +1,159 @@
+"""
+A streaming parser for the (hmmer3-text) output of hmmscan.
+
+The text output of hmmscan has all per-domain coordinates, scores and alignments, so a single pass over it
+gives us everything we need. The only two pieces of information missing from it are the accession and length of
+each HMM, which we read (once) from the Pfam-A.hmm.dat file that accompanies the HMM database.
+"""
+import os
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# A single domain hit, with 1-indexed inclusive coordinates
+HmmscanDomain = namedtuple('HmmscanDomain', [
+    'query_id',      # str, query id, e.g. 'ctcf'
+    'hit_id',        # str, HMM name, e.g. 'zf-H2C2_2'
+    'domain_index',  # int, 1-indexed no. of this domain among domains of this HMM for this query
+    'hmm_from',      # int
+    'hmm_to',        # int
+    'ali_from',      # int
+    'ali_to',        # int
+    'bitscore',      # float
+    'ievalue',       # float
+    'aliseq'         # str, may contain lowercase letters (for insertions) and hyphens (for deletions)
+])
+
+# A dict mapping (<file_path>, <file_size>, <file_mtime_ns>) => {<hmm_name> => (<accession>, <length>)}
+_hmm_metadata = {}
+
+
+def hmm_metadata(pfam_hmm_path):
+    """
+    Get the accession and length of each HMM in an HMM database (memoized unless the underlying file changes).
+    The information is read from <pfam_hmm_path>.dat (in Stockholm-like format, as distributed with Pfam) if it exists,
+    or from the HMM headers in the database itself otherwise. HMMs without an accession are skipped, with a warning.
+    :param pfam_hmm_path: Path to an HMM database, e.g. Pfam-A.hmm
+    :return: A dict mapping <hmm_name> => (<accession>, <length>)
+    """
+    dat_path = pfam_hmm_path + '.dat'
+    if os.path.exists(dat_path):
+        file_path, name_tag, acc_tag, length_tag = dat_path, '#=GF ID', '#=GF AC', '#=GF ML'
+    else:
+        file_path, name_tag, acc_tag, length_tag = pfam_hmm_path, 'NAME', 'ACC', 'LENG'
+
+    stat = os.stat(file_path)
+    key = os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+    if key not in _hmm_metadata:
+        logger.info(f'Reading HMM metadata from {file_path}')
+        metadata = {}
+        name = acc = None
+        with open(file_path, 'r') as f:
+            for line in f:
+                if line.startswith(name_tag):
+                    name, acc = line[len(name_tag):].strip(), None
+                elif line.startswith(acc_tag):
+                    acc = line[len(acc_tag):].strip()
+                elif line.startswith(length_tag):
+                    if acc is None:
+                        logger.warning(f'No accession found for HMM {name} in {file_path}, skipping')
+                    else:
+                        metadata[name] = acc, int(line[len(length_tag):].strip())
+        _hmm_metadata[key] = metadata
+
+    return _hmm_metadata[key]
+
+
+def parse_hmmscan_text(filename):
+    """
+    Parse hmmscan (hmmer3-text) output, yielding domain hits as they are encountered.
+    :param filename: Path to a file containing hmmscan output (i.e. the file specified by the -o flag)
+    :return: A generator of HmmscanDomain objects
+    """
+    query_id = hit_id = None
+    domain_rows = {}     # domain_index => row of the domain table of the current hit
+    domain_index = None  # domain_index of the alignment being read
+    aliseq = []          # (wrapped) chunks of the aligned query sequence for the current domain
+    block = []           # lines of the alignment block being read
+
+    def _domain():
+        row = domain_rows[domain_index]
+        return HmmscanDomain(
+            query_id=query_id,
+            hit_id=hit_id,
+            domain_index=domain_index,
+            hmm_from=int(row[6]),
+            hmm_to=int(row[7]),
+            ali_from=int(row[9]),
+            ali_to=int(row[10]),
+            bitscore=float(row[2]),
+            ievalue=float(row[5]),
+            aliseq=''.join(aliseq)
+        )
+
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+
+            if domain_index is not None:
+                if line.startswith('  == domain') or line.startswith('>>') or \
+                        line.startswith('Internal pipeline statistics') or line.startswith('//'):
+                    yield _domain()
+                    domain_index, aliseq, block = None, [], []
+                elif block or (line.strip() and not line.endswith((' CS', ' RF'))):
+                    # Reading an alignment - each (wrapped) block is, after any optional CS/RF annotation lines:
+                    #   <hit_id> <from> <aligned_hmm> <to>
+                    #   <match line>, which may be blank and may end in anything (including ' PP')
+                    #   <query_id> <from> <aligned_seq> <to>
+                    #   <posterior probabilities> PP
+                    # so lines are identified by their position in the block, rather than by their content.
+                    block.append(line)
+                    if len(block) == 4:
+                        model_cols, seq_cols = block[0].split(), block[2].split()
+                        if model_cols[0] != hit_id or seq_cols[0] != query_id or not block[3].endswith(' PP'):
+                            raise RuntimeError(f'Unexpected alignment block for {query_id}/{hit_id} in {filename}')
+                        aliseq.append(seq_cols[2])
+                        block = []
+
+            if line.startswith('Query:'):
+                query_id = line.split()[1]
+            elif line.startswith('>>'):
+                hit_id = line.split()[1]
+                domain_rows = {}
+            elif line.startswith('  == domain'):
+                domain_index = int(line.split()[2])
+            elif domain_index is None:
+                cols = line.split()
+                # Domain table rows, e.g.:
+                #   #    score  bias  c-Evalue  i-Evalue hmmfrom  hmm to    alifrom  ali to    envfrom  env to     acc
+                #   1 !   16.1   0.1   7.4e-07    0.0055       1      26 []     281     307 ..     281     307 .. 0.92
+                if len(cols) == 16 and cols[0].isdigit() and cols[1] in ('!', '?'):
+                    domain_rows[int(cols[0])] = cols
+
+
+def hmmscan_results(domains, pfam_hmm_path):
+    """
+    Convert HmmscanDomain objects to results as yielded by DomainFinder._iter_domains
+    :param domains: An iterable of HmmscanDomain objects
+    :param pfam_hmm_path: Path to the HMM database that was searched, e.g. Pfam-A.hmm
+    :return: A generator of dicts
+    """
+    metadata = hmm_metadata(pfam_hmm_path)
+    for domain in domains:
+        if domain.hit_id not in metadata:
+            raise RuntimeError(f'Metadata (accession and length) for {domain.hit_id} not found!')
+        accession, length = metadata[domain.hit_id]
+        yield {
+            'query_id': domain.query_id,
+            'alihmmacc': accession,
+            'alihmmname': domain.hit_id,
+            'alisqfrom': domain.ali_from,
+            'alisqto': domain.ali_to,
+            'alihmmfrom': domain.hmm_from,
+            'alihmmto': domain.hmm_to,
+            'aliM': length,
+            'bitscore': domain.bitscore,
+            'ievalue': domain.ievalue,
+            'aliaseq': domain.aliseq
+        }
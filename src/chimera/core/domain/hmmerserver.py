@@ -0,0 +1,205 @@
+"""
+A long-lived hmmscan server, which loads the Pfam database once and then serves domain-finding requests over a
+local (unix) or TCP socket, so that individual requests don't pay the cost of hmmscan start-up and re-reading
+the (pressed) Pfam database.
+
+The server is started with:
+
+    python -m chimera.core.domain.hmmerserver --address /tmp/chimera_hmmer.sock
+
+and used by HmmerDomainFinder when the 'hmmer.server' config value (CHIMERA_HMMER_SERVER) is set to the same address.
+Scanning is done in-process through the pyhmmer bindings to the HMMER library (pip install chimera[server]).
+
+Requests are exchanged as pickles, so a server on a TCP socket requires clients to authenticate with the
+'hmmer.server_authkey' config value (CHIMERA_HMMER_SERVER_AUTHKEY). Access to a unix socket is governed by its file
+permissions.
+"""
+import os
+import logging
+import argparse
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from chimera import config
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    """
+    Parse a server address
+    :param address: str, either a <host>:<port> string for a TCP socket, or a path for a unix socket
+    :return: A (host, port) tuple or a path string, as expected by multiprocessing.connection
+    """
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def _check_authkey(address, authkey):
+    # Anyone who can connect to a server can have it unpickle arbitrary data, so TCP sockets must be authenticated
+    if isinstance(parse_address(address), tuple) and not authkey:
+        raise RuntimeError(f'An authkey (CHIMERA_HMMER_SERVER_AUTHKEY) is required for TCP address {address}')
+
+
+class HmmerServer:
+
+    def __init__(self, pfam_hmm_path, cut_ga=True, cpus=0):
+        """
+        :param pfam_hmm_path: Path to the Pfam-A.hmm file
+        :param cut_ga: Whether to use the gathering threshold of each model for reporting/inclusion (hmmscan --cut_ga)
+        :param cpus: No. of threads to use for scanning (0 to use all available cores)
+        """
+        from pyhmmer import easel, plan7
+
+        self.alphabet = easel.Alphabet.amino()
+        self.cut_ga = cut_ga
+        self.cpus = cpus
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._address = self._authkey = None
+
+        logger.info(f'Loading HMMs from {pfam_hmm_path}')
+        background = plan7.Background(self.alphabet)
+        self.profiles = []
+        with plan7.HMMFile(pfam_hmm_path) as f:
+            for hmm in f:
+                profile = plan7.Profile(hmm.M, self.alphabet)
+                profile.configure(hmm, background)
+                self.profiles.append(profile.to_optimized())
+        logger.info(f'Loaded {len(self.profiles)} HMMs')
+
+    def find_domains(self, sequences):
+        """
+        Find domains for one or more sequences
+        :param sequences: A list of (<name>, <sequence_string>) tuples
+        :return: A list of dicts, as yielded by DomainFinder._iter_domains
+        """
+        from pyhmmer import easel, hmmscan
+
+        queries = [
+            easel.TextSequence(name=name, sequence=seq).digitize(self.alphabet)
+            for name, seq in sequences
+        ]
+
+        results = []
+        with self._lock:
+            top_hits = hmmscan(queries, self.profiles, cpus=self.cpus,
+                               bit_cutoffs='gathering' if self.cut_ga else None)
+
+            for (name, _), hits in zip(sequences, top_hits):
+                for hit in hits.reported:
+                    for domain in hit.domains.reported:
+                        alignment = domain.alignment
+                        result = {
+                            'query_id': name,
+                            'alihmmacc': _str(hit.accession),
+                            'alihmmname': _str(hit.name),
+                            'alisqfrom': alignment.target_from,
+                            'alisqto': alignment.target_to,
+                            'alihmmfrom': alignment.hmm_from,
+                            'alihmmto': alignment.hmm_to,
+                            'aliM': alignment.hmm_length,
+                            'bitscore': domain.score,
+                            'ievalue': domain.i_evalue,
+                            'aliaseq': alignment.target_sequence
+                        }
+
+                        # TODO: The old Interacdome website does the following filtering of results for Hmmer
+                        if result['bitscore'] > 0:
+                            results.append(result)
+
+        return results
+
+    def serve_forever(self, address, authkey=None):
+        """
+        Serve requests on an address until interrupted. Each connection is handled in its own thread.
+        :param address: Address to listen on (see parse_address)
+        :param authkey: bytes, used to authenticate clients. Required for TCP addresses, optional for unix sockets.
+        """
+        _check_authkey(address, authkey)
+        self._stopped.clear()
+        self._address, self._authkey = address, authkey
+        with Listener(parse_address(address), authkey=authkey) as listener:
+            logger.info(f'Listening on {address}')
+            while not self._stopped.is_set():
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as e:
+                    logger.warning(f'Rejected connection ({e!r})')
+                    continue
+                if self._stopped.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        logger.info(f'Stopped listening on {address}')
+
+    def shutdown(self):
+        """
+        Stop a server running serve_forever (in another thread) from accepting connections. Connections that are
+        already open are not interrupted.
+        """
+        self._stopped.set()
+        # Wake up the listener, which is blocked waiting for a connection
+        Client(parse_address(self._address), authkey=self._authkey).close()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    break
+                try:
+                    conn.send(('ok', self.find_domains(request)))
+                except Exception as e:
+                    logger.exception('Error handling request')
+                    conn.send(('error', str(e)))
+
+
+def _str(s):
+    # Depending on the pyhmmer version, names/accessions are bytes or str
+    return s.decode('utf8') if isinstance(s, bytes) else s
+
+
+def _authkey():
+    authkey = config.hmmer.server_authkey
+    return authkey.encode('utf8') if authkey else None
+
+
+def find_domains(sequences, address=None):
+    """
+    Find domains for one or more sequences using a running HmmerServer
+    :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+    :param address: Address of the server (see parse_address), by default the 'hmmer.server' config value
+    :return: A list of dicts, as yielded by DomainFinder._iter_domains
+    """
+    address = address or config.hmmer.server
+    authkey = _authkey()
+    _check_authkey(address, authkey)
+    with Client(parse_address(address), authkey=authkey) as conn:
+        conn.send([(sequence.name, str(sequence.seq)) for sequence in sequences])
+        status, results = conn.recv()
+
+    if status != 'ok':
+        raise RuntimeError(f'Hmmer server error: {results}')
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run a long-lived hmmscan server')
+    parser.add_argument('--address', default=config.hmmer.server,
+                        help='<host>:<port> or unix socket path to listen on')
+    parser.add_argument('--hmm', default=os.path.join(config.dirs.data.pfam, 'Pfam-A.hmm'), help='Path to Pfam-A.hmm')
+    parser.add_argument('--cpus', type=int, default=0, help='No. of scanning threads (0 for all cores)')
+    args = parser.parse_args()
+
+    if not args.address:
+        parser.error('No address specified')
+    # Fail before (rather than after) loading the HMMs
+    _check_authkey(args.address, _authkey())
+
+    HmmerServer(args.hmm, cpus=args.cpus).serve_forever(args.address, authkey=_authkey())
@@ -1,65 +1,142 @@
+import os
+import time
 import logging
+import threading
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 from . import DomainFinder
+from chimera import config
 
 logger = logging.getLogger(__name__)
 
+# HTTP status codes on which we retry a request (after backing off), since they indicate a transient condition
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# A dict mapping (<pid>, <pool size>) => requests.Session, shared by all finders in a process, since finders are
+# typically short-lived (e.g. one per query). Sessions are keyed by pid so that a forked worker never reuses
+# connections opened by its parent.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _session(pool_maxsize):
+    """
+    Get the session (with a pooled connection adapter) for a connection pool size, creating it if needed
+    :param pool_maxsize: Maximum no. of connections kept in the pool, i.e. of concurrent requests
+    :return: A requests.Session object
+    """
+    key = os.getpid(), pool_maxsize
+    with _sessions_lock:
+        if key not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return _sessions[key]
+
 
 class HmmerWebDomainFinder(DomainFinder):
 
-    def find_domains(self, sequences):
-        results = []
-        for sequence in sequences:
-
-            # TODO: Does HmmerWeb support a single POST call with multiple sequences?
-            logger.info(f'Making Hmmer web call for sequence {sequence.name}')
-            response = requests.post(
-                'https://www.ebi.ac.uk/Tools/hmmer/search/hmmscan',
-                headers={'Content-type': 'application/json', 'Accept': 'application/json'},
-                data=json.dumps({
-                    'hmmdb': 'pfam',
-                    'cut_ga': True,
-                    'seq': str(sequence.seq)
-                }),
-            )
-
-            d = response.json()
-            logger.info(f'Hmmr Web API response for sequence {sequence.name} obtained')
-
-            hits = d['results']['hits']
-
-            # The Hmmer Web call returns way more results than a locally run 'hmmscan --cut_ga'.
-            # This is because it includes records with 'is_included' = 0, which we need to filter out
-
-            # TODO: There's probably a way to enhance the POST call above with extra params, to directly take
-            # care of this.
-
-            for hit in hits:
-
-                # 'nincluded' key for each 'hit' tells us how many records in the 'domains' key
-                # will have is_included = 1, so we need not enter the inner loop
-
-                if hit['nincluded'] > 0:
-                    for record in hit['domains']:
-                        if record['is_included']:
-                            result = {
-                                'query_id': sequence.name,
-                                'alihmmacc': record['alihmmacc'],
-                                'alihmmname': record['alihmmname'],
-                                'alisqfrom': int(record['alisqfrom']),
-                                'alisqto': int(record['alisqto']),
-                                'alihmmfrom': int(record['alihmmfrom']),
-                                'alihmmto': int(record['alihmmto']),
-                                'aliM': int(record['aliM']),
-                                'bitscore': float(record['bitscore']),
-                                'ievalue': float(record['ievalue']),
-                                'aliaseq': record['aliaseq'],
-                            }
-
-                            # TODO: The old Interacdome website does the following filtering of results for Hmmer
-                            if result['bitscore'] > 0:
-                                results.append(result)
-
-        return results
+    algorithm = 'hmmerweb'
+
+    def __init__(self, cache=None, url=None, max_workers=None, retries=None, backoff_factor=None, timeout=None):
+        """
+        :param cache: See DomainFinder
+        :param url: URL of the Hmmer Web hmmscan endpoint (by default the 'hmmerweb.url' config value)
+        :param max_workers: Maximum no. of concurrent requests (by default the 'hmmerweb.max_workers' config value)
+        :param retries: No. of times a failed request is retried (by default the 'hmmerweb.retries' config value)
+        :param backoff_factor: Retry no. i (0-indexed) is made after backoff_factor * 2**i seconds
+            (by default the 'hmmerweb.backoff_factor' config value)
+        :param timeout: Timeout (in seconds) of each individual request (by default the 'hmmerweb.timeout' config value)
+        """
+        super().__init__(cache=cache)
+        self.url = url or config.hmmerweb.url
+        self.max_workers = max_workers or config.hmmerweb.max_workers
+        self.retries = config.hmmerweb.retries if retries is None else retries
+        self.backoff_factor = config.hmmerweb.backoff_factor if backoff_factor is None else backoff_factor
+        self.timeout = timeout or config.hmmerweb.timeout
+
+    @property
+    def session(self):
+        # A session, with a connection pool large enough for all concurrent requests, is reused across calls (and
+        # finders) in a process
+        return _session(self.max_workers)
+
+    def _post(self, sequence):
+        """
+        Make a Hmmer Web call for a single sequence, retrying (with exponential backoff) on timeouts, connection errors
+        and transient HTTP errors.
+        :param sequence: A Bio.SeqRecord.SeqRecord object
+        :return: The decoded JSON response, a dict
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                logger.info(f'Making Hmmer web call for sequence {sequence.name}')
+                response = self.session.post(
+                    self.url,
+                    headers={'Content-type': 'application/json', 'Accept': 'application/json'},
+                    data=json.dumps({
+                        'hmmdb': 'pfam',
+                        'cut_ga': True,
+                        'seq': str(sequence.seq)
+                    }),
+                    timeout=self.timeout
+                )
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    logger.info(f'Hmmr Web API response for sequence {sequence.name} obtained')
+                    return response.json()
+                error = f'HTTP {response.status_code}'
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+
+            if attempt < self.retries:
+                delay = self.backoff_factor * 2 ** attempt
+                logger.warning(f'Hmmer web call for sequence {sequence.name} failed ({error}), retrying in {delay}s')
+                time.sleep(delay)
+
+        raise RuntimeError(f'Hmmer web call for sequence {sequence.name} failed after {self.retries + 1} attempts')
+
+    def _iter_domains(self, sequences):
+        # TODO: Does HmmerWeb support a single POST call with multiple sequences?
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Responses are processed in the order of the input sequences, while later requests are still in flight
+            for sequence, d in zip(sequences, executor.map(self._post, sequences)):
+
+                hits = d['results']['hits']
+
+                # The Hmmer Web call returns way more results than a locally run 'hmmscan --cut_ga'.
+                # This is because it includes records with 'is_included' = 0, which we need to filter out
+
+                # TODO: There's probably a way to enhance the POST call above with extra params, to directly take
+                # care of this.
+
+                for hit in hits:
+
+                    # 'nincluded' key for each 'hit' tells us how many records in the 'domains' key
+                    # will have is_included = 1, so we need not enter the inner loop
+
+                    if hit['nincluded'] > 0:
+                        for record in hit['domains']:
+                            if record['is_included']:
+                                result = {
+                                    'query_id': sequence.name,
+                                    'alihmmacc': record['alihmmacc'],
+                                    'alihmmname': record['alihmmname'],
+                                    'alisqfrom': int(record['alisqfrom']),
+                                    'alisqto': int(record['alisqto']),
+                                    'alihmmfrom': int(record['alihmmfrom']),
+                                    'alihmmto': int(record['alihmmto']),
+                                    'aliM': int(record['aliM']),
+                                    'bitscore': float(record['bitscore']),
+                                    'ievalue': float(record['ievalue']),
+                                    'aliaseq': record['aliaseq'],
+                                }
+
+                                # TODO: The old Interacdome website does the following filtering of results for Hmmer
+                                if result['bitscore'] > 0:
+                                    yield result
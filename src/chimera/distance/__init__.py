@@ -1,18 +1,23 @@
-from collections import defaultdict
 import numpy as np
 from math import e, pi, sqrt
 from scipy.integrate import quad
+from scipy.special import ndtr
+from scipy.spatial import cKDTree
+import os
 import gzip
 import io
+import json
 import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import NamedTemporaryFile
 from tqdm import tqdm
 import pandas as pd
 
-from prody import parsePDB
-from prody.atomic.hierview import HierView
-from prody.atomic import AAMAP
-
-from chimera.utils import vdw_radius
+from chimera import config
+from chimera.utils import vdw_radii
+from chimera.core.domain.cache import file_checksum
+from chimera.distance.structure import structure_cache
 
 # Constant factor used for PDF calculation for a normal distribution. Pre-computed here once.
 NORM_PDF_FACTOR = 1.0/sqrt(2*pi)
@@ -52,6 +57,34 @@ ANNOTATION_COLUMNS = [
 ]
 
 
+# Columns of a distance file, in order
+DISTANCE_COLUMNS = [
+    'pdbID-pdbChain',
+    'receptor_aa_1-index',
+    'receptor_aa_value',
+    'receptor_atom_id',
+    'receptor_atom_value',
+    'ligand_id',
+    'ligand_atom_value',
+    'euclidean_distance',
+    'overlap_vdw_radii',
+    'integral_error_vdw_radii',
+    'overlap_1.5',
+    'integral_error_1.5',
+    'full_receptor_sequence'
+]
+
+# Columns of a distance file with few distinct values, which are dictionary-encoded in Parquet distance files
+CATEGORICAL_DISTANCE_COLUMNS = [
+    'pdbID-pdbChain',
+    'receptor_aa_value',
+    'receptor_atom_id',
+    'receptor_atom_value',
+    'ligand_id',
+    'ligand_atom_value'
+]
+
+
 def distance_df_to_csv(df, pdb_id, file_path, compressed=False):
 
     def _format_integral(x):
@@ -91,18 +124,58 @@ def distance_df_to_csv(df, pdb_id, file_path, compressed=False):
                         'full_receptor_sequence']) + '\n').encode('utf8'))
 
     df = df.copy()
-    df['overlap_vdw_radii'] = df.apply(lambda row: _format_integral(row['overlap_vdw_radii']), axis=1)
-    df['integral_error_vdw_radii'] = df.apply(lambda row: _format_error(row['integral_error_vdw_radii']), axis=1)
-    df['overlap_1.5'] = df.apply(lambda row: _format_integral(row['overlap_1.5']), axis=1)
-    df['integral_error_1.5'] = df.apply(lambda row: _format_error(row['integral_error_1.5']), axis=1)
+    df['overlap_vdw_radii'] = [_format_integral(x) for x in df['overlap_vdw_radii']]
+    df['integral_error_vdw_radii'] = [_format_error(x) for x in df['integral_error_vdw_radii']]
+    df['overlap_1.5'] = [_format_integral(x) for x in df['overlap_1.5']]
+    df['integral_error_1.5'] = [_format_error(x) for x in df['integral_error_1.5']]
 
     _f = io.StringIO()
-    df[['pdbID-pdbChain', 'receptor_aa_1-index', 'receptor_aa_value', 'receptor_atom_id', 'receptor_atom_value', 'ligand_id', 'ligand_atom_value', 'euclidean_distance', 'overlap_vdw_radii', 'integral_error_vdw_radii', 'overlap_1.5', 'integral_error_1.5', 'full_receptor_sequence']].to_csv(_f, sep='\t', header=False, index=False)
+    df[DISTANCE_COLUMNS].to_csv(_f, sep='\t', header=False, index=False)
     _f.seek(0)
     f.write(_f.read().encode('utf8'))
     f.close()
 
 
+def distance_df_to_parquet(df, pdb_id, file_path):
+    """
+    Write a distance DataFrame (as returned by create_distance_file) to a Parquet file, with the columns of the legacy
+    text format. Low-cardinality string columns are dictionary-encoded, and distances are stored as float32.
+    :param df: A DataFrame, as returned by create_distance_file
+    :param pdb_id: pdb id, saved in the file metadata
+    :param file_path: Path to the output file
+    :return: None
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = df[DISTANCE_COLUMNS].astype({
+        **{c: 'category' for c in CATEGORICAL_DISTANCE_COLUMNS},
+        'receptor_aa_1-index': 'int32',
+        'euclidean_distance': 'float32'
+    })
+    # As in text distance files, where the sequence is only present in the first row of each chain
+    df['full_receptor_sequence'] = df['full_receptor_sequence'].where(df['full_receptor_sequence'] != '', None)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'pdb_id': pdb_id.encode('utf8')})
+    pq.write_table(table, file_path)
+
+
+def read_distance_file(file_path):
+    """
+    Read a distance file, either in the legacy (optionally gzipped) text format, or in Parquet format (by extension)
+    :param file_path: Path to a distance file, e.g. 2lue_distances.txt.gz or 2lue_distances.parquet
+    :return: A DataFrame with columns DISTANCE_COLUMNS
+    """
+    file_path = str(file_path)
+    if file_path.endswith('.parquet'):
+        return pd.read_parquet(file_path)
+
+    _open = gzip.open if file_path.endswith('.gz') else open
+    with _open(file_path, 'rt') as f:
+        return pd.read_csv(f, header=None, comment='#', sep='\t', names=DISTANCE_COLUMNS)
+
+
 def minf1f2(x, mu2, sd1, sd2):
     min_value = min(e**(-(x**2)/(2*sd1**2))/sd1, e**(-(x-mu2)**2/(2*sd2**2))/sd2)
     return NORM_PDF_FACTOR * min_value
@@ -123,188 +196,531 @@ def overlap_radii(dist, r1, r2):
     )
 
 
-def create_distance_file(pdb_id, pdb_chains, receptor_filepaths, ligand_ids, ligand_filepaths, distance_filepath, include_backbone=False, distance_cutoff=20, compressed=True, calculate_overlap=True):
-
-    _rows = []
+def overlap_radii_analytic(dist, r1, r2):
+    """
+    Overlap area between normal distributions centered at 0 and dist, with standard deviations r1 and r2,
+    calculated in closed form (using the points where the two PDFs intersect, and the normal CDF).
+    All arguments can be scalars or arrays (broadcast against each other).
+    :param dist: Distance between the centers of the two distributions
+    :param r1: Standard deviation of the first distribution
+    :param r2: Standard deviation of the second distribution
+    :return: A float array of overlap areas
+    """
+    dist, r1, r2 = np.broadcast_arrays(np.abs(np.asarray(dist, dtype=float)), np.asarray(r1, dtype=float),
+                                       np.asarray(r2, dtype=float))
+    # The overlap area is unchanged if we swap the distributions (and reflect about dist/2), so we place the narrower
+    # distribution at 0, and the wider distribution at dist.
+    sd_n, sd_w = np.minimum(r1, r2), np.maximum(r1, r2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # For unequal standard deviations, the PDFs intersect at the 2 roots of a*x**2 + b*x + c = 0; the narrower
+        # distribution is the smaller one outside the roots, and the wider one between them.
+        a = 1 / (2 * sd_w ** 2) - 1 / (2 * sd_n ** 2)
+        b = -dist / sd_w ** 2
+        c = dist ** 2 / (2 * sd_w ** 2) - np.log(sd_n / sd_w)
+        q = -0.5 * (b + np.where(b >= 0, 1, -1) * np.sqrt(b ** 2 - 4 * a * c))  # numerically stable roots
+        x1, x2 = np.minimum(q / a, c / q), np.maximum(q / a, c / q)
+        unequal = ndtr(x1 / sd_n) + (ndtr((x2 - dist) / sd_w) - ndtr((x1 - dist) / sd_w)) + ndtr(-x2 / sd_n)
+
+        # For equal standard deviations, the PDFs intersect (only) at dist/2
+        equal = 2 * ndtr(-dist / (2 * sd_n))
+
+    return np.where(sd_n == sd_w, equal, unequal)
+
+
+class OverlapTable:
+    """
+    A lookup table of overlap areas (see overlap_radii_analytic) on a fine, regular grid of distances, for pairs of
+    standard deviations (in practice, the finite set of VDW radii in vdw.txt, and 1.5).
+
+    Tables for each pair of standard deviations are computed the first time they're needed, and (optionally)
+    persisted to disk, so that they're shared across structures and processes. Overlap areas are then obtained by
+    interpolating log-overlaps linearly between grid points, which is accurate to a relative error of ~1e-6 for the
+    default grid.
+    """
+
+    def __init__(self, path=None, max_distance=20, step=0.001):
+        """
+        :param path: Path to a .npz file where tables are persisted (created if needed), or None to keep tables in
+            memory only
+        :param max_distance: Maximum distance covered by the grid; overlaps for larger distances are calculated directly
+        :param step: Spacing of the distance grid
+        """
+        self.path = path
+        self.max_distance = max_distance
+        self.step = step
+        self.distances = np.arange(int(round(max_distance / step)) + 1) * step
+
+        # Log-overlaps at self.distances, one row for each (<sd1>, <sd2>) pair (with sd1 <= sd2) in self.rows
+        self.rows = {}
+        self.values = np.empty((0, len(self.distances)))
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with np.load(path) as data:
+                if np.array_equal(data['distances'], self.distances):
+                    keys = [key for key in data.files if key != 'distances']
+                    self.rows = {tuple(map(float, key.split('_'))): i for i, key in enumerate(keys)}
+                    self.values = np.array([data[key] for key in keys]).reshape(-1, len(self.distances))
+                else:
+                    logger.warning(f'Ignoring overlap table {path} computed on a different distance grid')
+
+    def _add(self, pairs):
+        with self._lock:
+            pairs = [pair for pair in pairs if pair not in self.rows]
+            if not pairs:
+                return
+            logger.info(f'Calculating overlap tables for standard deviations {pairs}')
+            values = [np.log(np.maximum(overlap_radii_analytic(self.distances, *pair), np.finfo(float).tiny))
+                      for pair in pairs]
+            self.values = np.vstack([self.values] + values)
+            self.rows.update({pair: len(self.rows) + i for i, pair in enumerate(pairs)})
+            if self.path is not None:
+                self._save()
+
+    def _save(self):
+        # Write to a temporary file first, so that concurrent readers never see a partially written table
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with NamedTemporaryFile(dir=directory, suffix='.npz', delete=False) as f:
+            np.savez(f, distances=self.distances,
+                     **{f'{sd1!r}_{sd2!r}': self.values[i] for (sd1, sd2), i in self.rows.items()})
+        os.replace(f.name, self.path)
+
+    def lookup(self, dist, r1, r2):
+        """
+        Look up overlap areas between normal distributions centered at 0 and dist, with standard deviations r1 and r2
+        :param dist: An array-like of distances between the centers of the distributions
+        :param r1: An array-like (or scalar) of standard deviations of the first distribution
+        :param r2: An array-like (or scalar) of standard deviations of the second distribution
+        :return: A float array of overlap areas
+        """
+        dist, r1, r2 = np.broadcast_arrays(np.abs(np.asarray(dist, dtype=float)), np.asarray(r1, dtype=float),
+                                           np.asarray(r2, dtype=float))
+        sd1, sd2 = np.minimum(r1, r2), np.maximum(r1, r2)
+
+        sd1_codes, sd1_values = pd.factorize(sd1)
+        sd2_codes, sd2_values = pd.factorize(sd2)
+        pair_codes, pair_inverse = np.unique(sd1_codes * len(sd2_values) + sd2_codes, return_inverse=True)
+        pairs = [(float(sd1_values[code // len(sd2_values)]), float(sd2_values[code % len(sd2_values)]))
+                 for code in pair_codes]
+        self._add(pairs)
+
+        rows = np.array([self.rows[pair] for pair in pairs], dtype=int).reshape(-1)[pair_inverse.reshape(-1)]
+        x = np.minimum(dist, self.max_distance) / self.step
+        i = np.minimum(x.astype(int), len(self.distances) - 2)
+        t = x - i
+        results = np.exp((1 - t) * self.values[rows, i] + t * self.values[rows, i + 1])
+
+        beyond = dist > self.max_distance
+        if beyond.any():
+            results[beyond] = overlap_radii_analytic(dist[beyond], sd1[beyond], sd2[beyond])
+        return results
+
+
+# A dict mapping (<path>, <max_distance>, <step>) => OverlapTable, shared across structures
+_overlap_tables = {}
+
+
+def overlap_table(max_distance=20, step=0.001):
+    """
+    Get the OverlapTable persisted at the path configured in the config file (under cache.overlaps), or an in-memory
+    OverlapTable if no such path is configured. Tables are shared by all calls in a process.
+    :param max_distance: Maximum distance covered by the grid
+    :param step: Spacing of the distance grid
+    :return: An OverlapTable object
+    """
+    path = config.cache.overlaps.path or None
+    key = path, max_distance, step
+    if key not in _overlap_tables:
+        _overlap_tables[key] = OverlapTable(path=path, max_distance=max_distance, step=step)
+    return _overlap_tables[key]
+
+
+def overlaps(dist, r1, r2, method='quad'):
+    """
+    Overlap areas (and their integral errors) between normal distributions centered at 0 and dist, with standard
+    deviations r1 and r2, for arrays of distances/standard deviations.
+    :param dist: An array-like of distances between the centers of the distributions
+    :param r1: An array-like (or scalar) of standard deviations of the first distribution
+    :param r2: An array-like (or scalar) of standard deviations of the second distribution
+    :param method: One of:
+        'quad' - Numerical integration, as in legacy code. This reproduces legacy values and integral error estimates
+            exactly, but is slow, and inaccurate for distant atoms (where the error estimates typically exceed the
+            calculated overlap).
+        'analytic' - Closed-form calculation over whole arrays at once; integral errors are reported as 0.
+        'table' - Interpolation in a precomputed OverlapTable (see overlap_table); integral errors are reported as 0.
+    :return: A 2-tuple of float arrays
+        0: overlap areas
+        1: integral errors
+    """
+    dist, r1, r2 = np.broadcast_arrays(np.asarray(dist, dtype=float), np.asarray(r1, dtype=float),
+                                       np.asarray(r2, dtype=float))
+    if method == 'quad':
+        results = np.array([overlap_radii(*args) for args in zip(dist, r1, r2)], dtype=float).reshape(-1, 2)
+        return results[:, 0], results[:, 1]
+    elif method == 'analytic':
+        return overlap_radii_analytic(dist, r1, r2), np.zeros(len(dist))
+    elif method == 'table':
+        return overlap_table().lookup(dist, r1, r2), np.zeros(len(dist))
+    else:
+        raise RuntimeError(f'Unsupported overlap method {method}')
+
+
+def create_distance_file(pdb_id, pdb_chains, receptor_filepaths, ligand_ids, ligand_filepaths, distance_filepath, include_backbone=False, distance_cutoff=20, compressed=True, calculate_overlap=True, overlap_method='quad', output_format='tsv'):
+
+    dfs = []
     previous_pdb_chain = None
     for pdb_chain, receptor_filepath, ligand_id, ligand_filepath in zip(pdb_chains, receptor_filepaths, ligand_ids, ligand_filepaths):
 
-        atoms = defaultdict(list)
-        positions = {}
-
-        _last_residue_number = None  # TODO: REMOVE if IGNORE_INSERTION_CODE==False
-
-        receptor_atoms = parsePDB(receptor_filepath, altloc='A1')  # TODO: Find breaking case if altloc is not specified
-        receptor_selection = receptor_atoms.select('stdaa and not hydrogen')
-
-        for residue in HierView(receptor_selection).iterResidues():
-            residue_number = residue.getResnum()
-            residue_name = residue.getResname()
-
-            # positions[residue_number] = AAMAP[residue_name]  # TODO: ADD if IGNORE_INSERTION_CODE==True
-
-            _flag = False  # TODO: REMOVE once the first-4 assumption is removed
-            if not include_backbone:
-                if _last_residue_number != residue_number:  # TODO: REMOVE if IGNORE_INSERTION_CODE==False
-                    positions[residue_number] = AAMAP[residue_name]  # TODO: REMOVE if IGNORE_INSERTION_CODE==False
-                    if set(residue.getNames()[:4]) != set(['N', 'CA', 'C', 'O']):  # TODO: REMOVE once the first-4 assumption is removed
-                        logger.error(f'Backbone ERROR in {receptor_filepath}-{residue_number}-{residue_name}')
-                        _flag = True
-                    else:
-                        residue = residue.select('not backbone')
-
-            _last_residue_number = residue_number  # TODO: REMOVE if IGNORE_INSERTION_CODE==False
-            if residue is not None:
-                if _flag:  # TODO: REMOVE once the first-4 assumption is removed
-                    atoms[residue_number].extend(
-                        [tuple(atom.getCoords()) + (atom.getElement(),) for atom in residue.iterAtoms()][4:]
-                    )
-                else:
-                    atoms[residue_number].extend(
-                        [tuple(atom.getCoords()) + (atom.getElement(),) for atom in residue.iterAtoms()]
-                    )
-
-        # Sort all atom entries according to distance
-        for k, v in atoms.items():
-            atoms[k] = sorted(v)
-
+        # Receptors (typically shared by several ligands) and ligands are only parsed once (see StructureCache)
+        receptor = structure_cache().receptor(receptor_filepath, include_backbone=include_backbone,
+                                              ignore_insertion_code=IGNORE_INSERTION_CODE)
+        positions = dict(zip(receptor.residue_numbers.tolist(), receptor.residue_values.tolist()))
         start_index = min(positions.keys())
 
-        ligand_atoms = parsePDB(ligand_filepath)
-        ligand_selection = ligand_atoms.select('hetatm and not hydrogen')
-
-        with tqdm(total=ligand_selection.numAtoms()) as pbar:
-
-            for ligand_atom in ligand_selection:
-                ligand_element = ligand_atom.getElement()
-                # logger.info(f'Processing ligand {ligand_element}')
-
-                # Special processing for nucleic acids
-                if ligand_id == 'NUC':
-                    ligand_atom_name = ligand_atom.getName()
-
-                    # Get other atom names in the same chain and residue as *this* atom
-                    other_atom_names = HierView(
-                        ligand_atom.getAtomGroup()
-                    ).getResidue(
-                        chid=ligand_atom.getChid(),
-                        resnum=ligand_atom.getResnum()
-                    ).getNames()
-
-                    # TODO: There has to be a more direct way to do this!
-                    ligand_sub_type = 'RNA' if "O2'" in other_atom_names else 'DNA'
-                    if "'" in ligand_atom_name or 'P' in ligand_atom_name:
-                        ligand_sub_type += 'B'
-                else:
-                    ligand_sub_type = ''
-
-                for i, ts in atoms.items():
-                    n = len(ts)
-                    for j, t in enumerate(ts, start=1):
-                        _x, _y, _z, _e = t
-                        dist = np.linalg.norm(np.array([_x, _y, _z]) - ligand_atom.getCoords())
-                        if dist <= distance_cutoff:
-                            _row = {
-                                'pdbID-pdbChain': f'{pdb_id}{pdb_chain}',
-                                'receptor_aa_1-index': i - start_index + 1,
-                                'receptor_aa_value': f'{positions[i]}',
-                                'receptor_atom_id': f'{j}/{n}',
-                                'receptor_atom_value': f'{_e}',
-                                'ligand_id': f'{ligand_id}{ligand_sub_type}',
-                                'ligand_atom_value': f'{ligand_element}',
-                                'euclidean_distance': dist,
-                                'full_receptor_sequence': ''
-                            }
-
-                            if previous_pdb_chain != pdb_chain:
-                               _row['full_receptor_sequence'] = ''.join([positions[aa_index] if aa_index in positions else 'X' for aa_index in range(start_index, max(positions.keys())+1)])
-                               previous_pdb_chain = pdb_chain
-
-                            _rows.append(_row)
-
-                pbar.update(1)
-    pbar.close()
-
-    df = pd.DataFrame(_rows)
+        # Receptor atoms are in residue order, and sorted (by coordinates) within each residue
+        receptor_coords = receptor.atom_coords
+        receptor_aa_index = receptor.atom_residue_numbers - start_index + 1
+        receptor_aa_value = pd.Series(receptor.atom_residue_numbers).map(positions).values.astype(object)
+        # Atoms of a residue are contiguous, and are identified by their (1-indexed) position j in the residue and
+        # the no. of atoms n in the residue, as <j>/<n>
+        residue_starts = np.flatnonzero(np.diff(receptor.atom_residue_numbers, prepend=np.nan) != 0)
+        residue_atom_counts = np.diff(np.append(residue_starts, len(receptor_coords)))
+        j = np.arange(len(receptor_coords)) - np.repeat(residue_starts, residue_atom_counts) + 1
+        n = np.repeat(residue_atom_counts, residue_atom_counts)
+        receptor_atom_id = np.array([f'{_j}/{_n}' for _j, _n in zip(j.tolist(), n.tolist())], dtype=object)
+        receptor_atom_value = receptor.atom_elements.astype(object)
+
+        ligand = structure_cache().ligand(ligand_filepath, ligand_id)
+        ligand_coords = ligand.atom_coords
+        ligand_values = np.stack([ligand.atom_types.astype(object), ligand.atom_elements.astype(object)], axis=1)
+
+        # Find all receptor atoms within distance_cutoff of each ligand atom. The search radius is padded slightly so
+        # that the cutoff itself is applied to distances calculated exactly as before.
+        tree = cKDTree(receptor_coords)
+        neighbors = tree.query_ball_point(ligand_coords, r=distance_cutoff * (1 + 1e-9) + 1e-9)
+
+        ligand_indices = np.repeat(np.arange(len(ligand_coords)), [len(n) for n in neighbors])
+        receptor_indices = np.concatenate([np.sort(n) for n in neighbors] + [np.array([], dtype=int)]).astype(int)
+        differences = receptor_coords[receptor_indices] - ligand_coords[ligand_indices]
+        dist = np.sqrt(np.einsum('ij,ij->i', differences, differences))
+
+        mask = dist <= distance_cutoff
+        ligand_indices, receptor_indices, dist = ligand_indices[mask], receptor_indices[mask], dist[mask]
+        logger.info(f'Found {len(dist)} receptor-ligand atom pairs within {distance_cutoff} for {pdb_id}{pdb_chain}')
+
+        chain_df = pd.DataFrame({
+            'pdbID-pdbChain': f'{pdb_id}{pdb_chain}',
+            'receptor_aa_1-index': receptor_aa_index[receptor_indices],
+            'receptor_aa_value': receptor_aa_value[receptor_indices],
+            'receptor_atom_id': receptor_atom_id[receptor_indices],
+            'receptor_atom_value': receptor_atom_value[receptor_indices],
+            'ligand_id': ligand_values[ligand_indices, 0],
+            'ligand_atom_value': ligand_values[ligand_indices, 1],
+            'euclidean_distance': dist,
+            'full_receptor_sequence': ''
+        })
+
+        if len(chain_df) > 0 and previous_pdb_chain != pdb_chain:
+            chain_df.loc[0, 'full_receptor_sequence'] = ''.join([positions[aa_index] if aa_index in positions else 'X' for aa_index in range(start_index, max(positions.keys())+1)])
+            previous_pdb_chain = pdb_chain
+
+        dfs.append(chain_df)
+
+    df = pd.concat(dfs, ignore_index=True)
 
     if calculate_overlap:
-        tqdm.pandas()
         logger.info('adding receptor atom vdw radius')
-        df['receptor_atom_radius'] = df.progress_apply(lambda row: vdw_radius(row['receptor_atom_value']), axis=1)
+        df['receptor_atom_radius'] = vdw_radii(df['receptor_atom_value'])
         logger.info('adding ligand atom vdw radius')
-        df['ligand_atom_radius'] = df.progress_apply(lambda row: vdw_radius(row['ligand_atom_value']), axis=1)
+        df['ligand_atom_radius'] = vdw_radii(df['ligand_atom_value'])
 
         logger.info('calculating vdw overlap areas')
-        df[['overlap_vdw_radii', 'integral_error_vdw_radii']] = df.progress_apply(lambda row: pd.Series(overlap_radii(row['euclidean_distance'], row['receptor_atom_radius'], row['ligand_atom_radius'])), axis=1)
+        df['overlap_vdw_radii'], df['integral_error_vdw_radii'] = overlaps(
+            df['euclidean_distance'], df['receptor_atom_radius'], df['ligand_atom_radius'], method=overlap_method
+        )
         logger.info('calculating standard overlap areas')
-        df[['overlap_1.5', 'integral_error_1.5']] = df.progress_apply(lambda row: pd.Series(overlap_radii(row['euclidean_distance'], 1.5, 1.5)), axis=1)
+        df['overlap_1.5'], df['integral_error_1.5'] = overlaps(df['euclidean_distance'], 1.5, 1.5, method=overlap_method)
 
-        if EMULATE_CACHING_BUG:
-            overlaps = {}
+        if EMULATE_CACHING_BUG and overlap_method == 'quad':
             logger.info('"caching" calculated overlap areas to emulate legacy behavior')
-            for idx in df.index:
-                row = df.iloc[idx]
-                sd1, sd2 = sorted([vdw_radius(row['receptor_atom_value']), vdw_radius(row['ligand_atom_value'])])
-                overlaps[(row['euclidean_distance'], (sd1, sd2))] = row['overlap_vdw_radii'], row['integral_error_vdw_radii']
-                overlaps[(row['euclidean_distance'], (1.5, 1.5))] = row['overlap_1.5'], row['integral_error_1.5']
+            # Legacy code cached overlap areas in a dict keyed by (distance, sorted standard deviations), writing the
+            # vdw and then the standard (1.5, 1.5) overlap for each row in turn, so all rows with the same key end up
+            # with the last value written for that key (quad is not symmetric in its standard deviations).
+            sd1 = np.minimum(df['receptor_atom_radius'], df['ligand_atom_radius'])
+            sd2 = np.maximum(df['receptor_atom_radius'], df['ligand_atom_radius'])
+            writes = pd.DataFrame({
+                'dist': np.concatenate([df['euclidean_distance'], df['euclidean_distance']]),
+                'sd1': np.concatenate([sd1, np.full(len(df), 1.5)]),
+                'sd2': np.concatenate([sd2, np.full(len(df), 1.5)]),
+                'overlap': np.concatenate([df['overlap_vdw_radii'], df['overlap_1.5']]),
+                'error': np.concatenate([df['integral_error_vdw_radii'], df['integral_error_1.5']]),
+                # Order of writes - row by row, with the vdw overlap written before the standard overlap
+                'order': np.concatenate([2 * np.arange(len(df)), 2 * np.arange(len(df)) + 1])
+            }).sort_values('order').drop_duplicates(['dist', 'sd1', 'sd2'], keep='last')
 
             logger.info('modifying calculated overlap areas to emulate legacy behavior')
-            df[['overlap_vdw_radii', 'integral_error_vdw_radii']] = df.progress_apply(lambda row: pd.Series(overlaps[(row['euclidean_distance'], tuple(sorted([row['receptor_atom_radius'], row['ligand_atom_radius']])))]), axis=1)
-            df[['overlap_1.5', 'integral_error_1.5']] = df.progress_apply(lambda row: pd.Series(overlaps[(row['euclidean_distance'], (1.5, 1.5))]), axis=1)
-
-    distance_df_to_csv(df, pdb_id, distance_filepath, compressed=compressed)
+            keys = pd.MultiIndex.from_frame(writes[['dist', 'sd1', 'sd2']])
+            cached = writes[['overlap', 'error']].values
+            vdw = cached[keys.get_indexer(pd.MultiIndex.from_arrays([df['euclidean_distance'], sd1, sd2]))]
+            std = cached[keys.get_indexer(pd.MultiIndex.from_arrays([df['euclidean_distance'], np.full(len(df), 1.5),
+                                                                     np.full(len(df), 1.5)]))]
+            df['overlap_vdw_radii'], df['integral_error_vdw_radii'] = vdw[:, 0], vdw[:, 1]
+            df['overlap_1.5'], df['integral_error_1.5'] = std[:, 0], std[:, 1]
+
+    if output_format == 'tsv':
+        distance_df_to_csv(df, pdb_id, distance_filepath, compressed=compressed)
+    elif output_format == 'parquet':
+        distance_df_to_parquet(df, pdb_id, distance_filepath)
+    else:
+        raise RuntimeError(f'Unsupported output format {output_format}')
     return df
 
 
-def create_fasta(df, filepath, compressed=True, distance='maxstd', distance_cutoff=20):
-
-    distances = {}  # pdbID-pdbChain => <sequence>, [(<residue_index>, <ligand_id>, <distance>), ..]
-
-    for pdb_chain, df1 in df.groupby(['pdbID-pdbChain']):
-
-        receptor_sequence = df1['full_receptor_sequence'].dropna().iloc[0]
-
-        if distance.endswith('std'):
-            df1 = df1[df1['integral_error_1.5'] < df1['overlap_1.5']]
-        elif distance.endswith('vdw'):
-            df1 = df1[df1['integral_error_vdw_radii'] < df1['overlap_vdw_radii']]
-
-        ligand_distances = []
-        for residue_index, df2 in df1.groupby(['receptor_aa_1-index']):
-
-            unique_receptor_positions = df2['receptor_atom_id'].unique()
-            n_unique_receptor_positions = len(unique_receptor_positions)
-
-            for ligand_id, df3 in df2.groupby(['ligand_id']):
-
-                if distance=='maxstd':
-                    d = df3.groupby('receptor_atom_id').sum()['overlap_1.5'].max()
-                elif distance=='maxvdw':
-                    d = df3.groupby('receptor_atom_id').sum()['overlap_vdw_radii'].max()
-                elif distance=='meanstd':
-                    d = df3['overlap_1.5'].sum() / n_unique_receptor_positions
-                elif distance=='meanvdw':
-                    d = df3['overlap_vdw_radii'].sum() / n_unique_receptor_positions
-                elif distance=='sumstd':
-                    d = df3['overlap_1.5'].sum()
-                elif distance=='sumvdw':
-                    d = df3['overlap_vdw_radii'].sum()
-                elif distance=='mindist':
-                    d = df3['euclidean_distance'].min()
-                elif distance=='meandist':
-                    d = df3.groupby('receptor_atom_id')['euclidean_distance'].min()
-                    d = d.reindex(unique_receptor_positions, fill_value=distance_cutoff).mean()
-                elif distance=='fracin4':
-                    n_aa_atoms = int(df3.iloc[0]['receptor_atom_id'].split('/')[-1])
-                    n_aa_atoms_near = (df3.groupby('receptor_atom_id')['euclidean_distance'].min() < 4).sum()
-                    d = n_aa_atoms_near/n_aa_atoms
-
-                ligand_distances.append((residue_index, ligand_id, d))
-
-        distances[pdb_chain] = receptor_sequence, sorted(ligand_distances)
+def distance_filepath(distance_dir, pdb_id, compressed=True, output_format='tsv'):
+    """
+    Path of the distance file for a pdb id, in the (legacy) directory layout <distance_dir>/2/2l/2lue_distances.txt.gz
+    (or <distance_dir>/2/2l/2lue_distances.parquet for Parquet files)
+    """
+    if output_format == 'parquet':
+        filename = f'{pdb_id}_distances.parquet'
+    else:
+        filename = f'{pdb_id}_distances.txt' + ('.gz' if compressed else '')
+    return os.path.join(distance_dir, pdb_id[:1], pdb_id[:2], filename)
+
+
+def _create_distance_file_task(task):
+    """
+    Create a distance file for a single pdb id, unless an identical one (i.e. one created from the same inputs and
+    parameters, and unmodified since) already exists. Any errors are caught and reported, not raised.
+    :param task: A dict with keys pdb_id, filepath, force_overwrite, and kwargs (keyword arguments for
+        create_distance_file)
+    :return: A 3-tuple of (<pdb_id>, <status>, <message>), where <status> is one of 'created', 'skipped', 'failed'
+    """
+    pdb_id, filepath, kwargs = task['pdb_id'], task['filepath'], task['kwargs']
+    checksum_filepath = filepath + '.sha256'
+    try:
+        inputs = {
+            'kwargs': {k: v for k, v in kwargs.items() if not k.endswith('filepaths')},
+            'files': [file_checksum(f) for f in kwargs['receptor_filepaths'] + kwargs['ligand_filepaths']]
+        }
+
+        if not task['force_overwrite'] and os.path.exists(filepath) and os.path.exists(checksum_filepath):
+            with open(checksum_filepath, 'r') as f:
+                checksums = json.load(f)
+            if checksums['inputs'] == inputs and checksums['output'] == file_checksum(filepath):
+                return pdb_id, 'skipped', ''
+
+        # Write to a temporary file first, so that an interrupted run never leaves a partially written output behind
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_filepath = os.path.join(os.path.dirname(filepath), '.tmp.' + os.path.basename(filepath))
+        create_distance_file(pdb_id=pdb_id, distance_filepath=tmp_filepath, **kwargs)
+        os.replace(tmp_filepath, filepath)
+
+        with open(checksum_filepath, 'w') as f:
+            json.dump({'inputs': inputs, 'output': file_checksum(filepath)}, f)
+
+        return pdb_id, 'created', ''
+
+    except Exception as e:
+        return pdb_id, 'failed', f'{type(e).__name__}: {e}'
+
+
+def create_distance_files(annotation_file, pdb_ids, receptor_dir, ligand_dir, distance_dir, max_workers=None,
+                          chunksize=1, force_overwrite=False, include_backbone=False, distance_cutoff=20,
+                          compressed=True, calculate_overlap=True, overlap_method='quad', output_format='tsv'):
+    """
+    Create distance files for a number of pdb ids in parallel, using a pool of processes.
+    Distance files that already exist, and were created from the same inputs and parameters (as recorded in
+    checksum files alongside them) are skipped, so interrupted runs can simply be restarted.
+    Failures for individual pdb ids are logged and reported, and don't affect other pdb ids.
+
+    :param annotation_file: Path to a tab-delimited annotation file (as downloaded from BioLiP)
+    :param pdb_ids: A list of pdb ids to create distance files for
+    :param receptor_dir: Directory containing receptor structures, e.g. 2lueA.pdb
+    :param ligand_dir: Directory containing ligand structures, e.g. 2lue_III_B_1.pdb
+    :param distance_dir: Directory to write distance files to (see distance_filepath)
+    :param max_workers: No. of processes to use (all cores by default)
+    :param chunksize: No. of pdb ids handed to a process at a time
+    :param force_overwrite: Whether to re-create distance files even if they're up to date
+    :param include_backbone: See create_distance_file
+    :param distance_cutoff: See create_distance_file
+    :param compressed: See create_distance_file
+    :param calculate_overlap: See create_distance_file
+    :param overlap_method: See create_distance_file
+    :param output_format: See create_distance_file
+    :return: A DataFrame with columns pdb_id, status ('created', 'skipped', 'failed') and message
+    """
+    annot_df = pd.read_csv(annotation_file, sep='\t', header=None, names=ANNOTATION_COLUMNS)
+    annot_df = annot_df[annot_df.pdb_id.isin(pdb_ids)]
+
+    tasks = []
+    for pdb_id, df in annot_df.groupby('pdb_id', sort=False):
+        tasks.append({
+            'pdb_id': pdb_id,
+            'filepath': distance_filepath(distance_dir, pdb_id, compressed=compressed, output_format=output_format),
+            'force_overwrite': force_overwrite,
+            'kwargs': {
+                'pdb_chains': df.pdb_chain.tolist(),
+                'receptor_filepaths': [os.path.join(receptor_dir, f'{pdb_id}{pdb_chain}.pdb')
+                                       for pdb_chain in df.pdb_chain],
+                'ligand_ids': df.ligand_id.tolist(),
+                'ligand_filepaths': [os.path.join(ligand_dir, f'{pdb_id}_{ligand_id}_{ligand_chain}_{ligand_sno}.pdb')
+                                     for ligand_id, ligand_chain, ligand_sno in
+                                     zip(df.ligand_id, df.ligand_chain, df.ligand_serial_number)],
+                'include_backbone': include_backbone,
+                'distance_cutoff': distance_cutoff,
+                'compressed': compressed,
+                'calculate_overlap': calculate_overlap,
+                'overlap_method': overlap_method,
+                'output_format': output_format
+            }
+        })
+
+    results = [(pdb_id, 'failed', 'Not found in annotation file') for pdb_id in pdb_ids
+               if pdb_id not in set(annot_df.pdb_id)]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        with tqdm(total=len(tasks)) as pbar:
+            for pdb_id, status, message in executor.map(_create_distance_file_task, tasks, chunksize=chunksize):
+                if status == 'failed':
+                    logger.error(f'Failed to create distance file for {pdb_id}: {message}')
+                results.append((pdb_id, status, message))
+                pbar.update(1)
 
+    results = pd.DataFrame(results, columns=['pdb_id', 'status', 'message'])
+    logger.info(f'Distance files: {results.status.value_counts().to_dict()}')
+    return results
+
+
+# Distance metrics supported by create_fasta/create_fastas
+DISTANCE_METRICS = ('mindist', 'fracin4', 'meandist', 'maxstd', 'meanstd', 'sumstd', 'maxvdw', 'meanvdw', 'sumvdw')
+
+
+def _group_reduce(ufunc, keys, values, n_groups):
+    """
+    Reduce values within groups
+    :param ufunc: A numpy ufunc to reduce with, e.g. np.minimum
+    :param keys: An int array of (0-indexed) group numbers, one for each value
+    :param values: An array of values
+    :param n_groups: Total no. of groups (all of which must have at least one value)
+    :return: An array of reduced values, one for each group
+    """
+    order = np.argsort(keys, kind='mergesort')
+    starts = np.searchsorted(keys[order], np.arange(n_groups))
+    return ufunc.reduceat(values[order], starts) if len(values) else values[:0]
+
+
+def distance_metrics(df, distances=DISTANCE_METRICS, distance_cutoff=20):
+    """
+    Calculate per-residue, per-ligand distance metrics for all chains in a distance DataFrame, in a single pass.
+    :param df: A distance DataFrame, e.g. as returned by create_distance_file or read_distance_file
+    :param distances: An iterable of distance metrics (see DISTANCE_METRICS)
+    :param distance_cutoff: The distance cutoff used when creating the distance DataFrame
+    :return: A dict mapping <distance_metric> => { <pdbID-pdbChain> => (<sequence>, [(<residue_index>, <ligand_id>,
+        <distance>), ..]) }, with chains sorted, and entries for each chain sorted by residue index and ligand id
+    """
+    unknown = set(distances) - set(DISTANCE_METRICS)
+    if unknown:
+        raise RuntimeError(f'Unknown distance metric(s) {unknown}')
+
+    chain_codes, chains = pd.factorize(df['pdbID-pdbChain'], sort=True)
+    residue_codes, residues = pd.factorize(df['receptor_aa_1-index'], sort=True)
+    ligand_codes, ligands = pd.factorize(df['ligand_id'], sort=True)
+    atom_codes, atoms = pd.factorize(df['receptor_atom_id'])
+    # No. of atoms in the residue, i.e. the <n> in receptor atom ids of the form <j>/<n>
+    n_residue_atoms = np.array([int(str(atom).split('/')[-1]) for atom in atoms], dtype=int)
+
+    # The receptor sequence of each chain is only populated in its first row
+    has_sequence = df['full_receptor_sequence'].notna().values
+    _, first = np.unique(chain_codes[has_sequence], return_index=True)
+    sequences = df['full_receptor_sequence'].values[np.flatnonzero(has_sequence)[first]]
+
+    # Integer-coded keys for (chain, residue), (chain, residue, ligand) and (chain, residue, ligand, atom)
+    residue_keys = chain_codes.astype(np.int64) * len(residues) + residue_codes
+    ligand_keys = residue_keys * len(ligands) + ligand_codes
+    atom_keys = ligand_keys * len(atoms) + atom_codes
+
+    filters = {
+        'dist': np.ones(len(df), dtype=bool),
+        'std': (df['integral_error_1.5'] < df['overlap_1.5']).values if 'overlap_1.5' in df else None,
+        'vdw': (df['integral_error_vdw_radii'] < df['overlap_vdw_radii']).values if 'overlap_vdw_radii' in df else None
+    }
+
+    results = {}
+    for kind, mask in filters.items():
+        _distances = [d for d in distances if (d[-3:] if d.endswith(('std', 'vdw')) else 'dist') == kind]
+        if not _distances:
+            continue
+        rows = np.flatnonzero(mask)
+
+        # (chain, residue, ligand) groups, in sorted order, and the no. of unique receptor atoms in each residue
+        groups, group_first_row, group_of_row = np.unique(ligand_keys[rows], return_index=True, return_inverse=True)
+        group_of_row = group_of_row.reshape(-1)
+        residue_atoms = np.unique(residue_keys[rows] * len(atoms) + atom_codes[rows])
+        residue_atom_counts = pd.Series(residue_atoms // len(atoms)).value_counts()
+        n_unique_atoms = residue_atom_counts.reindex(groups // len(ligands)).values
+
+        # (chain, residue, ligand, atom) sub-groups
+        subgroups, subgroup_of_row = np.unique(atom_keys[rows], return_inverse=True)
+        subgroup_of_row = subgroup_of_row.reshape(-1)
+        group_of_subgroup = np.searchsorted(groups, subgroups // len(atoms))
+
+        values = {}
+        if kind == 'dist':
+            dist = df['euclidean_distance'].values[rows].astype(float)
+            atom_min_dist = _group_reduce(np.minimum, subgroup_of_row, dist, len(subgroups))
+            values['mindist'] = _group_reduce(np.minimum, group_of_row, dist, len(groups))
+            n_atoms_present = np.bincount(group_of_subgroup, minlength=len(groups))
+            values['meandist'] = (
+                np.bincount(group_of_subgroup, weights=atom_min_dist, minlength=len(groups)) +
+                distance_cutoff * (n_unique_atoms - n_atoms_present)
+            ) / n_unique_atoms
+            values['fracin4'] = np.bincount(group_of_subgroup, weights=atom_min_dist < 4, minlength=len(groups)) / \
+                n_residue_atoms[atom_codes[rows][group_first_row]]
+        else:
+            overlap = df['overlap_1.5' if kind == 'std' else 'overlap_vdw_radii'].values[rows].astype(float)
+            atom_sums = np.bincount(subgroup_of_row, weights=overlap, minlength=len(subgroups))
+            sums = np.bincount(group_of_row, weights=overlap, minlength=len(groups))
+            values['max' + kind] = _group_reduce(np.maximum, group_of_subgroup, atom_sums, len(groups))
+            values['mean' + kind] = sums / n_unique_atoms
+            values['sum' + kind] = sums
+
+        group_chains = groups // (len(residues) * len(ligands))
+        group_residues = residues[(groups // len(ligands)) % len(residues)]
+        group_ligands = ligands[groups % len(ligands)]
+        for distance in _distances:
+            chain_distances = {chain: (sequence, []) for chain, sequence in zip(chains, sequences)}
+            for chain_code, residue_index, ligand_id, d in zip(group_chains, group_residues, group_ligands,
+                                                                values[distance]):
+                chain_distances[chains[chain_code]][1].append((residue_index, ligand_id, d))
+            results[distance] = chain_distances
+
+    return results
+
+
+def _write_fasta(chain_distances, filepath):
     with open(filepath, 'w') as f:
-        for chain, (seq, ligand_distances) in distances.items():
+        for chain, (seq, ligand_distances) in chain_distances.items():
             f.write(f'>{chain} bindingSiteRes=')
             f.write(','.join([f'{pos}-{lig}-{d:.5f}' for pos, lig, d in ligand_distances]))
             f.write(f';\n{seq}\n\n')
+
+
+def create_fasta(df, filepath, compressed=True, distance='maxstd', distance_cutoff=20):
+    _write_fasta(distance_metrics(df, distances=(distance,), distance_cutoff=distance_cutoff)[distance], filepath)
+
+
+def create_fastas(df, filepath_pattern, distances=DISTANCE_METRICS, distance_cutoff=20):
+    """
+    Create FASTA files for several distance metrics at once (see create_fasta)
+    :param df: A distance DataFrame, e.g. as returned by create_distance_file or read_distance_file
+    :param filepath_pattern: A string with a '{distance}' placeholder, e.g. '2lue_{distance}.fa'
+    :param distances: An iterable of distance metrics (see DISTANCE_METRICS)
+    :param distance_cutoff: The distance cutoff used when creating the distance DataFrame
+    :return: A dict mapping <distance_metric> => <filepath>
+    """
+    filepaths = {}
+    for distance, chain_distances in distance_metrics(df, distances=distances, distance_cutoff=distance_cutoff).items():
+        filepaths[distance] = filepath_pattern.format(distance=distance)
+        _write_fasta(chain_distances, filepaths[distance])
+    return filepaths
@@ -0,0 +1,246 @@
+"""
+Extraction of receptor and ligand atoms from (BioLiP) PDB files, as numpy arrays.
+
+All per-atom information is pulled out of the ProDy AtomGroup in one shot, and per-residue properties (backbone
+checks, nucleic acid sub-types) are computed once per residue, so that parsing overhead does not scale with
+per-atom Python calls.
+
+Parsed structures are cached (see StructureCache), so that each file is only parsed once across ligands, runs and
+scripts.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import namedtuple, OrderedDict
+from tempfile import NamedTemporaryFile
+import numpy as np
+import pandas as pd
+from prody import parsePDB
+from prody.atomic import AAMAP
+
+from chimera import config
+
+logger = logging.getLogger(__name__)
+
+ReceptorStructure = namedtuple('ReceptorStructure', [
+    'residue_numbers',       # int array, residue numbers of all (standard amino acid) residues, in file order
+    'residue_values',        # str array, one-letter amino acid codes of these residues
+    'atom_coords',           # (n, 3) float array, coordinates of atoms, sorted by coordinates within each residue
+    'atom_residue_numbers',  # int array, residue number of each atom
+    'atom_elements'          # str array, element of each atom
+])
+
+LigandStructure = namedtuple('LigandStructure', [
+    'atom_coords',  # (n, 3) float array, coordinates of atoms, in file order
+    'atom_types',   # str array, ligand id of each atom, with a sub-type (DNA/RNA, B for backbone) for nucleic acids
+    'atom_elements'  # str array, element of each atom
+])
+
+
+def _residue_codes(atoms):
+    """
+    Get residue codes for atoms, identifying residues the same way as ProDy's HierView
+    :param atoms: A ProDy Atomic object
+    :return: An int array, one element for each atom, with codes numbered in order of first appearance of each residue
+    """
+    keys = pd.MultiIndex.from_arrays([atoms.getSegnames(), atoms.getChids(), atoms.getResnums(), atoms.getIcodes()])
+    codes, _ = pd.factorize(keys)
+    return codes
+
+
+def receptor_structure(receptor_filepath, include_backbone=False, ignore_insertion_code=True):
+    """
+    Extract the non-hydrogen standard amino acid atoms from a receptor PDB file
+    :param receptor_filepath: Path to a receptor PDB file, e.g. 2lueA.pdb
+    :param include_backbone: Whether to include backbone atoms
+    :param ignore_insertion_code: Whether to treat consecutive residues with the same residue number (but different
+        insertion codes) as a single residue (see chimera.distance.IGNORE_INSERTION_CODE)
+    :return: A ReceptorStructure object
+    """
+    receptor_atoms = parsePDB(str(receptor_filepath), altloc='A1')  # TODO: Find breaking case if altloc is not specified
+    selection = receptor_atoms.select('stdaa and not hydrogen')
+
+    coords = selection.getCoords().reshape(-1, 3)
+    resnums = selection.getResnums().astype(int)
+    resnames = selection.getResnames()
+    names = selection.getNames()
+    elements = selection.getElements().astype(str)
+
+    # Residues as identified by ProDy's HierView, and the rank of each atom within its residue
+    residues = _residue_codes(selection)
+    order = np.argsort(residues, kind='mergesort')
+    first_atoms = np.searchsorted(residues[order], np.arange(residues.max() + 1 if len(residues) else 0))
+    rank = np.empty(len(residues), dtype=int)
+    rank[order] = np.arange(len(residues)) - np.repeat(first_atoms, np.diff(np.append(first_atoms, len(residues))))
+
+    residue_resnums = resnums[order][first_atoms]
+    residue_resnames = resnames[order][first_atoms]
+
+    keep = np.ones(len(residues), dtype=bool)
+    extended = np.ones(len(first_atoms), dtype=bool)  # Residues that (legacy code) records atoms for
+    residue_numbers, residue_values = np.array([], dtype=int), np.array([], dtype=str)
+    if not include_backbone:
+        # With insertion codes ignored, only the first of consecutive residues with the same residue number is
+        # recorded, and has its backbone removed
+        # TODO: REMOVE if IGNORE_INSERTION_CODE==False
+        new = np.append([True], residue_resnums[1:] != residue_resnums[:-1]) if ignore_insertion_code else \
+            np.ones(len(first_atoms), dtype=bool)
+
+        # The first 4 atoms of each residue are assumed to be backbone atoms
+        # TODO: REMOVE once the first-4 assumption is removed
+        first_4 = np.full((len(first_atoms), 4), '', dtype=object)
+        first_4[residues[rank < 4], rank[rank < 4]] = names[rank < 4]
+        flagged = new & ~(np.sort(first_4.astype(str), axis=1) == ['C', 'CA', 'N', 'O']).all(axis=1)
+        for resnum, resname in zip(residue_resnums[flagged], residue_resnames[flagged]):
+            logger.error(f'Backbone ERROR in {receptor_filepath}-{resnum}-{resname}')
+
+        keep &= ~(new & ~flagged)[residues] | ~selection.getFlags('backbone')
+        keep &= ~flagged[residues] | (rank >= 4)
+        extended = flagged | (np.bincount(residues[keep], minlength=len(first_atoms)) > 0)
+
+        # Residue numbers are unique, in order of first appearance, each with the value of its last residue
+        residue_values = pd.Series([AAMAP[resname] for resname in residue_resnames[new]], index=residue_resnums[new],
+                                   dtype=object).groupby(level=0, sort=False).last()
+        residue_numbers, residue_values = residue_values.index.values.astype(int), residue_values.values.astype(str)
+
+    # Atoms are grouped by residue number (in order of the first residue with that number to record atoms),
+    # and sorted by coordinates (then element) within each group
+    group_order = pd.unique(residue_resnums[extended])
+    groups = pd.Index(group_order).get_indexer(resnums)
+    indices = np.flatnonzero(keep)
+    indices = indices[np.lexsort((
+        pd.factorize(elements[indices], sort=True)[0],
+        coords[indices, 2], coords[indices, 1], coords[indices, 0],
+        groups[indices]
+    ))]
+
+    return ReceptorStructure(
+        residue_numbers=residue_numbers,
+        residue_values=residue_values,
+        atom_coords=coords[indices],
+        atom_residue_numbers=resnums[indices],
+        atom_elements=elements[indices]
+    )
+
+
+def ligand_structure(ligand_filepath, ligand_id):
+    """
+    Extract the non-hydrogen hetero atoms from a ligand PDB file
+    :param ligand_filepath: Path to a ligand PDB file, e.g. 2lue_III_B_1.pdb
+    :param ligand_id: Ligand id, e.g. 'III', or 'NUC' for nucleic acids
+    :return: A LigandStructure object
+    """
+    ligand_atoms = parsePDB(str(ligand_filepath))
+    selection = ligand_atoms.select('hetatm and not hydrogen')
+
+    atom_types = np.full(selection.numAtoms(), ligand_id, dtype=object)
+    if ligand_id == 'NUC':
+        # Residues (across all atoms, in the same chain and with the same residue number) with an O2' atom are RNA,
+        # others DNA. Atoms with a ' or a P in their name are backbone atoms.
+        # TODO: There has to be a more direct way to do this!
+        all_residues = pd.MultiIndex.from_arrays([ligand_atoms.getChids(), ligand_atoms.getResnums()])
+        rna_residues = all_residues[ligand_atoms.getNames() == "O2'"].unique()
+        is_rna = pd.MultiIndex.from_arrays([selection.getChids(), selection.getResnums()]).isin(rna_residues)
+
+        names = selection.getNames().astype(str)
+        is_backbone = (np.char.find(names, "'") >= 0) | (np.char.find(names, 'P') >= 0)
+        atom_types = atom_types + np.where(is_rna, 'RNA', 'DNA').astype(object) + \
+            np.where(is_backbone, 'B', '').astype(object)
+
+    return LigandStructure(
+        atom_coords=selection.getCoords().reshape(-1, 3),
+        atom_types=atom_types.astype(str),
+        atom_elements=selection.getElements().astype(str)
+    )
+
+
+class StructureCache:
+    """
+    A cache of structures extracted from PDB files (see receptor_structure/ligand_structure), keyed by the path, size
+    and modification time of each file, along with the extraction parameters.
+
+    The most recently used structures are kept in memory, and all structures are (optionally) persisted as .npz files
+    in a directory, so that they're shared across runs and processes.
+    """
+
+    def __init__(self, path=None, max_entries=64):
+        """
+        :param path: Path to a directory where structures are persisted (created if needed), or None to keep structures
+            in memory only
+        :param max_entries: Maximum no. of structures kept in memory
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._structures = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(filepath, **params):
+        """
+        Get the cache key for a structure
+        :param filepath: Path to a PDB file
+        :param params: Extraction parameters
+        :return: A hex digest string
+        """
+        stat = os.stat(filepath)
+        s = json.dumps([os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns, params], sort_keys=True)
+        return hashlib.sha256(s.encode('utf8')).hexdigest()
+
+    def _get(self, structure_class, extract, filepath, **params):
+        key = self.key(filepath, kind=structure_class.__name__, **params)
+        with self._lock:
+            if key in self._structures:
+                self._structures.move_to_end(key)
+                return self._structures[key]
+
+        file_path = None if self.path is None else os.path.join(self.path, f'{key}.npz')
+        if file_path is not None and os.path.exists(file_path):
+            with np.load(file_path, allow_pickle=False) as data:
+                structure = structure_class(**{field: data[field] for field in structure_class._fields})
+        else:
+            structure = extract(filepath, **params)
+            if file_path is not None:
+                # Write to a temporary file first, so that concurrent readers never see a partially written structure
+                with NamedTemporaryFile(dir=self.path, suffix='.npz', delete=False) as f:
+                    np.savez(f, **structure._asdict())
+                os.replace(f.name, file_path)
+
+        with self._lock:
+            self._structures[key] = structure
+            while len(self._structures) > self.max_entries:
+                self._structures.popitem(last=False)
+        return structure
+
+    def receptor(self, receptor_filepath, include_backbone=False, ignore_insertion_code=True):
+        """
+        Get the (possibly cached) ReceptorStructure for a receptor PDB file (see receptor_structure)
+        """
+        return self._get(ReceptorStructure, receptor_structure, str(receptor_filepath),
+                         include_backbone=include_backbone, ignore_insertion_code=ignore_insertion_code)
+
+    def ligand(self, ligand_filepath, ligand_id):
+        """
+        Get the (possibly cached) LigandStructure for a ligand PDB file (see ligand_structure)
+        """
+        return self._get(LigandStructure, ligand_structure, str(ligand_filepath), ligand_id=ligand_id)
+
+
+# A dict mapping <path> => StructureCache, shared across calls
+_structure_caches = {}
+
+
+def structure_cache():
+    """
+    Get the StructureCache persisted at the path configured in the config file (under cache.structures), or an
+    in-memory StructureCache if no such path is configured. Caches are shared by all calls in a process.
+    :return: A StructureCache object
+    """
+    path = config.cache.structures.path or None
+    if path not in _structure_caches:
+        _structure_caches[path] = StructureCache(path=path)
+    return _structure_caches[path]
@@ -1,13 +1,12 @@
 import logging
-import json
-import plotly
 from importlib.resources import read_text
-from flask import Blueprint, request, render_template, send_file, session, abort
+from flask import Blueprint, request, render_template, jsonify, Response, abort
 
-from chimera import config, dsprint_pfam_ids, interacdome_pfam_ids
+import chimera
+from chimera import config
 from chimera.utils import parse_fasta
 from chimera.tasks import query
-from chimera.plots import binding_freq_plot_data_domain, binding_freq_plot_data_sequence
+from chimera.plots.cache import ALGORITHMS, pfam_id_set, plot_cache
 
 bp = Blueprint('web', __name__)
 logger = logging.getLogger(__name__)
@@ -19,15 +18,12 @@ ctcf = read_text('chimera.data.sample', 'ctcf.fa')
 @bp.route('/dsprint', methods=['GET', 'POST'])
 def dsprint():
 
-    pfam_ids = {p: p + (' *' if p in interacdome_pfam_ids else '') for p in dsprint_pfam_ids}
+    pfam_ids = {p: p + (' *' if p in chimera.interacdome_pfam_id_set else '') for p in chimera.dsprint_pfam_ids}
     selected_pfam_id = None
-    data = ''
     if request.method == 'POST':
         selected_pfam_id = request.form['pfam_id']
-        data = binding_freq_plot_data_domain(selected_pfam_id, algorithm='dsprint')
-        data = json.dumps(data, cls=plotly.utils.PlotlyJSONEncoder)
 
-    return render_template('dsprint.html', pfam_ids=pfam_ids, selected_pfam_id=selected_pfam_id, data=data)
+    return render_template('dsprint.html', pfam_ids=pfam_ids, selected_pfam_id=selected_pfam_id)
 
 
 @bp.route('/dpuc2')
@@ -43,13 +39,24 @@ def domstratstats():
 @bp.route('/interacdome', methods=['GET', 'POST'])
 def interacdome():
     selected_pfam_id = None
-    data = ''
     if request.method == 'POST':
         selected_pfam_id = request.form['pfam_id']
-        data = binding_freq_plot_data_domain(selected_pfam_id, algorithm='interacdome')
-        data = json.dumps(data, cls=plotly.utils.PlotlyJSONEncoder)
 
-    return render_template('interacdome.html', pfam_ids=interacdome_pfam_ids, selected_pfam_id=selected_pfam_id, data=data)
+    return render_template('interacdome.html', pfam_ids=chimera.interacdome_pfam_ids, selected_pfam_id=selected_pfam_id)
+
+
+@bp.route('/plot_data/<algorithm>/<pfam_id>')
+def plot_data(algorithm, pfam_id):
+    # Prebuilt Plotly payloads are served as-is, and only re-sent if they've changed since the client last fetched them
+    if algorithm not in ALGORITHMS or pfam_id not in pfam_id_set(algorithm):
+        abort(404)
+
+    etag, payload = plot_cache().get(algorithm, pfam_id)
+    response = Response(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 @bp.route('/interacdome_faq')
@@ -66,16 +73,14 @@ def interacdome_download():
 def index():
 
     error_msg = ''
-    data_plotly = []
     seq_text = ''
-    domain_dataframe = None
-    n_hits = 0
     algorithm = ''
     domain_algorithm = ''
     email_address = ''
     full_domains = False
 
     job_id = ''
+    interactive = False
     n_sequences = 0
     max_sequences_interactive = config.web.max_sequences_interactive
 
@@ -106,33 +111,24 @@ def index():
                                   full_domains=full_domains)
                 job_id = job.id
         else:
-            domain_dataframe, binding_dataframe, result_filename = query(sequences=sequences, save_results=True,
-                                                                         email_address=email_address,
-                                                                         algorithm=algorithm,
-                                                                         domain_algorithm=domain_algorithm,
-                                                                         full_domains=full_domains)
-            session['result_filename'] = result_filename
-
-            for i, sequence in enumerate(sequences):
-                d = binding_freq_plot_data_sequence(str(sequence.seq), domain_dataframe, binding_dataframe)
-                data_plotly.append(d)
-
-            n_hits = len(domain_dataframe)
-
-    data_plotly = json.dumps(data_plotly, cls=plotly.utils.PlotlyJSONEncoder)
+            # Interactive jobs are also run by a Celery worker, so that web workers are not tied up while they run;
+            # the page polls for the status (and then the results) of the job.
+            job = query.delay(seq_text=seq_text, save_results=bool(email_address), email_address=email_address or None,
+                              algorithm=algorithm, domain_algorithm=domain_algorithm, full_domains=full_domains,
+                              interactive=True)
+            job_id = job.id
+            interactive = True
 
     return render_template(
         'index.html',
-        n_hits=n_hits,
 
         # For displaying warnings/messages
         error_msg=error_msg,
         job_id=job_id,
+        interactive=interactive,
         n_sequences=n_sequences,
         max_sequences_interactive=max_sequences_interactive,
 
-        df=domain_dataframe,
-        data_plotly=data_plotly,
         seq=seq_text,
         sample_seq=ctcf,
         algorithm=algorithm,
@@ -142,11 +138,45 @@ def index():
     )
 
 
-@bp.route('/seq_results')
-def seq_results():
-    try:
-        return send_file(session['result_filename'], as_attachment=True, attachment_filename='results.csv')
-    except:  # nopep8
+def _job_status(result):
+    status = {'job_id': result.id, 'state': result.state, 'ready': result.ready()}
+    if result.failed():
+        # Details of the failure are only logged, and not exposed to clients
+        logger.error(f'Job {result.id} failed: {result.result!r}')
+        status['error'] = 'Please try again later, or contact us if the problem persists.'
+    return status
+
+
+@bp.route('/job/<job_id>')
+def job_status(job_id):
+    return jsonify(_job_status(query.AsyncResult(job_id)))
+
+
+def _job_result(result):
+    # Results of a successful interactive job, or None if the job is not (yet) done or is not an interactive job
+    if not result.successful() or not isinstance(result.result, dict):
+        return None
+    return result.result
+
+
+@bp.route('/job/<job_id>/result')
+def job_result(job_id):
+    result = query.AsyncResult(job_id)
+    if not result.ready():
+        return jsonify(_job_status(result)), 202
+    if result.failed():
+        return jsonify(_job_status(result)), 500
+
+    results = _job_result(result)
+    if results is None:
         abort(404)
+    return jsonify({k: results[k] for k in ('n_hits', 'domains', 'data_plotly')})
 
 
+@bp.route('/seq_results/<job_id>')
+def seq_results(job_id):
+    results = _job_result(query.AsyncResult(job_id))
+    if results is None:
+        abort(404)
+    return Response(results['results_csv'], mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=results.csv'})
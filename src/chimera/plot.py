@@ -64,7 +64,7 @@ def figure(x, y, title=None, title_fontsize=None, figsize=(50, 3), **kwargs):
 
 def binding_freq_figure(pfam_id, ligand_type, title=None, raise_errors=True, detailed=False):
 
-    from chimera import df_dl
+    from chimera import df_dl, interacdome_binding_frequencies
 
     df_dl = df_dl[
         (df_dl.num_nonidentical_instances >= config.web.min_instances) &
@@ -84,7 +84,7 @@ def binding_freq_figure(pfam_id, ligand_type, title=None, raise_errors=True, det
         if detailed:
             kwargs = dict(
                 x=list(range(1, row.domain_length + 1)),
-                y=list(map(float, row.binding_frequencies.split(','))),
+                y=interacdome_binding_frequencies[row.name],
                 title=title,
                 title_fontsize=10,
                 xlabel='Position in Domain',
@@ -97,7 +97,7 @@ def binding_freq_figure(pfam_id, ligand_type, title=None, raise_errors=True, det
         else:
             kwargs = dict(
                 x=list(range(1, row.domain_length + 1)),
-                y=list(map(float, row.binding_frequencies.split(','))),
+                y=interacdome_binding_frequencies[row.name],
                 title=title,
                 title_fontsize=20,
                 xlabel=None,
@@ -23,18 +23,31 @@ LIGAND_TYPE_COLORS = {
 }
 
 
-def binding_freq_plot_data_domain(pfam_id, algorithm):
-
+def binding_freq_plot_data_domain(pfam_id, algorithm, df_dl=None):
+    """
+    Get plot data for the binding frequencies of a domain
+    :param pfam_id: Pfam id, e.g. 'PF00001_7tm_1'
+    :param algorithm: Ligand-binding algorithm (case-sensitive), one of 'interacdome'/'dsprint'
+    :param df_dl: A DataFrame of binding frequency records of this domain, if already at hand; by default these are
+        looked up in all records of the algorithm
+    :return: A dict of plot data, with 'data' and 'layout' keys
+    """
     if algorithm == 'interacdome':
-        from chimera import df_dl
-        df_dl = df_dl[
-            (df_dl.num_nonidentical_instances >= config.web.min_instances) &
-            (df_dl.num_structures >= config.web.min_structures)
-        ]
+        from chimera import interacdome_binding_frequencies as binding_frequencies
     elif algorithm == 'dsprint':
-        from chimera import df_dl_dsprint as df_dl
+        from chimera import dsprint_binding_frequencies as binding_frequencies
 
-    df_dl = df_dl[df_dl.pfam_id == pfam_id]
+    if df_dl is None:
+        if algorithm == 'interacdome':
+            from chimera import df_dl
+            df_dl = df_dl[
+                (df_dl.num_nonidentical_instances >= config.web.min_instances) &
+                (df_dl.num_structures >= config.web.min_structures)
+            ]
+        elif algorithm == 'dsprint':
+            from chimera import df_dl_dsprint as df_dl
+
+        df_dl = df_dl[df_dl.pfam_id == pfam_id]
 
     traces = []
     colorway = []
@@ -45,7 +58,7 @@ def binding_freq_plot_data_domain(pfam_id, algorithm):
             traces.append(
                 go.Bar(
                     x=list(range(1, row.domain_length + 1)),
-                    y=list(map(float, row.binding_frequencies.split(','))),
+                    y=binding_frequencies.tolist(row.name),
                     name=ligand_type
                 )
             )
@@ -59,6 +72,29 @@ def binding_freq_plot_data_domain(pfam_id, algorithm):
     }
 
 
+def binding_freq_plot_data_sequences(sequences, domain_df, df):
+    """
+    Get plot data for each of several sequences (see binding_freq_plot_data_sequence), from results for all of them
+    :param sequences: A list of Bio.SeqRecord.SeqRecord objects
+    :param domain_df: A DataFrame of domain hits for all sequences, with a 'query_id' column
+    :param df: A DataFrame of binding frequencies for all sequences, with a 'query_id' column
+    :return: A list of plot data dicts, one for each sequence
+    """
+    # Results are grouped by sequence once, so that each sequence's plot is built only from its own slice of results
+    domain_indices = domain_df.groupby('query_id', observed=True).indices
+    indices = df.groupby('query_id', observed=True).indices
+    empty = np.array([], dtype=int)
+
+    return [
+        binding_freq_plot_data_sequence(
+            str(sequence.seq),
+            domain_df.iloc[domain_indices.get(sequence.name, empty)],
+            df.iloc[indices.get(sequence.name, empty)]
+        )
+        for sequence in sequences
+    ]
+
+
 def binding_freq_plot_data_sequence(seq, domain_df, df):
 
     sequence_length = len(seq)
@@ -91,7 +127,7 @@ def binding_freq_plot_data_sequence(seq, domain_df, df):
             We use the same 'name' so that all box plots are in the same line.
     'line_width': By making this 0, we prevent the 'median' line to be displayed inside each individual box.
     """
-    for i, (pfam_domain, df) in enumerate(domain_df.groupby('pfam_domain')):
+    for i, (pfam_domain, df) in enumerate(domain_df.groupby('pfam_domain', observed=True)):
         for _, row in df.iterrows():
             traces.append(
                 go.Box(
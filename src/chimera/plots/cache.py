@@ -0,0 +1,217 @@
+"""
+A store of serialized Plotly payloads for the per-domain binding frequency pages (see binding_freq_plot_data_domain),
+so that browsing domain pages is a lookup rather than a filter/parse/serialize of the binding frequency tables.
+
+Payloads are built on first use, or ahead of time (for all domains of one or more algorithms) with:
+
+    python -m chimera.plots.cache --algorithm dsprint interacdome
+
+and persisted in a local SQLite database configured under cache.plots (CHIMERA_CACHE_PLOTS_PATH), if any.
+Payloads are keyed by a version of the data they're built from, so they're rebuilt whenever the binding frequency
+tables or the display thresholds in the config file change.
+"""
+import json
+import hashlib
+import logging
+import argparse
+import sqlite3
+import threading
+import pandas as pd
+import plotly
+
+import chimera
+from chimera import config
+from chimera.plots import binding_freq_plot_data_domain
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate all stored payloads, e.g. when the layout of plots changes
+PLOT_CACHE_VERSION = 1
+
+ALGORITHMS = ('dsprint', 'interacdome')
+
+
+def pfam_ids(algorithm):
+    """
+    Get the Pfam ids that are browsable for an algorithm
+    :param algorithm: Ligand-binding algorithm (case-sensitive), one of ALGORITHMS
+    :return: An array of Pfam ids
+    """
+    if algorithm == 'dsprint':
+        return chimera.dsprint_pfam_ids
+    elif algorithm == 'interacdome':
+        return chimera.interacdome_pfam_ids
+    else:
+        raise RuntimeError(f'Unsupported ligand frequency algorithm {algorithm}')
+
+
+def pfam_id_set(algorithm):
+    """
+    Get the Pfam ids that are browsable for an algorithm, for membership checks
+    :param algorithm: Ligand-binding algorithm (case-sensitive), one of ALGORITHMS
+    :return: A frozenset of Pfam ids
+    """
+    if algorithm == 'dsprint':
+        return chimera.dsprint_pfam_id_set
+    elif algorithm == 'interacdome':
+        return chimera.interacdome_pfam_id_set
+    else:
+        raise RuntimeError(f'Unsupported ligand frequency algorithm {algorithm}')
+
+
+def source_table(algorithm):
+    """
+    Get the binding frequency records that plots of an algorithm are built from
+    :param algorithm: Ligand-binding algorithm (case-sensitive), one of ALGORITHMS
+    :return: A DataFrame
+    """
+    if algorithm == 'dsprint':
+        return chimera.df_dl_dsprint
+    elif algorithm == 'interacdome':
+        return chimera.df_dl_filtered
+    else:
+        raise RuntimeError(f'Unsupported ligand frequency algorithm {algorithm}')
+
+
+# A dict mapping <algorithm> => (<DataFrame>, <version>), so that tables are only hashed once per process
+_source_versions = {}
+
+
+def source_version(algorithm):
+    """
+    Get a string that identifies the data (and settings) that plots of an algorithm are built from
+    :param algorithm: Ligand-binding algorithm (case-sensitive), one of ALGORITHMS
+    :return: A hex digest string
+    """
+    df = source_table(algorithm)
+    if _source_versions.get(algorithm, (None,))[0] is not df:
+        h = hashlib.sha256()
+        h.update(json.dumps([PLOT_CACHE_VERSION, algorithm, config.web.min_instances,
+                             config.web.min_structures]).encode('utf8'))
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        _source_versions[algorithm] = df, h.hexdigest()
+    return _source_versions[algorithm][1]
+
+
+class PlotCache:
+    """
+    Serialized Plotly payloads (and their ETags) for each (algorithm, pfam_id), kept in memory and (optionally)
+    persisted in a local SQLite database.
+    """
+
+    def __init__(self, db_path=None):
+        """
+        :param db_path: Path to a SQLite database (created if needed), or None to keep payloads in memory only
+        """
+        self.db_path = db_path
+        self._payloads = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if db_path is not None:
+            with self._connection() as conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS plots (algorithm TEXT NOT NULL, pfam_id TEXT NOT NULL, '
+                    'version TEXT NOT NULL, etag TEXT NOT NULL, payload TEXT NOT NULL, '
+                    'PRIMARY KEY (algorithm, pfam_id))'
+                )
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads, so we keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30)
+        return conn
+
+    @staticmethod
+    def _build(algorithm, pfam_id, df_dl=None):
+        if df_dl is None:
+            df = source_table(algorithm)
+            df_dl = df[df.pfam_id == pfam_id]
+        payload = json.dumps(binding_freq_plot_data_domain(pfam_id, algorithm=algorithm, df_dl=df_dl),
+                             cls=plotly.utils.PlotlyJSONEncoder)
+        return hashlib.sha256(payload.encode('utf8')).hexdigest()[:32], payload
+
+    def get(self, algorithm, pfam_id, df_dl=None):
+        """
+        Get the serialized Plotly payload for a domain, building (and storing) it if needed
+        :param algorithm: Ligand-binding algorithm (case-sensitive), one of ALGORITHMS
+        :param pfam_id: Pfam id, e.g. 'PF00001_7tm_1'
+        :param df_dl: See binding_freq_plot_data_domain
+        :return: A 2-tuple of strings
+            0: ETag of the payload
+            1: JSON payload
+        """
+        version = source_version(algorithm)
+        key = algorithm, pfam_id
+        with self._lock:
+            if self._payloads.get(key, (None,))[0] == version:
+                return self._payloads[key][1:]
+
+        row = None
+        if self.db_path is not None:
+            with self._connection() as conn:
+                row = conn.execute('SELECT etag, payload FROM plots WHERE algorithm = ? AND pfam_id = ? AND version = ?',
+                                   (algorithm, pfam_id, version)).fetchone()
+        if row is None:
+            row = self._build(algorithm, pfam_id, df_dl=df_dl)
+            if self.db_path is not None:
+                with self._connection() as conn:
+                    conn.execute('INSERT OR REPLACE INTO plots VALUES (?, ?, ?, ?, ?)',
+                                 (algorithm, pfam_id, version) + row)
+
+        with self._lock:
+            self._payloads[key] = (version,) + tuple(row)
+        return tuple(row)
+
+    def build(self, algorithm):
+        """
+        Build and persist payloads for all browsable domains of an algorithm, dropping payloads built from other
+        versions of the data
+        :param algorithm: Ligand-binding algorithm (case-sensitive), one of ALGORITHMS
+        :return: No. of payloads built
+        """
+        version = source_version(algorithm)
+        if self.db_path is not None:
+            with self._connection() as conn:
+                conn.execute('DELETE FROM plots WHERE algorithm = ? AND version != ?', (algorithm, version))
+
+        # Records are grouped by domain once, rather than looked up in the whole table for each domain
+        df = source_table(algorithm)
+        indices = df.groupby('pfam_id', sort=False).indices
+        ids = pfam_ids(algorithm)
+        logger.info(f'Building {len(ids)} plots for {algorithm}')
+        for pfam_id in ids:
+            self.get(algorithm, pfam_id, df_dl=df.iloc[indices[pfam_id]])
+        return len(ids)
+
+
+# A dict mapping <path> => PlotCache, shared across calls
+_plot_caches = {}
+
+
+def plot_cache():
+    """
+    Get the PlotCache persisted at the path configured in the config file (under cache.plots), or an in-memory
+    PlotCache if no such path is configured. Caches are shared by all calls in a process.
+    :return: A PlotCache object
+    """
+    path = config.cache.plots.path or None
+    if path not in _plot_caches:
+        _plot_caches[path] = PlotCache(db_path=path)
+    return _plot_caches[path]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build Plotly payloads for per-domain binding frequency pages')
+    parser.add_argument('--algorithm', nargs='+', choices=ALGORITHMS, default=list(ALGORITHMS),
+                        help='Ligand-binding algorithm(s)')
+    args = parser.parse_args()
+
+    if not config.cache.plots.path:
+        parser.error('No plot cache path configured (CHIMERA_CACHE_PLOTS_PATH)')
+
+    for algorithm in args.algorithm:
+        n = plot_cache().build(algorithm)
+        logger.info(f'Built {n} plots for {algorithm}')
@@ -1,17 +1,26 @@
+import json
 from tempfile import NamedTemporaryFile
+import plotly
 from celery import Celery
 
 from chimera import config
 from chimera.core import query as sequence_query
+from chimera.plots import binding_freq_plot_data_sequences
 from chimera.utils import email, parse_fasta
 
 app = Celery('tasks', broker=config.celery.broker, backend=config.celery.backend)
+# Report a 'STARTED' state for running jobs (rather than 'PENDING' until they finish), for job status requests
+app.conf.task_track_started = True
 app.control.enable_events()
 
+# Columns of the domain table that are returned for interactive jobs
+DOMAIN_COLUMNS = ['query_id', 'pfam_domain', 'bit_score', 'domain_length', 'e_value', 'hmm_start', 'hmm_end',
+                  'target_start', 'target_end']
+
 
 @app.task
 def query(sequences=None, seq_text=None, save_results=False, email_address=None, algorithm='dsprint',
-          domain_algorithm='hmmer', silent=False, full_domains=False):
+          domain_algorithm='hmmer', silent=False, full_domains=False, interactive=False):
     """
     Query 1 or more sequences and send final results to an email address
 
@@ -30,10 +39,17 @@ def query(sequences=None, seq_text=None, save_results=False, email_address=None,
     :param silent: A boolean indicating whether we return anything
         Useful when this function is executed in asynchronous mode to avoid serialization issues with returned objects
     :param full_domains: A boolean indicating whether we restrict results to full domain matches.
-    :return: If silent is False, a 3-tuple of values
-        0: DataFrame containing Hmmer matches
-        1: DataFrame containing Ligand-binding frequency data
-        2: The file path of saved results if save_results=True, None otherwise
+    :param interactive: A boolean indicating whether we return (JSON-serializable) results for display on the site,
+        instead of DataFrames. Useful when this function is executed in asynchronous mode for the site.
+    :return: If silent is False and interactive is True, a dict with keys:
+            n_hits: No. of domain hits
+            domains: A list of dicts, one for each domain hit, with keys DOMAIN_COLUMNS
+            data_plotly: A list of (JSON-serializable) Plotly figures, one for each sequence
+            results_csv: Complete results, in csv format
+        If silent is False and interactive is False, a 3-tuple of values
+            0: DataFrame containing Hmmer matches
+            1: DataFrame containing Ligand-binding frequency data
+            2: The file path of saved results if save_results=True, None otherwise
     """
     if seq_text is not None:
         sequences = parse_fasta(seq_text)
@@ -54,6 +70,18 @@ def query(sequences=None, seq_text=None, save_results=False, email_address=None,
     if email_address is not None and email_address.strip():
         email(email_address, f'ProtDomain Results for job {query.request.id}', 'ProtDomain Results are attached.', [result_filename])
 
-    if not silent:
-        return domains, df, result_filename
+    if silent:
+        return
+
+    if interactive:
+        data_plotly = binding_freq_plot_data_sequences(sequences, domains, df)
+        return {
+            'n_hits': len(domains),
+            # float32 bit scores are displayed as strings, e.g. '18.923153' rather than 18.923152923583984
+            'domains': json.loads(domains[DOMAIN_COLUMNS].astype({'bit_score': str}).to_json(orient='records')),
+            'data_plotly': json.loads(json.dumps(data_plotly, cls=plotly.utils.PlotlyJSONEncoder)),
+            'results_csv': domains.to_csv(index=False)
+        }
+
+    return domains, df, result_filename
 
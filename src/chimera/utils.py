@@ -2,6 +2,7 @@ import subprocess
 import os.path
 import logging
 import importlib.resources
+import numpy as np
 import pandas as pd
 from io import StringIO
 from Bio import SeqIO
@@ -39,15 +40,34 @@ with importlib.resources.path(chimera.data, 'vdw.txt') as path:
     vdw_df.index = vdw_df.index.str.lower()
     vdw_df = vdw_df.replace({pd.np.nan: None})
 
+# A dict mapping <lowercase element symbol> => <element code>, and the radius of each element code, indexed by code.
+# The radius is the VDW radius of the element, falling back to its ionic radius, falling back to 1.5
+vdw_element_codes = {element: i for i, element in enumerate(vdw_df.index)}
+_vdw_radii = np.array([s.vdw_radius or s.ionic_radius or 1.5 for s in vdw_df.itertuples()], dtype=float)
+
 
 def vdw_radius(element):
     """
     Return VDW radius of element
-    :param element: Element symbol (case-sensitive)
+    :param element: Element symbol (case-insensitive)
     :return: Float indicating the VDW radius
     """
-    s = vdw_df.loc[element.lower()]
-    return s.vdw_radius or s.ionic_radius or 1.5
+    return float(_vdw_radii[vdw_element_codes[element.lower()]])
+
+
+def vdw_radii(elements):
+    """
+    Return VDW radii of elements (see vdw_radius)
+    :param elements: An array-like of element symbols (case-insensitive), e.g. a pandas Series
+    :return: A numpy array of floats indicating the VDW radii
+    """
+    # Elements are typically drawn from a handful of distinct values, so we only look up the distinct ones
+    codes, uniques = pd.factorize(np.asarray(elements, dtype=object))
+    unknown = [element for element in uniques if str(element).lower() not in vdw_element_codes]
+    if unknown:
+        raise RuntimeError(f'Unknown element(s) {unknown}')
+    element_codes = np.array([vdw_element_codes[str(element).lower()] for element in uniques], dtype=int)
+    return _vdw_radii[element_codes[codes]]
 
 
 _ligand_to_groups = {}
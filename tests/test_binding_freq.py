@@ -1,11 +1,20 @@
-from unittest import TestCase
+import os
+import json
+from unittest import TestCase, mock
 from importlib.resources import read_text
+import pandas as pd
 
+from chimera import binding_frequencies_interacdome
 from chimera.utils import parse_fasta
-from chimera.core import seq_to_matchstates
+from chimera.core import seq_to_matchstates, seqs_to_matchstates, domain_binding_frequencies
+from chimera.core.domain.hmmerweb import HmmerWebDomainFinder
 
-ctcf = read_text('chimera.data.sample', 'ctcf.fa')
-ctcf = str(parse_fasta(ctcf)[0].seq)
+ctcf_record = parse_fasta(read_text('chimera.data.sample', 'ctcf.fa'))[0]
+ctcf = str(ctcf_record.seq)
+
+# A Hmmer Web response for CTCF
+with open(os.path.join(os.path.dirname(__file__), 'hmmr_ctcf_results.json')) as f:
+    ctcf_response = json.load(f)
 
 
 class BindingSeqTestCase(TestCase):
@@ -72,3 +81,46 @@ class BindingSeqTestCase(TestCase):
 
         # match_states are NOT contiguous, 1..21, 23..26 (i.e. missing 22, the 1-indexed position of the deletion)
         self.assertEqual(match_states, tuple(range(1, 22)) + tuple(range(23, 27)))
+
+    def testMatchStatesBatch(self):
+        # Normal, insertion and deletion hits from Hmmer for CTCF, converted in a single batch
+        hits = [
+            ('FQCELCSYTCPRRSNLDRHMKSH', 266, 288),
+            ('HKCPDCDMAFVTSGELVRHRRYkH', 322, 345),
+            ('FQCSLCSYASRDTYKLKRHMR-THSG', 379, 403)
+        ]
+        rows, match_states, seq_indices = seqs_to_matchstates(*zip(*hits))
+
+        for i, (domain_seq, start, end) in enumerate(hits):
+            _match_states, _seq_indices = seq_to_matchstates(domain_seq, start, end)
+            self.assertEqual(tuple(match_states[rows == i]), _match_states)
+            self.assertEqual(tuple(seq_indices[rows == i]), _seq_indices)
+
+
+class DomainBindingFrequenciesTestCase(TestCase):
+    def setUp(self):
+        # CTCF, and a fragment of it (with a subset of its domain hits)
+        fragment = ctcf_record[:400]
+        fragment.id = fragment.name = 'ctcf_fragment'
+        with mock.patch.object(HmmerWebDomainFinder, '_post', return_value=ctcf_response):
+            self.domains = HmmerWebDomainFinder().domain_table([ctcf_record, fragment])
+
+    def tearDown(self):
+        pass
+
+    def testMatchesMerge(self):
+        df = domain_binding_frequencies(self.domains, algorithm='interacdome')
+
+        # The unpivoted match/sequence table, merged with the binding frequency table
+        match_rows = []
+        for (query_id, pfam_domain), _df in self.domains.groupby(['query_id', 'pfam_domain']):
+            for _, row in _df.iterrows():
+                for match_i, seq_i in zip(row.match_states, row.seq_indices):
+                    match_rows.append({'query_id': query_id, 'pfam_domain': pfam_domain, 'match_i': match_i,
+                                       'seq_i': seq_i})
+        expected = pd.merge(pd.DataFrame(match_rows), binding_frequencies_interacdome,
+                            left_on=['pfam_domain', 'match_i'], right_on=['pfam_id', 'match_state'])
+
+        # Same rows, in the same order and with the same dtypes
+        self.assertGreater(len(df), 0)
+        pd.testing.assert_frame_equal(expected, df[expected.columns])
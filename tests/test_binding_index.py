@@ -0,0 +1,188 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+from importlib.resources import path
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import chimera.data
+from chimera import binding_frequencies_interacdome, config
+from chimera.core.binding import BindingFrequencyIndex, BindingFrequencyArray, unpivot_binding_frequencies, \
+    write_binding_frequencies
+
+
+class BindingFrequencyIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = BindingFrequencyIndex(binding_frequencies_interacdome)
+
+    def tearDown(self):
+        pass
+
+    def testLookupMatchesMerge(self):
+        # A mix of known pfam ids, an unknown pfam id, and match states both within and beyond the domain length
+        pfam_ids = list(self.index.pfam_ids[:5]) + ['PF99999_Unknown']
+        matches = pd.DataFrame({
+            'pfam_domain': np.repeat(pfam_ids, 400),
+            'match_i': np.tile(np.arange(1, 401), len(pfam_ids))
+        })
+
+        expected = pd.merge(matches, binding_frequencies_interacdome, left_on=['pfam_domain', 'match_i'],
+                            right_on=['pfam_id', 'match_state'])
+
+        indices, ligand_types, binding_frequencies = self.index.lookup(matches['pfam_domain'], matches['match_i'])
+        actual = matches.iloc[indices].reset_index(drop=True)
+        actual['ligand_type'] = ligand_types
+        actual['binding_frequency'] = binding_frequencies
+
+        columns = ['pfam_domain', 'match_i', 'ligand_type', 'binding_frequency']
+        expected = expected[columns].sort_values(columns).reset_index(drop=True)
+        actual = actual[columns].sort_values(columns).reset_index(drop=True)
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+
+    def testLookupEmpty(self):
+        indices, ligand_types, binding_frequencies = self.index.lookup([], [])
+        self.assertEqual(0, len(indices))
+        self.assertEqual(0, len(binding_frequencies))
+
+
+class BindingFrequencyArrayTestCase(TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'pfam_id': ['PF00002_B', 'PF00001_A', 'PF00001_A'],
+            'ligand_type': ['dna', 'ion', 'sm'],
+            'binding_frequencies': ['1,0.25', '0.1,0.2,0.3', '0.5,0,0']
+        }, index=[10, 20, 30])
+        self.binding_frequencies = BindingFrequencyArray(self.df['binding_frequencies'])
+
+    def tearDown(self):
+        pass
+
+    def testGetItem(self):
+        self.assertEqual(3, len(self.binding_frequencies))
+        self.assertEqual(np.float32, self.binding_frequencies.values.dtype)
+        for label, row in self.df.iterrows():
+            expected = np.array(row.binding_frequencies.split(','), dtype=np.float32)
+            np.testing.assert_array_equal(expected, self.binding_frequencies[label])
+        self.assertEqual([0.1, 0.2, 0.3], self.binding_frequencies.tolist(20))
+
+    def testUnpivot(self):
+        df = self.df.loc[[30, 10]]
+        actual = unpivot_binding_frequencies(df, self.binding_frequencies)
+
+        expected = pd.DataFrame([
+            {'pfam_id': row.pfam_id, 'match_state': i, 'ligand_type': row.ligand_type, 'binding_frequency': float(bf)}
+            for _, row in df.iterrows() for i, bf in enumerate(row.binding_frequencies.split(','), start=1)
+        ])
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+
+        # The unpivoted table is what the query merge is built from
+        indices, ligand_types, binding_frequencies = BindingFrequencyIndex(actual).lookup(['PF00002_B'] * 3, [1, 2, 3])
+        self.assertEqual([0, 1], list(indices))
+        np.testing.assert_array_equal([1, 0.25], binding_frequencies)
+
+    def testParseError(self):
+        with self.assertRaises(RuntimeError):
+            BindingFrequencyArray(pd.Series(['0.1,0.2', '0.5,,0.1']))
+
+
+class BindingFrequencyFileTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_filepath = os.path.join(self.tmp_dir.name, 'interacdome_fordownload.tsv')
+        self.filepath = os.path.join(self.tmp_dir.name, 'binding_frequencies_interacdome.parquet')
+
+        rng = np.random.default_rng(0)
+        records = []
+        for i in range(50):
+            length = rng.integers(1, 30)
+            for ligand_type in ('SM_', 'ION_', 'DNA_', 'DNA'):
+                records.append({
+                    'pfam_id': f'PF{50 - i:05d}_{i}',
+                    'domain_length': length,
+                    'ligand_type': ligand_type,
+                    'binding_frequencies': ','.join(map(str, rng.integers(0, 100, length) / 100)),
+                    'num_nonidentical_instances': rng.integers(0, 10),
+                    'num_structures': rng.integers(0, 10),
+                    'max_achieved_precision': rng.random()
+                })
+        self.df = pd.DataFrame(records)
+        self.df.to_csv(self.source_filepath, sep='\t', index=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, **kwargs):
+        return write_binding_frequencies('interacdome', filepath=self.filepath, source_filepath=self.source_filepath,
+                                         row_group_size=100, **kwargs)
+
+    def testWrite(self):
+        self.assertTrue(self._write())
+
+        # The same table (in the same order) as was generated, a record and a match state at a time, before
+        df = self.df[
+            (self.df['num_nonidentical_instances'] >= config.web.min_instances) &
+            (self.df['num_structures'] >= config.web.min_structures) &
+            (self.df['max_achieved_precision'] >= config.web.min_achieved_precision) &
+            self.df['ligand_type'].str.endswith('_')
+        ]
+        expected = pd.DataFrame([
+            {'pfam_id': pfam_id, 'match_state': i, 'ligand_type': row.ligand_type[:-1].lower(),
+             'binding_frequency': float(bf)}
+            for pfam_id, _df in df.groupby('pfam_id') for _, row in _df.iterrows()
+            for i, bf in enumerate(row.binding_frequencies.split(','), start=1)
+        ])
+        actual = pd.read_parquet(self.filepath)
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False, atol=1e-7)
+
+        # Each pfam id is in a single row group
+        parquet_file = pq.ParquetFile(self.filepath)
+        self.assertGreater(parquet_file.num_row_groups, 1)
+        row_group_pfam_ids = [set(parquet_file.read_row_group(i, columns=['pfam_id']).column(0).to_pylist())
+                              for i in range(parquet_file.num_row_groups)]
+        self.assertEqual(len(actual['pfam_id'].unique()), sum(len(pfam_ids) for pfam_ids in row_group_pfam_ids))
+
+    def testShippedTable(self):
+        # Regenerating the shipped table from its source file gives the same table, in the same order
+        with path(chimera.data, 'interacdome_fordownload.tsv') as source_filepath:
+            if not os.path.exists(source_filepath):
+                self.skipTest('interacdome_fordownload.tsv not found')
+            write_binding_frequencies('interacdome', filepath=self.filepath, source_filepath=str(source_filepath))
+
+        pd.testing.assert_frame_equal(binding_frequencies_interacdome, pd.read_parquet(self.filepath),
+                                      check_dtype=False)
+
+    def testExactValues(self):
+        self.df.loc[0, ['binding_frequencies', 'num_nonidentical_instances', 'num_structures',
+                        'max_achieved_precision']] = '0.1,0.123456789', 10, 10, 1
+        self.df.loc[0, 'domain_length'] = 2
+        self.df.to_csv(self.source_filepath, sep='\t', index=False)
+        self._write()
+
+        df = pd.read_parquet(self.filepath)
+        self.assertEqual('float64', df['binding_frequency'].dtype)
+
+        # Values looked up for query results are exactly those in the source file
+        index = BindingFrequencyIndex(df)
+        _, ligand_types, binding_frequencies = index.lookup([self.df.loc[0, 'pfam_id']] * 2, [1, 2])
+        binding_frequencies = binding_frequencies[ligand_types == 'sm']
+        self.assertEqual([0.1, 0.123456789], list(binding_frequencies))
+        self.assertEqual(['0.1', '0.123456789'], pd.Series(binding_frequencies).to_csv(index=False).split()[1:])
+
+    def testIncremental(self):
+        self.assertTrue(self._write())
+        self.assertFalse(self._write())
+        self.assertTrue(self._write(force=True))
+
+        # The table is regenerated if thresholds change
+        n = len(pd.read_parquet(self.filepath))
+        with mock.patch.object(config.web, 'min_instances', 0):
+            self.assertTrue(self._write())
+            self.assertLess(n, len(pd.read_parquet(self.filepath)))
+            self.assertFalse(self._write())
+        self.assertTrue(self._write())
+
+        # .. or if the source file changes
+        self.df.iloc[:-1].to_csv(self.source_filepath, sep='\t', index=False)
+        self.assertTrue(self._write())
+        self.assertFalse(self._write())
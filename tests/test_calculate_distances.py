@@ -1,9 +1,15 @@
+import os
 from importlib.resources import path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 import chimera.data.sample
 import chimera.data.sample.ligand
 import chimera.data.sample.receptor
-from chimera.distance import create_distance_file
+import numpy as np
+import pandas as pd
+from chimera.distance import ANNOTATION_COLUMNS, create_distance_file, create_distance_files, distance_filepath, \
+    overlaps, OverlapTable, distance_df_to_csv, distance_df_to_parquet, read_distance_file, \
+    create_fastas
 
 
 class CalcDistanceTestCase(TestCase):
@@ -30,3 +36,112 @@ class CalcDistanceTestCase(TestCase):
                     compressed=False,
                     calculate_overlap=True
                 )
+
+    def testOverlapAnalytic(self):
+        dist = np.array([0, 0.5, 1.0, 2.5, 4.0, 3.0, 3.0])
+        r1 = np.array([1.5, 1.55, 1.7, 1.52, 1.8, 1.5, 1.8])
+        r2 = np.array([1.5, 1.8, 1.52, 1.7, 1.8, 1.8, 1.5])
+
+        expected, _ = overlaps(dist, r1, r2, method='quad')
+        actual, errors = overlaps(dist, r1, r2, method='analytic')
+        np.testing.assert_allclose(expected, actual, rtol=1e-5)
+        np.testing.assert_array_equal(0, errors)
+
+        # Identical distributions overlap completely
+        self.assertAlmostEqual(1.0, overlaps([0], 1.5, 1.5, method='analytic')[0][0])
+
+    def testOverlapTable(self):
+        dist = np.linspace(0, 25, 1001)
+        r1 = np.resize([1.5, 1.55, 1.7, 1.52, 1.8], len(dist))
+        r2 = np.resize([1.5, 1.8, 1.52, 1.7], len(dist))
+        expected, _ = overlaps(dist, r1, r2, method='analytic')
+
+        with TemporaryDirectory() as tmp_dir:
+            table_path = os.path.join(tmp_dir, 'overlaps.npz')
+            np.testing.assert_allclose(expected, OverlapTable(table_path).lookup(dist, r1, r2), rtol=1e-5)
+
+            # Tables are persisted, and reused by new OverlapTable objects
+            table = OverlapTable(table_path)
+            self.assertIn((1.5, 1.8), table.rows)
+            np.testing.assert_allclose(expected, table.lookup(dist, r1, r2), rtol=1e-5)
+
+    def testDistanceFiles(self):
+        with TemporaryDirectory() as tmp_dir:
+            annotation = dict.fromkeys(ANNOTATION_COLUMNS, '')
+            annotation.update(pdb_id='2lue', pdb_chain='A', ligand_id='III', ligand_chain='B', ligand_serial_number=1)
+            annotations = [annotation, dict(annotation, pdb_id='9zzz')]  # no structures for 9zzz
+            annotation_file = os.path.join(tmp_dir, 'annotations.txt')
+            with open(annotation_file, 'w') as f:
+                for a in annotations:
+                    f.write('\t'.join(str(a[c]) for c in ANNOTATION_COLUMNS) + '\n')
+
+            receptor_dir = os.path.dirname(chimera.data.sample.receptor.__file__)
+            ligand_dir = os.path.dirname(chimera.data.sample.ligand.__file__)
+            kwargs = dict(annotation_file=annotation_file, pdb_ids=['2lue', '9zzz', '0abc'], receptor_dir=receptor_dir,
+                          ligand_dir=ligand_dir, distance_dir=tmp_dir, max_workers=2, overlap_method='analytic')
+
+            results = create_distance_files(**kwargs).set_index('pdb_id').status
+            self.assertEqual({'2lue': 'created', '9zzz': 'failed', '0abc': 'failed'}, results.to_dict())
+            self.assertTrue(os.path.exists(distance_filepath(tmp_dir, '2lue')))
+
+            # Up-to-date distance files are not re-created
+            results = create_distance_files(**kwargs).set_index('pdb_id').status
+            self.assertEqual('skipped', results['2lue'])
+
+    def testParquetDistanceFile(self):
+        df = pd.DataFrame({
+            'pdbID-pdbChain': ['2lueA'] * 3,
+            'receptor_aa_1-index': [2, 3, 3],
+            'receptor_aa_value': ['A', 'M', 'M'],
+            'receptor_atom_id': ['1/1', '1/4', '2/4'],
+            'receptor_atom_value': ['C', 'C', 'S'],
+            'ligand_id': ['III'] * 3,
+            'ligand_atom_value': ['N', 'N', 'O'],
+            'euclidean_distance': [16.96673241964993, 13.904636564829731, 4.25],
+            'overlap_vdw_radii': [5.968761e-07, 1.880736e-05, 0.25],
+            'integral_error_vdw_radii': [1.1e-06, 1.2e-06, 1e-10],
+            'overlap_1.5': [5.979602e-08, 3.571466e-06, 0.125],
+            'integral_error_1.5': [1.1e-07, 1.5e-07, 1e-10],
+            'full_receptor_sequence': ['GAM', '', '']
+        })
+
+        with TemporaryDirectory() as tmp_dir:
+            text_path, parquet_path = os.path.join(tmp_dir, 'd.txt'), os.path.join(tmp_dir, 'd.parquet')
+            distance_df_to_csv(df, '2lue', text_path)
+            distance_df_to_parquet(df, '2lue', parquet_path)
+            expected, actual = read_distance_file(text_path), read_distance_file(parquet_path)
+
+        self.assertEqual('category', actual['ligand_atom_value'].dtype.name)
+        self.assertEqual('float32', actual['euclidean_distance'].dtype.name)
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False, check_categorical=False, rtol=1e-6)
+
+    def testFastas(self):
+        df = pd.DataFrame({
+            'pdbID-pdbChain': ['2lueA'] * 5,
+            'receptor_aa_1-index': [3, 3, 3, 3, 2],
+            'receptor_atom_id': ['1/4', '1/4', '2/4', '3/4', '1/1'],
+            'ligand_id': ['III', 'III', 'III', 'ZN', 'III'],
+            'euclidean_distance': [3.0, 5.0, 6.0, 2.0, 10.0],
+            'overlap_vdw_radii': [0.5, 0.25, 0.1, 0.3, 0.01],
+            'integral_error_vdw_radii': [0, 0, 0, 1, 0],
+            'overlap_1.5': [0.5, 0.25, 0.1, 0.3, 0.01],
+            'integral_error_1.5': [0, 0, 0, 1, 0],
+            'full_receptor_sequence': ['GAM', '', '', '', '']
+        })
+
+        with TemporaryDirectory() as tmp_dir:
+            filepaths = create_fastas(df, os.path.join(tmp_dir, '2lue_{distance}.fa'))
+            fastas = {distance: open(filepath).read() for distance, filepath in filepaths.items()}
+
+        # Entries are sorted by residue and ligand; rows whose overlap is within the integration error are ignored
+        # for overlap-based metrics, and missing atoms count as being at the distance cutoff for 'meandist'
+        expected = {
+            'mindist': '2-III-10.00000,3-III-3.00000,3-ZN-2.00000',
+            'fracin4': '2-III-0.00000,3-III-0.25000,3-ZN-0.25000',
+            'meandist': '2-III-10.00000,3-III-9.66667,3-ZN-14.00000',
+            'maxstd': '2-III-0.01000,3-III-0.75000',
+            'meanstd': '2-III-0.01000,3-III-0.42500',
+            'sumvdw': '2-III-0.01000,3-III-0.85000'
+        }
+        for distance, binding_site_res in expected.items():
+            self.assertEqual(f'>2lueA bindingSiteRes={binding_site_res};\nGAM\n\n', fastas[distance])
@@ -0,0 +1,124 @@
+import os
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from chimera.core.domain import DomainFinder
+from chimera.core.domain.cache import SqliteDomainCache
+
+
+class CountingDomainFinder(DomainFinder):
+    """
+    A DomainFinder that reports a single fake hit per sequence, and keeps track of sequences it was asked about.
+    """
+
+    algorithm = 'counting'
+
+    def __init__(self, cache=None):
+        super().__init__(cache=cache)
+        self.database = 'v1'
+        self.queried = []
+
+    def database_version(self):
+        return self.database
+
+    def _iter_domains(self, sequences):
+        for sequence in sequences:
+            self.queried.append(sequence.name)
+            yield {'query_id': sequence.name, 'alihmmacc': 'PF00001.1', 'alihmmname': 'fake', 'alisqfrom': 1,
+                   'alisqto': len(sequence.seq), 'alihmmfrom': 1, 'alihmmto': len(sequence.seq),
+                   'aliM': len(sequence.seq), 'bitscore': 1.5, 'ievalue': 0.1, 'aliaseq': str(sequence.seq)}
+
+
+class DomainCacheTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def testCacheHit(self):
+        domain_finder = CountingDomainFinder(cache=SqliteDomainCache(self.db_path))
+        s1, s2 = SeqRecord(Seq('MEGDAVEAIV'), id='s1', name='s1'), SeqRecord(Seq('KKTFQCELCSY'), id='s2', name='s2')
+
+        first = domain_finder.find_domains([s1])
+        self.assertEqual(['s1'], domain_finder.queried)
+
+        # Only the sequence we haven't seen before is queried, but results are returned for both, in order
+        results = domain_finder.find_domains([s2, s1])
+        self.assertEqual(['s1', 's2'], domain_finder.queried)
+        self.assertEqual(['s2', 's1'], [r['query_id'] for r in results])
+        self.assertEqual(first, results[1:])
+
+        # Cached results are keyed on sequence content, not sequence name
+        renamed = SeqRecord(Seq('MEGDAVEAIV'), id='renamed', name='renamed')
+        results = domain_finder.find_domains([renamed])
+        self.assertEqual(['s1', 's2'], domain_finder.queried)
+        self.assertEqual('renamed', results[0]['query_id'])
+
+    def testStreaming(self):
+        domain_finder = CountingDomainFinder(cache=SqliteDomainCache(self.db_path))
+        s1, s2 = SeqRecord(Seq('MEGDAVEAIV'), id='s1', name='s1'), SeqRecord(Seq('KKTFQCELCSY'), id='s2', name='s2')
+
+        s3 = SeqRecord(Seq('VKKTFQCE'), id='s3', name='s3')
+
+        # Hits for a sequence are available (and cached) as soon as the next sequence's hits start coming in,
+        # before the search is complete
+        hits = domain_finder.iter_domains([s1, s2, s3])
+        self.assertEqual('s1', next(hits)['query_id'])
+        self.assertEqual(['s1', 's2'], domain_finder.queried)
+        self.assertEqual(['s2', 's3'], [hit['query_id'] for hit in hits])
+        self.assertEqual(['s1', 's2', 's3'], domain_finder.queried)
+
+        df = domain_finder.domain_table([s1, s2])
+        self.assertEqual(['s1', 's2', 's3'], domain_finder.queried)
+        self.assertEqual(['s1', 's2'], list(df['query_id']))
+        self.assertEqual(['PF00001_fake', 'PF00001_fake'], list(df['pfam_domain']))
+        self.assertEqual([10, 11], list(df['target_end']))
+        self.assertEqual('category', df['pfam_domain'].dtype.name)
+        self.assertEqual('int32', df['target_end'].dtype.name)
+        self.assertEqual('float32', df['bit_score'].dtype.name)
+
+    def testDuplicateNames(self):
+        domain_finder = CountingDomainFinder(cache=SqliteDomainCache(self.db_path))
+        s1, s2 = SeqRecord(Seq('MEGDAVEAIV'), id='s', name='s'), SeqRecord(Seq('KKTFQCELCSY'), id='s', name='s')
+
+        # Sequences with the same name each get (and cache) their own hits
+        results = domain_finder.find_domains([s1, s2])
+        self.assertEqual(['s', 's'], [r['query_id'] for r in results])
+        self.assertEqual(['MEGDAVEAIV', 'KKTFQCELCSY'], [r['aliaseq'] for r in results])
+
+        results = domain_finder.find_domains([s2])
+        self.assertEqual(2, len(domain_finder.queried))
+        self.assertEqual(['KKTFQCELCSY'], [r['aliaseq'] for r in results])
+
+        # .. as they do without a cache
+        domain_finder = CountingDomainFinder(cache=None)
+        domain_finder.cache = None
+        results = domain_finder.find_domains([s1, s2])
+        self.assertEqual(['MEGDAVEAIV', 'KKTFQCELCSY'], [r['aliaseq'] for r in results])
+
+    def testCacheInvalidation(self):
+        domain_finder = CountingDomainFinder(cache=SqliteDomainCache(self.db_path))
+        s1 = SeqRecord(Seq('MEGDAVEAIV'), id='s1', name='s1')
+
+        domain_finder.find_domains([s1])
+        domain_finder.database = 'v2'
+        domain_finder.find_domains([s1])
+        self.assertEqual(['s1', 's1'], domain_finder.queried)
+
+    def testEviction(self):
+        cache = SqliteDomainCache(self.db_path, max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, [])
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual([], cache.get('b'))
+        self.assertEqual([], cache.get('c'))
+
+        # 'b' is now the least recently used entry
+        cache.get('c')
+        cache.put('d', [])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([], cache.get('c'))
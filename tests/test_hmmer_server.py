@@ -0,0 +1,55 @@
+import os
+import time
+import threading
+from unittest import TestCase, mock
+from tempfile import TemporaryDirectory
+from importlib.resources import path, read_text
+
+import chimera.data.sample
+from chimera.utils import parse_fasta
+from chimera import config
+from chimera.core.domain.hmmerserver import HmmerServer, find_domains
+
+globins = parse_fasta(read_text('chimera.data.sample', 'globins45.fa'))
+
+
+class HmmerServerTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        # The server removes this socket file on exit
+        self.address = os.path.join(self.tmp_dir.name, 'chimera_hmmer.sock')
+
+        with path(chimera.data.sample, 'globins4.hmm') as hmm_path:
+            # The sample HMM has no gathering thresholds
+            self.server = HmmerServer(str(hmm_path), cut_ga=False, cpus=1)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(self.address,), daemon=True)
+        self.thread.start()
+        while not os.path.exists(self.address):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join(timeout=10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.address))
+        self.tmp_dir.cleanup()
+
+    def testHmmDomains(self):
+        results = find_domains(globins[:5], address=self.address)
+        self.assertEqual([s.name for s in globins[:5]], [r['query_id'] for r in results])
+
+        top_record = results[0]
+        self.assertEqual('globins4', top_record['alihmmname'])
+        self.assertEqual(149, top_record['aliM'])
+        self.assertEqual(1, top_record['alisqfrom'])
+        self.assertEqual(147, top_record['alisqto'])
+        # Aligned sequence has one residue per sequence position, plus deletions
+        self.assertEqual(147, len(top_record['aliaseq'].replace('-', '')))
+
+    def testTcpAuthkey(self):
+        # TCP sockets are only served to, and used by, authenticated clients
+        with self.assertRaises(RuntimeError):
+            self.server.serve_forever('127.0.0.1:0')
+        with mock.patch.object(config.hmmer, 'server_authkey', None):
+            with self.assertRaises(RuntimeError):
+                find_domains(globins[:1], address='127.0.0.1:1')
@@ -1,11 +1,22 @@
-from unittest import TestCase
-from importlib.resources import read_text
+import os
+import tempfile
+from unittest import TestCase, mock
+from importlib.resources import read_text, path
+from Bio.SeqRecord import SeqRecord
 
+from chimera import config
 from chimera.utils import parse_fasta
-from chimera.core.domain.hmmer import HmmerDomainFinder
+from chimera.core.domain.hmmer import HmmerDomainFinder, shard_sequences
+from chimera.core.domain.hmmerparser import hmm_metadata, parse_hmmscan_text, hmmscan_results
 
 ctcf = read_text('chimera.data.sample', 'ctcf.fa')
 ctcf = parse_fasta(ctcf)[0]
+globins = parse_fasta(read_text('chimera.data.sample', 'globins45.fa'))
+
+# Output of 'hmmscan' (HMMER 3.4) for the first 2 globins and a 'pp_target' sequence, against a database of the sample
+# globins4 HMM and a 'prolines' HMM (built from copies of MKTLLVAGSRHEWCDYFQNICKLGKWPP)
+hmmscan_results_path = os.path.join(os.path.dirname(__file__), 'hmmscan_globins_results.txt')
+pp_target = 'DEMKTLLVAGSRHEWCDYFQNICKLGKAPPQ'
 
 
 class HmmrTestCase(TestCase):
@@ -21,8 +32,118 @@ class HmmrTestCase(TestCase):
 
         top_record = results[0]
         self.assertEqual('zf-C2H2', top_record['alihmmname'])
-        # Note - Floating point values are not very accurate since we're essentially parsing Hmmer --domtblout results
-        # The corresponding web api call gives us 18.923152923584
+        # Note - Floating point values are not very accurate since hmmscan's text output reports bit scores to 1 decimal
+        # place. The corresponding web api call gives us 18.923152923584
         self.assertAlmostEqual(18.9, float(top_record['bitscore']))
         self.assertEqual(266, int(top_record['alisqfrom']))
         self.assertEqual(288, int(top_record['alisqto']))
+
+    def testShardSequences(self):
+        shards = shard_sequences(globins, 4)
+        self.assertEqual(4, len(shards))
+
+        # Every sequence is in exactly one shard, and shards retain the input order
+        indices = {s.name: i for i, s in enumerate(globins)}
+        self.assertEqual(sorted(indices), sorted(s.name for shard in shards for s in shard))
+        for shard in shards:
+            self.assertEqual(sorted(indices[s.name] for s in shard), [indices[s.name] for s in shard])
+
+        # Shards are balanced by total residue length, to within the length of the longest sequence
+        totals = [sum(len(s.seq) for s in shard) for shard in shards]
+        self.assertLessEqual(max(totals) - min(totals), max(len(s.seq) for s in globins))
+
+        # We never create empty shards
+        self.assertEqual(2, len(shard_sequences(globins[:2], 4)))
+
+    def testShardedDuplicateNames(self):
+        # Sequences sharing a name (in different shards) each get their own hits
+        sequences = [SeqRecord(s.seq, id=name, name=name) for s, name in zip(globins[:6], 'aabbaa')]
+
+        def _hmmscan(sequences, cpus=None):
+            return [[{'query_id': s.name, 'aliaseq': str(s.seq)}] for s in sequences]
+
+        with mock.patch.object(config.hmmer, 'shards', 3), mock.patch.object(config.hmmer, 'server', ''), \
+                mock.patch.object(config.hmmer, 'min_sequences_per_shard', 1), \
+                mock.patch.object(self.domain_finder, '_hmmscan', side_effect=_hmmscan) as m:
+            results = list(self.domain_finder._iter_domains(sequences))
+
+        self.assertEqual(3, m.call_count)
+        self.assertEqual([(s.name, str(s.seq)) for s in sequences], [(r['query_id'], r['aliaseq']) for r in results])
+
+    def testShardCount(self):
+        # Inputs are only sharded if each shard gets at least min_sequences_per_shard sequences
+        with mock.patch.object(config.hmmer, 'shards', 4), mock.patch.object(config.hmmer, 'server', ''), \
+                mock.patch.object(config.hmmer, 'min_sequences_per_shard', 10), \
+                mock.patch.object(self.domain_finder, '_hmmscan', return_value=[[]] * 25) as m:
+            list(self.domain_finder._iter_domains(globins[:5]))
+            self.assertEqual(1, m.call_count)
+
+            m.reset_mock()
+            m.side_effect = lambda sequences, cpus=None: [[] for _ in sequences]
+            list(self.domain_finder._iter_domains(globins[:25]))
+            self.assertEqual(3, m.call_count)
+
+    def testDatabaseVersion(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.object(config.dirs.data, 'pfam', tmp_dir):
+            # Pfam-A.hmm.dat is not required
+            with open(os.path.join(tmp_dir, 'Pfam-A.hmm'), 'w') as f:
+                f.write('HMMER3/f\n')
+            version = self.domain_finder.database_version()
+
+            # ..but is part of the version if it's there
+            with open(os.path.join(tmp_dir, 'Pfam-A.hmm.dat'), 'w') as f:
+                f.write('#=GF ID   fake\n')
+            self.assertNotEqual(version, self.domain_finder.database_version())
+
+    def testHmmMetadata(self):
+        # In the absence of a .dat file, metadata is read from the HMM headers, and HMMs without an accession (such
+        # as the sample HMM) are skipped
+        with path('chimera.data.sample', 'globins4.hmm') as hmm_path, self.assertLogs(level='WARNING'):
+            self.assertEqual({}, hmm_metadata(str(hmm_path)))
+
+
+class HmmscanParserTestCase(TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def testParse(self):
+        domains = list(parse_hmmscan_text(hmmscan_results_path))
+        self.assertEqual(['MYG_ESCGI', 'MYG_HORSE', 'pp_target'], [d.query_id for d in domains])
+        self.assertEqual(['globins4', 'globins4', 'prolines'], [d.hit_id for d in domains])
+
+        top_domain = domains[0]
+        self.assertEqual((1, 2, 149, 1, 147), (top_domain.domain_index, top_domain.hmm_from, top_domain.hmm_to,
+                                                top_domain.ali_from, top_domain.ali_to))
+        self.assertEqual(215.4, top_domain.bitscore)
+        self.assertEqual(4.3e-68, top_domain.ievalue)
+
+        # Alignments (wrapped over 2 blocks for globins) cover the aligned sequence, plus deletions (and with
+        # insertions in lowercase)
+        sequences = {s.name: str(s.seq) for s in globins[:2]}
+        sequences['pp_target'] = pp_target
+        for domain in domains:
+            self.assertEqual(sequences[domain.query_id][domain.ali_from - 1:domain.ali_to],
+                             domain.aliseq.replace('-', '').upper())
+
+    def testMatchLinePP(self):
+        # The match line of the 'prolines' alignment ends in ' PP' (a mismatch followed by 2 identical prolines),
+        # just like posterior probability lines do
+        with open(hmmscan_results_path) as f:
+            self.assertIn('               mKTLLVAGSRHEWCDYFQNICKLGK PP\n', f.read())
+        domain = list(parse_hmmscan_text(hmmscan_results_path))[-1]
+        self.assertEqual('MKTLLVAGSRHEWCDYFQNICKLGKAPP', domain.aliseq)
+
+    def testResults(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            hmm_path = os.path.join(tmp_dir, 'db.hmm')
+            with open(hmm_path + '.dat', 'w') as f:
+                f.write('#=GF ID   globins4\n#=GF AC   PF99998.1\n#=GF ML   149\n')
+                f.write('#=GF ID   prolines\n#=GF AC   PF99999.1\n#=GF ML   28\n')
+            results = list(hmmscan_results(parse_hmmscan_text(hmmscan_results_path), hmm_path))
+
+        self.assertEqual(['PF99998.1', 'PF99998.1', 'PF99999.1'], [r['alihmmacc'] for r in results])
+        self.assertEqual([149, 149, 28], [r['aliM'] for r in results])
+        self.assertEqual('MKTLLVAGSRHEWCDYFQNICKLGKAPP', results[-1]['aliaseq'])
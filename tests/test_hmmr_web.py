@@ -1,4 +1,7 @@
+import json
+import threading
 from unittest import TestCase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from importlib.resources import read_text
 
 from chimera.utils import parse_fasta
@@ -25,3 +28,72 @@ class HmmrWebTestCase(TestCase):
         self.assertAlmostEqual(18.923152923584, float(top_record['bitscore']))
         self.assertEqual(266, int(top_record['alisqfrom']))
         self.assertEqual(288, int(top_record['alisqto']))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in for the Hmmer Web hmmscan endpoint, that reports a single hit per sequence (one of them not included),
+    after failing the first request for every sequence with a 503.
+    """
+
+    def do_POST(self):
+        seq = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['seq']
+        with self.server.lock:
+            self.server.requests.append(seq)
+            first_attempt = self.server.requests.count(seq) == 1
+
+        if first_attempt:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        domain = {'alihmmacc': 'PF00001.1', 'alihmmname': 'fake', 'alisqfrom': '1', 'alisqto': str(len(seq)),
+                  'alihmmfrom': '1', 'alihmmto': str(len(seq)), 'aliM': str(len(seq)), 'bitscore': '10.5',
+                  'ievalue': '0.01', 'aliaseq': seq}
+        body = json.dumps({'results': {'hits': [
+            {'nincluded': 1, 'domains': [dict(domain, is_included=1), dict(domain, is_included=0)]}
+        ]}}).encode('utf8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HmmrWebStandInTestCase(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        url = f'http://127.0.0.1:{self.server.server_address[1]}/'
+        self.domain_finder = HmmerWebDomainFinder(url=url, max_workers=4, retries=2, backoff_factor=0.01, timeout=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testConcurrentRetries(self):
+        globins = parse_fasta(read_text('chimera.data.sample', 'globins45.fa'))[:10]
+        results = self.domain_finder.find_domains(globins)
+
+        # Results are in input order, with failed requests retried once each
+        self.assertEqual([s.name for s in globins], [r['query_id'] for r in results])
+        self.assertEqual(20, len(self.server.requests))
+        self.assertEqual([str(s.seq) for s in globins], [r['aliaseq'] for r in results])
+
+    def testRetriesExhausted(self):
+        self.domain_finder.retries = 0
+        with self.assertRaises(RuntimeError):
+            self.domain_finder.find_domains(parse_fasta(read_text('chimera.data.sample', 'globins45.fa'))[:1])
+
+    def testSharedSession(self):
+        # Finders are typically built per query, but share pooled connections within a process
+        finder = HmmerWebDomainFinder(url=self.domain_finder.url, max_workers=4)
+        self.assertIs(self.domain_finder.session, finder.session)
+        self.assertIsNot(self.domain_finder.session, HmmerWebDomainFinder(max_workers=2).session)
@@ -0,0 +1,72 @@
+import os
+import json
+import tempfile
+from unittest import TestCase, mock
+import pandas as pd
+import plotly
+
+import chimera
+from chimera.core.binding import BindingFrequencyArray
+from chimera.plots import binding_freq_plot_data_domain
+from chimera.plots.cache import PlotCache
+
+
+class PlotCacheTestCase(TestCase):
+    def setUp(self):
+        self.df_dl_dsprint = pd.DataFrame({
+            'pfam_id': ['PF00001_A', 'PF00001_A', 'PF00002_B'],
+            'domain_length': [3, 3, 2],
+            'ligand_type': ['ion', 'sm', 'dna'],
+            'binding_frequencies': ['0.1,0.2,0.3', '0.5,0,0', '1,0.25']
+        })
+        # Module-level data attributes are swapped for the duration of each test
+        self.patcher = mock.patch.dict(chimera.__dict__, {
+            'df_dl_dsprint': self.df_dl_dsprint,
+            'dsprint_pfam_ids': pd.unique(self.df_dl_dsprint['pfam_id']),
+            'dsprint_binding_frequencies': BindingFrequencyArray(self.df_dl_dsprint['binding_frequencies'])
+        })
+        self.patcher.start()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'plots.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        self.patcher.stop()
+
+    def testPayload(self):
+        etag, payload = PlotCache().get('dsprint', 'PF00001_A')
+        expected = json.dumps(binding_freq_plot_data_domain('PF00001_A', algorithm='dsprint'),
+                              cls=plotly.utils.PlotlyJSONEncoder)
+        self.assertEqual(expected, payload)
+        self.assertEqual(['ion', 'sm'], [trace['name'] for trace in json.loads(payload)['data']])
+
+        # ETags identify payloads
+        self.assertEqual(etag, PlotCache().get('dsprint', 'PF00001_A')[0])
+        self.assertNotEqual(etag, PlotCache().get('dsprint', 'PF00002_B')[0])
+
+    def testBuild(self):
+        cache = PlotCache(self.db_path)
+        self.assertEqual(2, cache.build('dsprint'))
+        expected = PlotCache().get('dsprint', 'PF00002_B')
+
+        # Payloads are persisted, and not rebuilt by other caches on the same database
+        with mock.patch.object(PlotCache, '_build', side_effect=AssertionError):
+            self.assertEqual(expected, PlotCache(self.db_path).get('dsprint', 'PF00002_B'))
+
+    def testInvalidation(self):
+        cache = PlotCache(self.db_path)
+        etag, _ = cache.get('dsprint', 'PF00002_B')
+
+        # Payloads built from other versions of the data are rebuilt
+        df_dl_dsprint = self.df_dl_dsprint.copy()
+        df_dl_dsprint.loc[2, 'binding_frequencies'] = '0.5,0.25'
+        with mock.patch.dict(chimera.__dict__, {
+            'df_dl_dsprint': df_dl_dsprint,
+            'dsprint_binding_frequencies': BindingFrequencyArray(df_dl_dsprint['binding_frequencies'])
+        }):
+            new_etag, payload = cache.get('dsprint', 'PF00002_B')
+            self.assertNotEqual(etag, new_etag)
+            self.assertEqual([0.5, 0.25], json.loads(payload)['data'][0]['y'])
+            self.assertEqual((new_etag, payload), PlotCache(self.db_path).get('dsprint', 'PF00002_B'))
+
+        self.assertEqual(etag, cache.get('dsprint', 'PF00002_B')[0])
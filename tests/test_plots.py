@@ -0,0 +1,46 @@
+import json
+from unittest import TestCase
+import pandas as pd
+import plotly
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from chimera.plots import binding_freq_plot_data_sequence, binding_freq_plot_data_sequences
+
+
+class PlotsTestCase(TestCase):
+    def setUp(self):
+        self.sequences = [SeqRecord(Seq('MKV' * 10), id=name, name=name) for name in ('seq1', 'seq2', 'seq3')]
+        self.domain_df = pd.DataFrame({
+            'query_id': pd.Categorical(['seq1', 'seq2', 'seq1']),
+            'pfam_domain': pd.Categorical(['PF00001_A', 'PF00002_B', 'PF00002_B']),
+            'target_start': [1, 5, 10],
+            'target_end': [8, 20, 25]
+        })
+        self.df = pd.DataFrame({
+            'query_id': pd.Categorical(['seq1', 'seq1', 'seq2', 'seq2']),
+            'seq_i': [2, 3, 3, 6],
+            'ligand_type': ['ion', 'sm', 'ion', 'ion'],
+            'binding_frequency': [0.5, 0.25, 0.75, 0.1]
+        })
+
+    def tearDown(self):
+        pass
+
+    def testPlotDataSequences(self):
+        actual = binding_freq_plot_data_sequences(self.sequences, self.domain_df, self.df)
+        self.assertEqual(3, len(actual))
+
+        for sequence, data in zip(self.sequences, actual):
+            expected = binding_freq_plot_data_sequence(
+                str(sequence.seq),
+                self.domain_df[self.domain_df.query_id == sequence.name],
+                self.df[self.df.query_id == sequence.name]
+            )
+            self.assertEqual(json.dumps(expected, cls=plotly.utils.PlotlyJSONEncoder),
+                             json.dumps(data, cls=plotly.utils.PlotlyJSONEncoder))
+
+        # Each sequence's plot only has its own domains and binding frequencies
+        self.assertEqual(2, sum(trace.type == 'box' for trace in actual[0]['data']))
+        self.assertEqual([0, 0, 0.75, 0, 0, 0.1], list(actual[1]['data'][0].y[:6]))
+        self.assertEqual([], actual[2]['data'])
@@ -0,0 +1,64 @@
+import os
+import shutil
+from importlib.resources import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+import chimera.data.sample.ligand
+import chimera.data.sample.receptor
+import numpy as np
+from chimera.distance.structure import receptor_structure, ligand_structure, StructureCache
+
+
+class StructureTestCase(TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def testReceptorStructure(self):
+        with path(chimera.data.sample.receptor, '2lueA.pdb') as receptor_path:
+            receptor = receptor_structure(receptor_path)
+            receptor_with_backbone = receptor_structure(receptor_path, include_backbone=True)
+
+        self.assertEqual(len(receptor.residue_numbers), len(set(receptor.residue_numbers)))
+        self.assertEqual('M', receptor.residue_values[receptor.residue_numbers == 3][0])
+        self.assertEqual(505, len(receptor.atom_coords))
+        self.assertGreater(len(receptor_with_backbone.atom_coords), len(receptor.atom_coords))
+
+        # Atoms are grouped by residue, and sorted by coordinates within each residue
+        residue_numbers = receptor.atom_residue_numbers
+        self.assertEqual(len(set(residue_numbers)), 1 + np.count_nonzero(np.diff(residue_numbers)))
+        for residue_number in set(residue_numbers):
+            coords = [tuple(c) for c in receptor.atom_coords[residue_numbers == residue_number]]
+            self.assertEqual(sorted(coords), coords)
+
+    def testLigandStructure(self):
+        with path(chimera.data.sample.ligand, '2lue_III_B_1.pdb') as ligand_path:
+            ligand = ligand_structure(ligand_path, 'III')
+
+        self.assertEqual((147, 3), ligand.atom_coords.shape)
+        self.assertEqual({'III'}, set(ligand.atom_types))
+        self.assertNotIn('H', set(ligand.atom_elements))
+
+    def testStructureCache(self):
+        with TemporaryDirectory() as tmp_dir, path(chimera.data.sample.receptor, '2lueA.pdb') as receptor_path:
+            receptor_path = shutil.copy(receptor_path, tmp_dir)
+            cache_dir = os.path.join(tmp_dir, 'structures')
+            expected = receptor_structure(receptor_path)
+
+            cache = StructureCache(path=cache_dir)
+            receptor = cache.receptor(receptor_path)
+            self.assertIs(receptor, cache.receptor(receptor_path))
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+            # A new cache reads persisted structures
+            receptor = StructureCache(path=cache_dir).receptor(receptor_path)
+            for field in receptor._fields:
+                np.testing.assert_array_equal(getattr(expected, field), getattr(receptor, field))
+
+            # Structures are extracted again for different parameters, or if the file changes
+            cache.receptor(receptor_path, include_backbone=True)
+            os.utime(receptor_path, ns=(0, 0))
+            cache.receptor(receptor_path)
+            self.assertEqual(3, len(os.listdir(cache_dir)))
@@ -1,5 +1,6 @@
 from unittest import TestCase
-from chimera.utils import vdw_radius
+import numpy as np
+from chimera.utils import vdw_radius, vdw_radii
 
 
 class VDWTestCase(TestCase):
@@ -24,3 +25,11 @@ class VDWTestCase(TestCase):
     def testVDWFr(self):
         # missing ionic_radius and vdw_radius
         self.assertEqual(1.5, vdw_radius('Fr'))
+
+    def testVDWRadii(self):
+        elements = ['H', 'Cl', 'CA', 'fr', 'H']
+        np.testing.assert_array_equal([vdw_radius(element) for element in elements], vdw_radii(elements))
+
+    def testVDWRadiiUnknown(self):
+        with self.assertRaises(RuntimeError):
+            vdw_radii(['H', 'Xx'])
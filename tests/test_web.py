@@ -0,0 +1,194 @@
+import io
+import os
+import json
+from unittest import TestCase, mock
+from importlib.resources import read_text
+import pandas as pd
+
+import chimera
+from chimera.core.binding import BindingFrequencyArray
+from chimera.core.domain.hmmerweb import HmmerWebDomainFinder
+
+# Importing chimera.tasks enables events on the configured Celery broker, which is not available in tests
+with mock.patch('celery.app.control.Control.enable_events'):
+    from chimera.tasks import query, DOMAIN_COLUMNS
+    from chimera.flask import create_app
+
+ctcf = read_text('chimera.data.sample', 'ctcf.fa')
+
+# A Hmmer Web response for CTCF
+with open(os.path.join(os.path.dirname(__file__), 'hmmr_ctcf_results.json')) as f:
+    ctcf_response = json.load(f)
+
+
+def _query(**kwargs):
+    # Run an interactive query eagerly (i.e. in-process, without a worker), with a recorded Hmmer Web response
+    with mock.patch.object(HmmerWebDomainFinder, '_post', return_value=ctcf_response):
+        return query.apply(kwargs=dict(dict(seq_text=ctcf, algorithm='interacdome', domain_algorithm='hmmerweb',
+                                            interactive=True), **kwargs))
+
+
+def _result(state, result=None):
+    # Patch in a stand-in for an AsyncResult of a job in a given state
+    async_result = mock.Mock(id='job1', state=state, result=result)
+    async_result.ready.return_value = state in ('SUCCESS', 'FAILURE')
+    async_result.failed.return_value = state == 'FAILURE'
+    async_result.successful.return_value = state == 'SUCCESS'
+    return mock.patch.object(query, 'AsyncResult', return_value=async_result)
+
+
+class InteractiveQueryTestCase(TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def testInteractiveQuery(self):
+        results = _query().get()
+
+        # Results are JSON-serializable, for the Celery result backend
+        self.assertEqual(results, json.loads(json.dumps(results)))
+
+        self.assertEqual(7, results['n_hits'])
+        self.assertEqual(7, len(results['domains']))
+        self.assertEqual(DOMAIN_COLUMNS, list(results['domains'][0]))
+        self.assertEqual('ctcf', results['domains'][0]['query_id'])
+        self.assertEqual('18.923153', results['domains'][0]['bit_score'])
+
+        # A single plot for the single sequence
+        self.assertEqual(1, len(results['data_plotly']))
+        self.assertIn('data', results['data_plotly'][0])
+        self.assertEqual(8, len(results['results_csv'].splitlines()))
+
+
+class JobTestCase(TestCase):
+    def setUp(self):
+        self.client = create_app().test_client()
+        self.results = _query().get()
+
+    def tearDown(self):
+        pass
+
+    def testPending(self):
+        with _result('STARTED'):
+            response = self.client.get('/job/job1/result')
+            self.assertEqual(202, response.status_code)
+            self.assertEqual({'job_id': 'job1', 'state': 'STARTED', 'ready': False}, response.get_json())
+
+            self.assertEqual(200, self.client.get('/job/job1').status_code)
+            self.assertEqual(404, self.client.get('/seq_results/job1').status_code)
+
+    def testFailure(self):
+        with _result('FAILURE', RuntimeError('Hmmscan execution failed at /secret/path')):
+            response = self.client.get('/job/job1/result')
+            self.assertEqual(500, response.status_code)
+            # Worker errors are not exposed
+            self.assertNotIn('/secret/path', response.get_data(as_text=True))
+            self.assertIn('error', response.get_json())
+
+            self.assertNotIn('/secret/path', self.client.get('/job/job1').get_data(as_text=True))
+
+    def testNotInteractive(self):
+        # Results of (silent) email jobs are not available on the site
+        with _result('SUCCESS', None):
+            self.assertEqual(404, self.client.get('/job/job1/result').status_code)
+            self.assertEqual(404, self.client.get('/seq_results/job1').status_code)
+
+    def testSuccess(self):
+        with _result('SUCCESS', self.results):
+            response = self.client.get('/job/job1/result')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual({k: self.results[k] for k in ('n_hits', 'domains', 'data_plotly')}, response.get_json())
+
+            response = self.client.get('/seq_results/job1')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('text/csv', response.mimetype)
+            self.assertEqual('attachment; filename=results.csv', response.headers['Content-Disposition'])
+            self.assertEqual(self.results['results_csv'], response.get_data(as_text=True))
+
+
+class MarkupTestCase(TestCase):
+    def setUp(self):
+        self.client = create_app().test_client()
+        # A FASTA header with (space-free) markup in it, which ends up as the query id of every domain hit
+        self.query_id = 'x<img/src=x/onerror=alert(1)>'
+        self.seq_text = ctcf.replace('>ctcf', '>' + self.query_id, 1)
+
+    def tearDown(self):
+        pass
+
+    def testResults(self):
+        results = _query(seq_text=self.seq_text).get()
+        self.assertEqual(self.query_id, results['domains'][0]['query_id'])
+
+        # Results are served as data, and only ever rendered as text by the page
+        with _result('SUCCESS', results):
+            response = self.client.get('/job/job1/result')
+        self.assertEqual('application/json', response.mimetype)
+        self.assertEqual(self.query_id, response.get_json()['domains'][0]['query_id'])
+
+    def testIndex(self):
+        with mock.patch.object(query, 'delay', return_value=mock.Mock(id='job1')):
+            response = self.client.post('/', data={
+                'seqFile': (io.BytesIO(b''), ''),
+                'seqTextArea': self.seq_text,
+                'algorithm0Select': 'hmmerweb',
+                'algorithm1Select': 'interacdome',
+                'emailaddress': ''
+            }, content_type='multipart/form-data')
+        self.assertEqual(200, response.status_code)
+
+        page = response.get_data(as_text=True)
+        self.assertNotIn(self.query_id, page)
+        self.assertIn('x&lt;img/src=x/onerror=alert(1)&gt;', page)
+        # Cells of the results table are rendered as text, rather than as HTML
+        self.assertIn('"render": $.fn.dataTable.render.text()', page)
+
+
+class PlotDataTestCase(TestCase):
+    def setUp(self):
+        df_dl_dsprint = pd.DataFrame({
+            'pfam_id': ['PF00001_A', 'PF00001_A'],
+            'domain_length': [3, 3],
+            'ligand_type': ['ion', 'sm'],
+            'binding_frequencies': ['0.1,0.2,0.3', '0.5,0,0']
+        })
+        # Module-level data attributes are swapped for the duration of each test
+        self.patcher = mock.patch.dict(chimera.__dict__, {
+            'df_dl_dsprint': df_dl_dsprint,
+            'dsprint_pfam_ids': pd.unique(df_dl_dsprint['pfam_id']),
+            'dsprint_pfam_id_set': frozenset(df_dl_dsprint['pfam_id']),
+            'dsprint_binding_frequencies': BindingFrequencyArray(df_dl_dsprint['binding_frequencies'])
+        })
+        self.patcher.start()
+        self.client = create_app().test_client()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def testPlotData(self):
+        response = self.client.get('/plot_data/dsprint/PF00001_A')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/json', response.mimetype)
+        self.assertEqual(['ion', 'sm'], [trace['name'] for trace in response.get_json()['data']])
+        etag = response.headers['ETag']
+        self.assertTrue(etag)
+
+        # Clients with an up-to-date payload are told so, without being sent the payload again
+        response = self.client.get('/plot_data/dsprint/PF00001_A', headers={'If-None-Match': etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.data)
+
+        response = self.client.get('/plot_data/dsprint/PF00001_A', headers={'If-None-Match': '"stale"'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(etag, response.headers['ETag'])
+
+    def testMembership(self):
+        # Requested pfam ids are checked against a set, rather than scanned for in the (ordered) array of pfam ids
+        with mock.patch.dict(chimera.__dict__, {'dsprint_pfam_ids': None}):
+            self.assertEqual(200, self.client.get('/plot_data/dsprint/PF00001_A').status_code)
+
+    def testNotFound(self):
+        self.assertEqual(404, self.client.get('/plot_data/dsprint/PF99999_Unknown').status_code)
+        self.assertEqual(404, self.client.get('/plot_data/unknown/PF00001_A').status_code)